@@ -0,0 +1,334 @@
+"""
+Batching sink: many results per upload instead of one.
+
+Results are appended, one JSON document per line (NDJSON), to a batch
+file under /tmp that survives warm invocations. Each line is written as
+its own gzip member; concatenated members are a valid gzip stream, so
+the batch is always a ready to ship .ndjson.gz without recompressing.
+
+A batch is flushed once it reaches max_bytes (compressed), max_count
+results or max_age seconds, whichever comes first. Age is only checked
+when results are added, i.e. on the next invocation: nothing runs
+between invocations, so the results in the open batch are lost if the
+container is reclaimed before then, up to max_count results or max_age
+seconds' worth. Callers that can't lose them should flush() before
+returning, at the cost of an upload per invocation. Flushing ships the
+batch to the API batch endpoint, or failing that to S3: a single PUT,
+or a multipart upload for large batches, followed by a manifest object
+describing it. Batches that fail to ship stay in the batch directory
+and are retried on the next flush.
+
+Results added with a tag have it listed in a <batch>.tags sidecar, and
+handed to on_delivered in order once their batch is shipped.
+
+A fan-out run can use a BatchSink directly: add() every result, then
+flush().
+"""
+import json
+import os
+import threading
+import time
+import zlib
+from os import getenv
+
+from profilers import json_stream
+
+BATCH_DIR = '/tmp/profiler-batches'
+API_BATCH_URL = 'https://serverless-observatory.threatresponse.cloud/api/profile/batch'
+
+MAX_BYTES = 5 * 1024 * 1024
+MAX_COUNT = 1000
+MAX_AGE = 300.0
+
+## S3 requires parts of at least 5MiB, except the last. A batch is
+## closed once it reaches MAX_BYTES, so one closed by size goes up in
+## parts.
+MULTIPART_THRESHOLD = MAX_BYTES
+PART_SIZE = 5 * 1024 * 1024
+
+OPEN_SUFFIX = '.open.ndjson.gz'
+READY_SUFFIX = '.ndjson.gz'
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def gzip_member(data):
+    """`data` as one complete gzip member."""
+    c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress(data) + c.flush()
+
+
+def ndjson_line(res):
+    line = json_stream.dumps(res)
+    if not isinstance(line, bytes):
+        line = line.encode('utf-8')
+    return line + b'\n'
+
+
+def _new_batch_id():
+    import uuid
+    return '{}-{}'.format(int(time.time() * 1000), uuid.uuid4().hex[:8])
+
+
+def _created(batch_id):
+    try:
+        return int(batch_id.split('-', 1)[0]) / 1000.0
+    except ValueError:
+        return time.time()
+
+
+def read_batch(path):
+    """The results in a batch file, for tests and consumers."""
+    import gzip
+    with gzip.open(path, 'rb') as f:
+        return [json.loads(line.decode('utf-8')) for line in f if line.strip()]
+
+
+class BatchSink(object):
+
+    """Collects results into NDJSON batches and ships them."""
+
+    def __init__(self, batch_dir=BATCH_DIR, max_bytes=MAX_BYTES,
+                 max_count=MAX_COUNT, max_age=MAX_AGE,
+                 multipart_threshold=MULTIPART_THRESHOLD, part_size=PART_SIZE,
+                 on_delivered=None):
+        self.batch_dir = batch_dir
+        self.max_bytes = max_bytes
+        self.max_count = max_count
+        self.max_age = max_age
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.on_delivered = on_delivered
+
+        self.batch_id = None
+        self.count = 0
+        self.size = 0
+        self.flushed = 0
+        self._lock = threading.Lock()
+        self._resume()
+
+    def _path(self, batch_id, suffix):
+        return os.path.join(self.batch_dir, batch_id + suffix)
+
+    def _resume(self):
+        """Pick up the open batches left by earlier processes.
+
+        Two processes in one container can each leave an open batch.
+        The newest stays open; older ones are closed, to ship with the
+        next flush.
+        """
+        try:
+            names = sorted(os.listdir(self.batch_dir))
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(OPEN_SUFFIX):
+                continue
+            if self.batch_id is not None:
+                self._close()
+            self.batch_id = name[:-len(OPEN_SUFFIX)]
+            path = self._path(self.batch_id, OPEN_SUFFIX)
+            self.size = os.path.getsize(path)
+            try:
+                self.count = len(read_batch(path))
+            except (IOError, OSError, ValueError, EOFError):
+                ## A torn write; ship what's there as a single entry.
+                self.count = 1
+
+    def ready(self):
+        """Closed batches waiting to be shipped, oldest first."""
+        try:
+            names = os.listdir(self.batch_dir)
+        except OSError:
+            return []
+        return sorted(n[:-len(READY_SUFFIX)] for n in names
+                      if n.endswith(READY_SUFFIX) and not n.endswith(OPEN_SUFFIX))
+
+    def due(self, now=None):
+        if self.batch_id is None:
+            return False
+        now = time.time() if now is None else now
+        return (self.size >= self.max_bytes or self.count >= self.max_count or
+                now - _created(self.batch_id) >= self.max_age)
+
+    def add(self, res, tag=None):
+        """Append `res` to the open batch; flush when the batch is due.
+
+        Returns the manifests of any batches shipped.
+        """
+        member = gzip_member(ndjson_line(res))
+        with self._lock:
+            if self.batch_id is not None and self.due():
+                self._close()
+            if self.batch_id is None:
+                if not os.path.isdir(self.batch_dir):
+                    os.makedirs(self.batch_dir)
+                self.batch_id = _new_batch_id()
+            with open(self._path(self.batch_id, OPEN_SUFFIX), 'ab') as f:
+                f.write(member)
+            if tag:
+                with open(self._path(self.batch_id, '.tags'), 'a') as f:
+                    f.write(tag + '\n')
+            self.count += 1
+            self.size += len(member)
+            if not self.due():
+                return []
+            self._close()
+        return self.ship()
+
+    def _close(self):
+        os.rename(self._path(self.batch_id, OPEN_SUFFIX),
+                  self._path(self.batch_id, READY_SUFFIX))
+        ## The line count travels with the batch in a small sidecar.
+        with open(self._path(self.batch_id, '.count'), 'w') as f:
+            f.write(str(self.count))
+        self.batch_id = None
+        self.count = 0
+        self.size = 0
+
+    def flush(self):
+        """Close the open batch and ship everything that is ready."""
+        with self._lock:
+            if self.batch_id is not None:
+                self._close()
+        return self.ship()
+
+    def _count(self, batch_id):
+        try:
+            with open(self._path(batch_id, '.count')) as f:
+                return int(f.read())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def ship(self):
+        """Ship ready batches oldest first, stopping at the first failure."""
+        manifests = []
+        for batch_id in self.ready():
+            manifest = self.ship_batch(batch_id)
+            if manifest is None:
+                break
+            self._delivered(batch_id)
+            for suffix in (READY_SUFFIX, '.count', '.tags'):
+                try:
+                    os.remove(self._path(batch_id, suffix))
+                except OSError:
+                    pass
+            self.flushed += 1
+            manifests.append(manifest)
+        return manifests
+
+    def _delivered(self, batch_id):
+        if self.on_delivered is None:
+            return
+        try:
+            with open(self._path(batch_id, '.tags')) as f:
+                tags = f.read().split()
+        except (IOError, OSError):
+            return
+        for tag in tags:
+            try:
+                self.on_delivered(tag)
+            except Exception:
+                pass
+
+    def manifest(self, batch_id):
+        import hashlib
+        path = self._path(batch_id, READY_SUFFIX)
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return {
+            'batch_id': batch_id,
+            'format': 'ndjson',
+            'compression': 'gzip',
+            'count': self._count(batch_id),
+            'bytes': os.path.getsize(path),
+            'sha256': digest.hexdigest(),
+            'created': _created(batch_id),
+            'flushed': time.time(),
+        }
+
+    def ship_batch(self, batch_id):
+        """Ship one batch: API batch endpoint, then S3. None on failure."""
+        manifest = self.manifest(batch_id)
+        path = self._path(batch_id, READY_SUFFIX)
+
+        if getenv('observatory_api_key', None) is not None:
+            from store_results import post_compressed
+            try:
+                with open(path, 'rb') as f:
+                    post_compressed(f.read(),
+                                    url=getenv('observatory_api_batch_url', API_BATCH_URL),
+                                    content_type='application/x-ndjson')
+                manifest['sink'] = 'api'
+                return manifest
+            except Exception:
+                pass
+
+        if getenv('observatory-results-bucket', None) is not None:
+            try:
+                manifest['key'] = self.put_s3(path, batch_id, manifest)
+                manifest['sink'] = 's3'
+                return manifest
+            except Exception:
+                pass
+        return None
+
+    def put_s3(self, path, batch_id, manifest):
+        """Upload the batch and then its manifest; returns the batch key."""
+        from profilers.aws import clients
+        s3 = clients.client('s3')
+        bucket = getenv('observatory-results-bucket')
+        key = 'batches/{}{}'.format(batch_id, READY_SUFFIX)
+
+        if manifest['bytes'] < self.multipart_threshold:
+            with open(path, 'rb') as f:
+                s3.put_object(Bucket=bucket, Key=key, Body=f)
+        else:
+            self._put_multipart(s3, bucket, key, path)
+
+        manifest = dict(manifest, key=key)
+        s3.put_object(Bucket=bucket, Key='batches/{}.manifest.json'.format(batch_id),
+                      Body=json.dumps(manifest).encode('utf-8'),
+                      ContentType='application/json')
+        return key
+
+    def _put_multipart(self, s3, bucket, key, path):
+        upload = s3.create_multipart_upload(Bucket=bucket, Key=key)
+        parts = []
+        try:
+            with open(path, 'rb') as f:
+                for number, block in enumerate(iter(lambda: f.read(self.part_size), b''), 1):
+                    part = s3.upload_part(Bucket=bucket, Key=key, PartNumber=number,
+                                          UploadId=upload['UploadId'], Body=block)
+                    parts.append({'PartNumber': number, 'ETag': part['ETag']})
+            s3.complete_multipart_upload(Bucket=bucket, Key=key,
+                                         UploadId=upload['UploadId'],
+                                         MultipartUpload={'Parts': parts})
+        except Exception:
+            s3.abort_multipart_upload(Bucket=bucket, Key=key,
+                                      UploadId=upload['UploadId'])
+            raise
+
+    def stats(self):
+        return {
+            'open_count': self.count,
+            'open_bytes': self.size,
+            'open_age': round(time.time() - _created(self.batch_id), 3) if self.batch_id else None,
+            'ready': len(self.ready()),
+            'flushed': self.flushed,
+        }
+
+
+def shared_sink():
+    """The process wide BatchSink, configured from PROFILER_BATCH_*."""
+    with _shared_lock:
+        if 'sink' not in _shared:
+            _shared['sink'] = BatchSink(
+                getenv('PROFILER_BATCH_DIR', BATCH_DIR),
+                max_bytes=int(getenv('PROFILER_BATCH_MAX_BYTES', MAX_BYTES)),
+                max_count=int(getenv('PROFILER_BATCH_MAX_COUNT', MAX_COUNT)),
+                max_age=float(getenv('PROFILER_BATCH_MAX_AGE', MAX_AGE)))
+        return _shared['sink']
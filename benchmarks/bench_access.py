@@ -0,0 +1,72 @@
+"""
+Compare the octal-list permission checks with AccessEvaluator.
+
+Usage: `python -m benchmarks.bench_access [entries]`
+
+Evaluates read/write/execute for a synthetic tree of stat results
+(100k entries by default) with random modes and owners. The octal-list
+path is what the walk did per directory before: three separate
+check_octals_in_stat calls with list membership and a linear group scan.
+"""
+import os
+import random
+import sys
+import time
+
+from profilers.posix_permissions import AccessEvaluator, PosixPermissions
+
+
+def synthetic_stats(n, uid, groups):
+    rng = random.Random(42)
+    owners = [uid, uid + 1, uid + 2]
+    gids = list(groups)[:2] + [65534, 65533]
+    stats = []
+    for _ in range(n):
+        mode = 0o040000 | rng.randint(0, 0o777)
+        ## mode, ino, dev, nlink, uid, gid, size, atime, mtime, ctime
+        stats.append(os.stat_result((mode, 0, 0, 1, rng.choice(owners),
+                                     rng.choice(gids), 0, 0, 0, 0)))
+    return stats
+
+
+def octal_lists(permissions, stats):
+    for st in stats:
+        (permissions.check_octals_in_stat(st, permissions._octal_is_readable),
+         permissions.check_octals_in_stat(st, permissions._octal_is_writable),
+         permissions.check_octals_in_stat(st, permissions._octal_is_executable))
+
+
+def masks(evaluator, stats):
+    for st in stats:
+        evaluator(st)
+
+
+def timed(fn, *args):
+    start = time.time()
+    fn(*args)
+    return time.time() - start
+
+
+def main(n=100000):
+    permissions = PosixPermissions()
+    ## A few supplementary groups, like a typical container user.
+    permissions.my_groups = list(permissions.my_groups) + list(range(1000, 1010))
+    evaluator = AccessEvaluator(permissions.my_uid, permissions.my_groups)
+    stats = synthetic_stats(n, permissions.my_uid, permissions.my_groups)
+
+    for st in stats[:1000]:
+        assert evaluator(st) == (
+            permissions.check_octals_in_stat(st, permissions._octal_is_readable),
+            permissions.check_octals_in_stat(st, permissions._octal_is_writable),
+            permissions.check_octals_in_stat(st, permissions._octal_is_executable))
+
+    legacy = timed(octal_lists, permissions, stats)
+    mask = timed(masks, evaluator, stats)
+
+    print("{} entries".format(n))
+    print("{:<12} {:>10.3f} s".format("octal lists", legacy))
+    print("{:<12} {:>10.3f} s  ({:.1f}x)".format("masks", mask, legacy / mask))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,86 @@
+"""
+Compare whole-string compression with the streaming compressors.
+
+Usage: `python -m benchmarks.bench_compression [repeat]`
+
+For every sample/*.json (repeated `repeat` times into one result, 20 by
+default, so the sizes look like a large profile) reports the compressed
+size, CPU time and peak memory of: the old approach (serialize the whole
+result, then gzip it through GzipFile) and iter_compressed with every
+codec installed here. Peak memory comes from tracemalloc on Python 3 and
+is only reported there.
+"""
+import glob
+import gzip
+import json
+import os
+import sys
+import time
+from io import BytesIO
+
+from profilers import json_stream
+import store_results
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+## CPU time of this process; time.clock on Python 2.
+cpu_time = getattr(time, 'process_time', None) or time.clock
+
+
+def whole_string(res):
+    data = json_stream.dumps(res).encode('utf-8')
+    out = BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb') as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def streaming(codec):
+    def compress(res):
+        return store_results.compress_results(res, codec)
+    return compress
+
+
+def measure(fn, res):
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = cpu_time()
+    data = fn(res)
+    cpu = cpu_time() - start
+    peak = None
+    if tracemalloc is not None:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return len(data), cpu, peak
+
+
+def main(repeat=20):
+    methods = [('whole string', whole_string)]
+    for codec in store_results.available_codecs():
+        methods.append(('stream ' + codec, streaming(codec)))
+
+    for path in sorted(glob.glob(os.path.join(ROOT, 'sample', '*.json'))):
+        with open(path) as f:
+            try:
+                sample = json.load(f)
+            except ValueError:
+                ## hookio.json is a python repr, not JSON.
+                continue
+        res = dict(('copy{}'.format(i), sample) for i in range(repeat))
+        raw = len(json_stream.dumps(res).encode('utf-8'))
+
+        print("{} x{}: {} bytes".format(os.path.basename(path), repeat, raw))
+        for name, fn in methods:
+            size, cpu, peak = measure(fn, res)
+            print("  {:<14} {:>9} bytes {:>8.3f} s cpu {:>12}".format(
+                name, size, cpu,
+                '-' if peak is None else '{} peak'.format(peak)))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
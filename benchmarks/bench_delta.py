@@ -0,0 +1,71 @@
+"""
+Bytes on the wire for full results versus deltas.
+
+Usage: `python -m benchmarks.bench_delta [invocations]`
+
+Replays sample/output.json as `invocations` (10 by default) warm
+invocations of one container, changing what really changes between
+them (timestamp, warm_for, is_warm), and compares the payloads of full
+and delta delivery, raw and gzipped. Strings are replaced whole, so a
+kernel log that grew between invocations would be shipped again in full.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import zlib
+
+import delta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def invocations(sample, n):
+    for i in range(n):
+        doc = dict(sample)
+        doc['timestamp'] = sample['timestamp'] + 60 * i
+        doc['warm_for'] = str(60 * i)
+        doc['is_warm'] = 'warm' if i else 'not warm'
+        yield doc
+
+
+def wire(payload):
+    raw = json.dumps(payload).encode('utf-8')
+    return len(raw), len(zlib.compress(raw, 6))
+
+
+def main(n=10):
+    with open(os.path.join(ROOT, 'sample', 'output.json')) as f:
+        sample = json.load(f)
+
+    state_dir = tempfile.mkdtemp()
+    try:
+        encoder = delta.DeltaEncoder(os.path.join(state_dir, 'delta.json'))
+        full = [0, 0]
+        diffed = [0, 0]
+        payloads = []
+        docs = list(invocations(sample, n))
+        for doc in docs:
+            for totals, payload in ((full, doc), (diffed, encoder.encode(doc))):
+                raw, gz = wire(payload)
+                totals[0] += raw
+                totals[1] += gz
+            payloads.append(payload)
+            encoder.commit()
+    finally:
+        shutil.rmtree(state_dir)
+
+    assert delta.reconstruct(payloads) == docs
+
+    print("{} invocations of sample/output.json".format(n))
+    print("{:<8} {:>10} {:>10}".format('', 'raw', 'gzip'))
+    print("{:<8} {:>10} {:>10}".format('full', full[0], full[1]))
+    print("{:<8} {:>10} {:>10}".format('delta', diffed[0], diffed[1]))
+    print("saving   {:>9.1f}% {:>9.1f}%".format(
+        100.0 * (1 - float(diffed[0]) / full[0]),
+        100.0 * (1 - float(diffed[1]) / full[1])))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,78 @@
+"""
+Compare the line by line cpuinfo/meminfo parsers with procfs's.
+
+Usage: `python -m benchmarks.bench_procinfo [repeat]`
+
+Parses the fixtures in tests/fixtures (a 96 vCPU /proc/cpuinfo and a
+/proc/meminfo) `repeat` times (500 by default) with the parsers
+get_cpuinfo and get_meminfo used to have and with procfs.parse_cpuinfo,
+dedup_cpuinfo and parse_meminfo, and reports the time per parse and
+the JSON size of the cpuinfo output.
+"""
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+from profilers import procfs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'tests', 'fixtures')
+
+
+def legacy_cpuinfo(path):
+    cpuinfo = OrderedDict()
+    procinfo = OrderedDict()
+    nprocs = 0
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                cpuinfo['proc%s' % nprocs] = procinfo
+                nprocs = nprocs+1
+                procinfo = OrderedDict()
+            else:
+                if len(line.split(':')) == 2:
+                    procinfo[
+                        line.split(':')[0].strip()
+                    ] = line.split(':')[1].strip()
+                else:
+                    procinfo[line.split(':')[0].strip()] = ''
+    return cpuinfo
+
+
+def legacy_meminfo(path):
+    meminfo = OrderedDict()
+    with open(path) as f:
+        for line in f:
+            meminfo[line.split(':')[0]] = line.split(':')[1].strip()
+    return meminfo
+
+
+def timed(fn, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        res = fn()
+    return (time.time() - start) / repeat * 1e6, res
+
+
+def main(repeat=500):
+    cpuinfo = os.path.join(FIXTURES, 'cpuinfo-96')
+    meminfo = os.path.join(FIXTURES, 'meminfo')
+
+    cases = [
+        ('cpuinfo legacy', lambda: legacy_cpuinfo(cpuinfo)),
+        ('cpuinfo', lambda: procfs.read_cpuinfo(path=cpuinfo)),
+        ('cpuinfo dedup', lambda: procfs.read_cpuinfo(dedup=True, path=cpuinfo)),
+        ('meminfo legacy', lambda: legacy_meminfo(meminfo)),
+        ('meminfo', lambda: procfs.read_meminfo(path=meminfo)),
+        ('meminfo int', lambda: procfs.read_meminfo(as_int=True, path=meminfo)),
+    ]
+    for name, fn in cases:
+        us, res = timed(fn, repeat)
+        size = len(json.dumps(res)) if name.startswith('cpuinfo') else ''
+        print("{:<16} {:>10.1f} us {:>10}".format(name, us, size))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
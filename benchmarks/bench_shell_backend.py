@@ -0,0 +1,51 @@
+"""
+Compare the shell and native collection backends of the core profile.
+
+Usage: `python -m benchmarks.bench_shell_backend [rounds]`
+
+Prints the number of shells spawned and the wall time per round for
+each backend. The native backend should spawn none.
+"""
+import os
+import sys
+import time
+
+from profilers.posix_core import PosixCoreProfiler
+from profilers.utils import spawn_count
+
+## Appends to the profiler's own source on every call.
+SKIP = ['source_editable']
+
+
+def run(backend, rounds):
+    if backend == 'shell':
+        os.environ['PROFILER_SHELL_FALLBACK'] = '1'
+    else:
+        os.environ.pop('PROFILER_SHELL_FALLBACK', None)
+
+    lookups = dict((k, v) for (k, v) in PosixCoreProfiler.lookups.items()
+                   if k not in SKIP)
+
+    spawns = spawn_count()
+    start = time.time()
+    for _ in range(rounds):
+        for fn in lookups.values():
+            try:
+                fn()
+            except Exception:
+                ## eg. no network for time_drift; not what we measure.
+                pass
+    elapsed = time.time() - start
+
+    return (spawn_count() - spawns) / float(rounds), elapsed / rounds
+
+
+def main(rounds=3):
+    print("{:<8} {:>12} {:>12}".format("backend", "forks/round", "s/round"))
+    for backend in ('shell', 'native'):
+        forks, seconds = run(backend, rounds)
+        print("{:<8} {:>12.1f} {:>12.3f}".format(backend, forks, seconds))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
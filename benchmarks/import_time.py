@@ -0,0 +1,84 @@
+"""
+Import-time harness for the lambda entry point.
+
+Usage: `python -m benchmarks.import_time [module] [budget_ms]`
+
+Imports `module` (launcher by default) in a fresh interpreter and
+reports its cumulative import time, parsed from `-X importtime`
+(Python 3.7+). Older interpreters fall back to timing the import from
+inside the child. Exits non-zero when the import takes longer than
+`budget_ms`.
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+## Generous enough for a cold page cache on a 128MB function.
+DEFAULT_BUDGET_MS = 150
+
+
+def parse_importtime(stderr):
+    """Map module name -> (self us, cumulative us) from -X importtime output."""
+    res = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            ## The header line.
+            continue
+        res[fields[2].strip()] = (self_us, cumulative_us)
+    return res
+
+
+def _run(args):
+    p = subprocess.Popen([sys.executable] + args, cwd=ROOT,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         universal_newlines=True)
+    out, err = p.communicate()
+    if p.returncode != 0:
+        raise Exception("import failed:\n" + err)
+    return out, err
+
+
+def measure(module='launcher'):
+    """Return (milliseconds to import `module`, modules it pulled in).
+
+    Python caches bytecode, so the module is imported once beforehand to
+    keep compilation out of the number, as on a deployed function.
+    """
+    _run(['-c', 'import ' + module])
+
+    if sys.version_info >= (3, 7):
+        _, err = _run(['-X', 'importtime', '-c', 'import ' + module])
+        times = parse_importtime(err)
+        return times[module][1] / 1000.0, sorted(times)
+
+    out, _ = _run(['-c',
+                   'import sys, time\n'
+                   'before = set(sys.modules)\n'
+                   'start = time.time()\n'
+                   'import ' + module + '\n'
+                   'print((time.time() - start) * 1000)\n'
+                   'print(" ".join(sorted(m for m in set(sys.modules) - before\n'
+                   '                      if sys.modules[m] is not None)))\n'])
+    elapsed, modules = out.splitlines()[:2]
+    return float(elapsed), modules.split()
+
+
+def main(module='launcher', budget_ms=DEFAULT_BUDGET_MS):
+    elapsed, modules = measure(module)
+    print("import {}: {:.1f} ms, {} modules (budget {} ms)".format(
+        module, elapsed, len(modules), budget_ms))
+    if elapsed > float(budget_ms):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:3])
@@ -0,0 +1,196 @@
+"""
+Asynchronous delivery of results, off the handler's critical path.
+
+With PROFILER_DELIVERY=async the handler only writes the gzipped
+results to a spool directory under /tmp and wakes a background thread
+that ships them with store_results.store_compressed (API, then S3).
+The handler returns without waiting for the upload.
+
+Lambda freezes the process as soon as the handler returns. An upload
+that hasn't finished by then resumes when the next invocation thaws the
+container. Anything that still fails stays spooled and is retried in
+the next drain, which ships the whole spool, oldest first, over the
+same keep-alive connection. Spooled files survive the process, so a
+new process in a warm container picks them up too.
+
+Spool files are named <enqueue time in ms>-<uuid>[.<tag>].json.gz. The
+enqueue time gives the delivery lag without reading the file. The
+optional tag is handed to on_delivered once the payload is shipped, so
+the caller learns what actually reached the receiver (see delta).
+"""
+import os
+import threading
+import time
+from os import getenv
+
+SPOOL_DIR = '/tmp/profiler-spool'
+
+## Oldest payloads are dropped beyond this many, to bound /tmp usage.
+SPOOL_MAX = 50
+
+SUFFIX = '.json.gz'
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def _tag(name):
+    tag = name[:-len(SUFFIX)].partition('.')[2]
+    return tag or None
+
+
+def _enqueued_at(name):
+    try:
+        return int(name.split('-', 1)[0]) / 1000.0
+    except ValueError:
+        return None
+
+
+class Delivery(object):
+
+    """A spool directory and the background thread that drains it."""
+
+    def __init__(self, spool_dir=SPOOL_DIR, send=None, spool_max=SPOOL_MAX,
+                 on_delivered=None):
+        if send is None:
+            from store_results import store_compressed
+            send = store_compressed
+        self.spool_dir = spool_dir
+        self.send = send
+        self.spool_max = spool_max
+        self.on_delivered = on_delivered
+
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_lag = None
+        self.max_lag = None
+
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._lock = threading.Lock()
+        self._state = threading.Lock()
+        self._thread = None
+
+    def spooled(self):
+        """Spooled file names, oldest first."""
+        try:
+            names = os.listdir(self.spool_dir)
+        except OSError:
+            return []
+        return sorted(n for n in names if n.endswith(SUFFIX))
+
+    def spool(self, res, tag=None):
+        """Write `res` to the spool and return its path."""
+        import uuid
+        from store_results import compress_results_to
+
+        if not os.path.isdir(self.spool_dir):
+            os.makedirs(self.spool_dir)
+        name = '{}-{}{}{}'.format(int(time.time() * 1000), uuid.uuid4().hex,
+                                  '.' + tag if tag else '', SUFFIX)
+        path = os.path.join(self.spool_dir, name)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            compress_results_to(res, f)
+        os.rename(tmp, path)
+
+        for old in self.spooled()[:-self.spool_max]:
+            self._remove(old)
+            self.dropped += 1
+        return path
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.spool_dir, name))
+        except OSError:
+            pass
+
+    def drain(self):
+        """Ship every spooled payload, oldest first, in one batch.
+
+        Stops at the first failure, leaving the rest for the next drain.
+        Returns the number delivered.
+        """
+        delivered = 0
+        with self._lock:
+            for name in self.spooled():
+                try:
+                    with open(os.path.join(self.spool_dir, name), 'rb') as f:
+                        body = f.read()
+                except (IOError, OSError):
+                    continue
+
+                try:
+                    response = self.send(body)
+                except Exception:
+                    response = None
+                if response is None:
+                    self.failed += 1
+                    break
+
+                self._remove(name)
+                delivered += 1
+                self.delivered += 1
+                if self.on_delivered is not None and _tag(name):
+                    try:
+                        self.on_delivered(_tag(name))
+                    except Exception:
+                        pass
+                enqueued = _enqueued_at(name)
+                if enqueued is not None:
+                    self.last_lag = time.time() - enqueued
+                    self.max_lag = max(self.max_lag or 0, self.last_lag)
+        return delivered
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            self.drain()
+            with self._state:
+                if not self._wake.is_set():
+                    self._idle.set()
+
+    def start(self):
+        """Wake the background thread, starting it on first use."""
+        with self._state:
+            self._idle.clear()
+            self._wake.set()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def deliver(self, res, tag=None):
+        """Spool `res` and ship it (and any backlog) in the background."""
+        self.spool(res, tag)
+        self.start()
+
+    def flush(self, timeout=None):
+        """Wait for the background thread to finish its current drain."""
+        return self._idle.wait(timeout)
+
+    def stats(self):
+        spooled = self.spooled()
+        oldest = _enqueued_at(spooled[0]) if spooled else None
+        return {
+            'spool_depth': len(spooled),
+            'oldest_spooled_age': round(time.time() - oldest, 3) if oldest else None,
+            'delivered': self.delivered,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'last_lag': round(self.last_lag, 3) if self.last_lag is not None else None,
+            'max_lag': round(self.max_lag, 3) if self.max_lag is not None else None,
+        }
+
+
+def shared_delivery():
+    """The process wide Delivery, spooling to PROFILER_SPOOL_DIR."""
+    with _shared_lock:
+        if 'delivery' not in _shared:
+            _shared['delivery'] = Delivery(
+                getenv('PROFILER_SPOOL_DIR', SPOOL_DIR),
+                spool_max=int(getenv('PROFILER_SPOOL_MAX', SPOOL_MAX)))
+        return _shared['delivery']
@@ -0,0 +1,228 @@
+"""
+Delta encoding of results against the last shipped result.
+
+Most of a profile (env, cpuinfo, packages, permissions, ...) is the same
+from one invocation to the next in a container. In diff mode
+(PROFILER_DELIVERY_FORMAT=delta) the first result is shipped in full,
+with its content hash in `_hash`; later ones ship only as
+
+    {"_delta": {"base": <hash of the previous result>,
+                "hash": <hash of this result>},
+     "ops": [{"op": "replace", "path": "/timestamp", "value": ...}, ...]}
+
+using JSON-Patch style add/remove/replace operations. Objects are
+diffed key by key; lists and scalars are replaced whole.
+
+The last shipped result and its hash are kept in /tmp (commit()), and
+the hash of the last result the receiver is known to have next to it
+(acknowledge()). A delta is only sent against an acknowledged base;
+otherwise the payload is a full one. Synchronous shipping acknowledges
+on commit. The async and batch sinks only enqueue, so they acknowledge
+each payload by its tag (payload_tag()) once it is delivered, in order.
+An acknowledgement whose base wasn't acknowledged first (its base was
+dropped from the spool, say) is refused, so the next payload is full.
+
+Every PROFILER_DELTA_KEYFRAME-th payload is a full one too, to bound
+the chain a reader has to replay. reconstruct() rebuilds full
+documents from a base and its delta chain.
+"""
+import copy
+import json
+import os
+from os import getenv
+
+from profilers.json_stream import is_stream
+
+STATE_FILE = '/tmp/profiler-delta.json'
+KEYFRAME = 20
+
+
+def canonical(doc):
+    return json.dumps(doc, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def content_hash(doc):
+    import hashlib
+    return hashlib.sha256(canonical(doc)).hexdigest()
+
+
+def _escape(key):
+    return key.replace('~', '~0').replace('/', '~1')
+
+
+def _unescape(token):
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def diff(base, doc, path=''):
+    """JSON-Patch style operations that turn `base` into `doc`."""
+    if isinstance(base, dict) and isinstance(doc, dict):
+        ops = []
+        for key in sorted(base):
+            if key not in doc:
+                ops.append({'op': 'remove', 'path': path + '/' + _escape(key)})
+        for key in sorted(doc):
+            child = path + '/' + _escape(key)
+            if key not in base:
+                ops.append({'op': 'add', 'path': child, 'value': doc[key]})
+            else:
+                ops.extend(diff(base[key], doc[key], child))
+        return ops
+    if base == doc and type(base) == type(doc):
+        return []
+    return [{'op': 'replace', 'path': path, 'value': doc}]
+
+
+def apply(base, ops):
+    """A copy of `base` with `ops` applied."""
+    doc = copy.deepcopy(base)
+    for op in ops:
+        tokens = [_unescape(t) for t in op['path'].split('/')[1:]]
+        if not tokens:
+            ## Replacing the whole document.
+            doc = copy.deepcopy(op['value'])
+            continue
+        parent = doc
+        for token in tokens[:-1]:
+            parent = parent[token]
+        if op['op'] == 'remove':
+            del parent[tokens[-1]]
+        elif op['op'] in ('add', 'replace'):
+            parent[tokens[-1]] = copy.deepcopy(op['value'])
+        else:
+            raise ValueError("Unsupported op: {}".format(op['op']))
+    return doc
+
+
+def is_delta(payload):
+    return isinstance(payload, dict) and '_delta' in payload
+
+
+def payload_tag(payload):
+    """'<hash>' for a full payload, '<base>.<hash>' for a delta."""
+    if is_delta(payload):
+        return '{base}.{hash}'.format(**payload['_delta'])
+    return payload['_hash']
+
+
+def reconstruct(payloads):
+    """Full documents for a full payload followed by its delta chain.
+
+    Raises ValueError when a delta doesn't apply to the document before
+    it, or the result doesn't match its hash.
+    """
+    docs = []
+    current = None
+    for payload in payloads:
+        if is_delta(payload):
+            if current is None or payload['_delta']['base'] != current[1]:
+                raise ValueError("Delta does not apply to the previous document")
+            doc = apply(current[0], payload['ops'])
+            expected = payload['_delta']['hash']
+        else:
+            doc = dict((k, v) for k, v in payload.items() if k != '_hash')
+            expected = payload.get('_hash')
+        digest = content_hash(doc)
+        if expected is not None and digest != expected:
+            raise ValueError("Reconstructed document does not match its hash")
+        current = (doc, digest)
+        docs.append(doc)
+    return docs
+
+
+class DeltaEncoder(object):
+
+    """Encodes results against the last shipped one, kept in `state_file`."""
+
+    def __init__(self, state_file=STATE_FILE, keyframe=KEYFRAME):
+        self.state_file = state_file
+        self.ack_file = state_file + '.ack'
+        self.keyframe = keyframe
+        self._pending = None
+
+    def load(self):
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+            return state['document'], state['hash'], state.get('chain', 0)
+        except (IOError, OSError, ValueError, KeyError):
+            return None, None, 0
+
+    def acknowledged(self):
+        """Hash of the last result the receiver is known to have."""
+        try:
+            with open(self.ack_file) as f:
+                return f.read().strip() or None
+        except (IOError, OSError):
+            return None
+
+    def acknowledge(self, tag):
+        """Record the payload tagged `tag` as delivered.
+
+        Refused, returning False, when it is a delta against something
+        other than the last acknowledged result.
+        """
+        base, _, digest = tag.rpartition('.')
+        if base and base != self.acknowledged():
+            return False
+        _write(self.ack_file, digest)
+        return True
+
+    def encode(self, res):
+        """The payload to ship for `res`: a delta when a base is known.
+
+        Streamed sections are materialized; call commit() once the
+        payload has been shipped or enqueued.
+        """
+        doc = dict((k, list(v) if is_stream(v) else v) for k, v in res.items())
+        ## Round trip so that tuples and the like compare as they'll be read.
+        doc = json.loads(canonical(doc).decode('utf-8'))
+        digest = content_hash(doc)
+        base, base_hash, chain = self.load()
+
+        if (base is None or chain + 1 >= self.keyframe or
+                self.acknowledged() != base_hash):
+            payload = dict(doc, _hash=digest)
+            chain = 0
+        else:
+            payload = {
+                '_delta': {'base': base_hash, 'hash': digest},
+                'ops': diff(base, doc),
+            }
+            chain += 1
+
+        self._pending = {'document': doc, 'hash': digest, 'chain': chain}
+        return payload
+
+    def commit(self, acknowledged=True):
+        """Make the last encoded result the base for the next delta.
+
+        `acknowledged` says the payload is known to be delivered; when
+        it was only enqueued, the sink acknowledges it later.
+        """
+        if self._pending is None:
+            return
+        _write(self.state_file, json.dumps(self._pending))
+        if acknowledged:
+            _write(self.ack_file, self._pending['hash'])
+        self._pending = None
+
+
+def _write(path, text):
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
+
+
+def delta_encoder():
+    return DeltaEncoder(getenv('PROFILER_DELTA_STATE', STATE_FILE),
+                        int(getenv('PROFILER_DELTA_KEYFRAME', KEYFRAME)))
+
+
+def acknowledge(tag):
+    """DeltaEncoder.acknowledge on the configured state, for the sinks."""
+    return delta_encoder().acknowledge(tag)
@@ -1,22 +1,163 @@
-import json
+import sys
+import time
+from os import getenv
 
 from store_results import store_results
+from profilers.json_stream import is_stream, write_json
 from profilers.utils import get_sandbox
 from profilers.posix_core import PosixCoreProfiler
 
+## Build the boto3 clients named in PROFILER_PREWARM_CLIENTS during lambda
+## init, which isn't billed, instead of in the first handler call.
+if getenv('PROFILER_PREWARM_CLIENTS'):
+    from profilers.aws import clients
+    clients.prewarm()
+
 ## Entrace point - handlers for different environments
 
+def get_profile_options(context):
+    """Profiler run options, from the environment and the lambda context.
+
+    PROFILER_EXECUTOR=concurrent runs the lookups on a thread pool of
+    PROFILER_MAX_WORKERS threads. The run is then bounded by the time the
+    invocation has left, minus PROFILER_BUDGET_MARGIN_MS reserved for
+    storing the results.
+
+    PROFILER_TIMINGS=1 adds per-lookup timings to the results, and
+    PROFILER_TIMINGS_TOP=N lists the N slowest lookups.
+
+    Lookups that can't change within a container are cached across warm
+    invocations unless PROFILER_CACHE=0.
+
+    PROFILER_SAMPLER=1 samples memory, load and CPU every
+    PROFILER_SAMPLE_INTERVAL_MS for the whole invocation: the handler
+    ends the sampler once the results are shipped.
+    """
+    options = {'cache': getenv('PROFILER_CACHE', '1') == '1'}
+
+    if getenv('PROFILER_SAMPLER', '0') == '1':
+        options['sample'] = True
+        options['sample_interval'] = int(getenv('PROFILER_SAMPLE_INTERVAL_MS', 50)) / 1000.0
+        options['keep_sampling'] = True
+
+    if getenv('PROFILER_TIMINGS', '0') == '1':
+        options['timings'] = True
+        options['slowest'] = int(getenv('PROFILER_TIMINGS_TOP', 5))
+
+    if getenv('PROFILER_EXECUTOR', 'serial') == 'concurrent':
+        options['concurrent'] = True
+        options['max_workers'] = int(getenv('PROFILER_MAX_WORKERS', 8))
+
+        if context is not None:
+            margin = int(getenv('PROFILER_BUDGET_MARGIN_MS', 500))
+            remaining = context.get_remaining_time_in_millis() - margin
+            options['budget'] = max(remaining, 0) / 1000.0
+
+    return options
+
+def get_shipper(results):
+    """Return the function that ships a payload in PROFILER_DELIVERY mode.
+
+    sync (default) stores the payload before returning, async spools it
+    for a background thread and batch adds it to the open batch. The
+    function takes the payload and an optional delta tag, and returns
+    None when the payload went nowhere. The async and batch modes add
+    their sink's stats, as of the start of this invocation, to
+    `results`, acknowledge delivered delta payloads, and fall back to
+    storing synchronously when /tmp can't be written. Without an API key
+    or results bucket nothing could ever ship, so every mode stores
+    synchronously, which returns None and the results go to stdout.
+    """
+    mode = getenv('PROFILER_DELIVERY', 'sync')
+    if (getenv('observatory_api_key', None) is None and
+            getenv('observatory-results-bucket', None) is None):
+        mode = 'sync'
+    if mode == 'async':
+        import delivery
+        sink = delivery.shared_delivery()
+        results['delivery'] = sink.stats()
+        enqueue = sink.deliver
+    elif mode == 'batch':
+        import batching
+        sink = batching.shared_sink()
+        results['batch'] = sink.stats()
+        enqueue = sink.add
+    else:
+        def store(payload, tag=None):
+            return store_results(payload)
+        return store
+
+    if getenv('PROFILER_DELIVERY_FORMAT', 'full') == 'delta':
+        import delta
+        sink.on_delivered = delta.acknowledge
+
+    def ship(payload, tag=None):
+        try:
+            enqueue(payload, tag)
+            return True
+        except (IOError, OSError):
+            return store_results(payload)
+    return ship
+
 def lambda_handler(event, context):
     env = get_sandbox()
     
     ## in the future, can do something like
     ## if env == 'foo', run this profiler
-    results = PosixCoreProfiler.run()
+    options = get_profile_options(context)
+    results = PosixCoreProfiler.run(**options)
 
     results['sandbox'] = env
 
-    if store_results(results) is None:
-        print(json.dumps(results))
+    ## Posts to the API must leave PROFILER_HTTP_DEADLINE_MARGIN_MS of
+    ## the invocation for the S3 fallback. Without an API key there is
+    ## nothing to post, and transport isn't even imported.
+    bounded = False
+    if context is not None and getenv('observatory_api_key', None) is not None:
+        import transport
+        margin = int(getenv('PROFILER_HTTP_DEADLINE_MARGIN_MS', 500))
+        bounded = True
+        transport.set_deadline(
+            time.time() + (context.get_remaining_time_in_millis() - margin) / 1000.0)
+
+    ## Streamed sections can only be read once. Whatever the sink does
+    ## with them, the stdout fallback must still print the same lists.
+    if any(is_stream(v) for v in results.values()):
+        results = dict((k, list(v) if is_stream(v) else v) for k, v in results.items())
+
+    try:
+        ship = get_shipper(results)
+
+        ## PROFILER_DELIVERY_FORMAT=delta ships only what changed since the
+        ## last result the receiver acknowledged.
+        encoder = None
+        tag = None
+        payload = results
+        if getenv('PROFILER_DELIVERY_FORMAT', 'full') == 'delta':
+            import delta
+            encoder = delta.delta_encoder()
+            payload = encoder.encode(results)
+            tag = delta.payload_tag(payload)
+
+        if ship(payload, tag) is None:
+            write_json(payload, sys.stdout)
+            sys.stdout.write('\n')
+        elif encoder is not None:
+            ## Only a synchronous store is known to have arrived; the
+            ## sinks acknowledge enqueued payloads once delivered.
+            encoder.commit(acknowledged=getenv('PROFILER_DELIVERY', 'sync') == 'sync')
+    finally:
+        ## Posts made later, e.g. by an async drain after the next thaw,
+        ## must not run against this invocation's deadline.
+        if bounded:
+            import transport
+            transport.set_deadline(None)
+
+        ## The shipped results have the samples up to shipping; what is
+        ## returned covers the whole invocation.
+        if options.get('keep_sampling'):
+            from profilers.sampler import shared_sampler
+            results['_samples'] = shared_sampler().end()
 
     return results
 
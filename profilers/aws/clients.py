@@ -0,0 +1,68 @@
+"""
+Process wide registry of boto3 clients.
+
+Building a client loads and parses the botocore service model, which
+costs tens to hundreds of milliseconds per service. Clients are created
+on first use, keyed by (service, region, endpoint), and kept for the
+life of the process, so warm invocations reuse them. boto3 clients are
+thread safe once built; only creation is serialized, since the default
+session is not.
+
+PROFILER_PREWARM_CLIENTS (e.g. "s3,logs,ec2,sqs") builds the listed
+clients when the launcher is imported, during lambda init rather than
+in the billed handler.
+"""
+import os
+import threading
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def default_region():
+    return os.getenv('AWS_REGION') or os.getenv('AWS_DEFAULT_REGION')
+
+
+def client(service, region_name=None, endpoint_url=None):
+    """The shared client for `service`, created on first use."""
+    key = (service, region_name or default_region(), endpoint_url)
+    found = _clients.get(key)
+    if found is not None:
+        return found
+
+    with _lock:
+        if key not in _clients:
+            import boto3
+            _clients[key] = boto3.client(service, region_name=key[1],
+                                         endpoint_url=endpoint_url)
+        return _clients[key]
+
+
+def clients():
+    """The keys of the clients built so far."""
+    return sorted(_clients, key=str)
+
+
+def clear_clients():
+    with _lock:
+        _clients.clear()
+
+
+def prewarm(services=None):
+    """Build clients for `services` (PROFILER_PREWARM_CLIENTS) now.
+
+    Errors are ignored; the client is simply built on first use instead.
+    """
+    if services is None:
+        services = [s.strip() for s in
+                    os.getenv('PROFILER_PREWARM_CLIENTS', '').split(',')]
+    built = []
+    for service in services:
+        if not service:
+            continue
+        try:
+            client(service)
+            built.append(service)
+        except Exception:
+            pass
+    return built
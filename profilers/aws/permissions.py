@@ -1,9 +1,12 @@
-import botocore
-import boto3
+import botocore.exceptions
 import os
+import threading
 import time
 import uuid
 
+from profilers.aws import clients
+from profilers.executor import run_lookups
+
 
 
 """
@@ -16,102 +19,245 @@ ec2:DescribeTags
 sqs:ListQueues
 sqs:PutMessage
 
+Every check is a row in PROBES: the service, the IAM action, the client
+method to call and how to build its arguments. `targets` returns the
+list of argument dicts to try in turn; the probe stops at the first
+call that proves the action allowed or denied. Actions that can't be
+tried without side effects (sending a message to someone's queue) are
+asked of the IAM policy simulator instead (`simulate`).
+
+A probe that nothing proved either way (no log group, throttling, the
+simulator not allowed, ...) answers None. Probes run concurrently, at
+most PROBE_CONCURRENCY at a time per service, within the time the
+invocation has left, and proven answers are cached per execution role.
 """
 
-def _cloudwatch_create_log_group(client):
-    try:
-        response = client.create_log_group(
-            logGroupName="serverless-observatory-check-{uuid}".format(uuid=uuid.uuid4().hex),
-        )
-        return True
-    except botocore.exceptions.ClientError as e:
-        return False
+## Error codes that prove the caller may not perform the action.
+DENIED_CODES = frozenset([
+    'AccessDenied',
+    'AccessDeniedException',
+    'UnauthorizedOperation',
+    'AuthorizationError',
+])
 
-def _cloudwatch_create_log_stream(client):
-    try:
-        response = client.create_log_stream(
-            logGroupName=os.getenv('AWS_LAMBDA_LOG_GROUP_NAME', None),
-            logStreamName='foo'
-        )
-        return True
-    except botocore.exceptions.ClientError as e:
-        return False
+## Error codes that prove the action is allowed without performing it.
+ALLOWED_CODES = frozenset([
+    'DryRunOperation',
+    'ResourceAlreadyExistsException',
+])
 
-def _cloudwatch_put_log_events(client):
-    try:
-        response = client.put_log_events(
-            logGroupName=os.getenv('AWS_LAMBDA_LOG_GROUP_NAME', None),
-            logStreamName=os.getenv('AWS_LAMBDA_LOG_STREAM_NAME', None),
-            logEvents=[
-                {
-                    'timestamp': int(time.time()),
-                    'message': 'Test event from the serverless observatory profiler.'
-                },
-            ]
-        )
-    except botocore.exceptions.ClientError as e:
-        return False
-
-def check_cloudwatch():
-    cloudwatch = boto3.client('logs')
-    results = {
-        'CreateLogGroup': _cloudwatch_create_log_group(cloudwatch),
-        'CreateLogStream': _cloudwatch_create_log_group(cloudwatch),
-        'PutLogEvents': _cloudwatch_put_log_events(cloudwatch)
-    }
-    return results
-
-def _ec2_can_describe_tags(client):
+PROBE_CONCURRENCY = 2
+PROBE_WORKERS = 6
+## At most this long, and never past the invocation's remaining time
+## less PROFILER_BUDGET_MARGIN_MS.
+PROBE_BUDGET = 2.0
+
+## Execution role ARN -> {action: allowed}
+_role_results = {}
+## Access key -> role ARN; the role of a container doesn't change.
+_identities = {}
+_lock = threading.Lock()
+
+
+def _log_group_targets(client):
+    return [{
+        'logGroupName': "serverless-observatory-check-{uuid}".format(uuid=uuid.uuid4().hex),
+    }]
+
+
+def _log_stream_targets(client):
+    group = os.getenv('AWS_LAMBDA_LOG_GROUP_NAME', None)
+    if group is None:
+        return []
+    return [{
+        'logGroupName': group,
+        'logStreamName': "serverless-observatory-check-{uuid}".format(uuid=uuid.uuid4().hex),
+    }]
+
+
+def _log_event_targets(client):
+    group = os.getenv('AWS_LAMBDA_LOG_GROUP_NAME', None)
+    stream = os.getenv('AWS_LAMBDA_LOG_STREAM_NAME', None)
+    if group is None or stream is None:
+        return []
+    return [{
+        'logGroupName': group,
+        'logStreamName': stream,
+        'logEvents': [
+            {
+                'timestamp': int(time.time() * 1000),
+                'message': 'Test event from the serverless observatory profiler.'
+            },
+        ]
+    }]
+
+
+PROBES = [
+    {'service': 'logs', 'action': 'CreateLogGroup',
+     'call': 'create_log_group', 'targets': _log_group_targets},
+    {'service': 'logs', 'action': 'CreateLogStream',
+     'call': 'create_log_stream', 'targets': _log_stream_targets},
+    {'service': 'logs', 'action': 'PutLogEvents',
+     'call': 'put_log_events', 'targets': _log_event_targets},
+    {'service': 'ec2', 'action': 'DescribeTags',
+     'call': 'describe_tags', 'args': {'MaxResults': 10}, 'dry_run': True},
+    {'service': 'sqs', 'action': 'ListQueues',
+     'call': 'list_queues'},
+    {'service': 'sqs', 'action': 'PutMessage',
+     'simulate': 'sqs:SendMessage'},
+]
+
+
+def _verdict(client, probe, args):
+    """True/False when the call proves the action allowed/denied, else None."""
+    if probe.get('dry_run'):
+        args = dict(args, DryRun=True)
     try:
-        response = client.describe_tags(
-            DryRun=True,
-            MaxResults=10
-        )
+        getattr(client, probe['call'])(**args)
         return True
     except botocore.exceptions.ClientError as e:
-        return False
+        code = e.response.get('Error', {}).get('Code')
+        if code in ALLOWED_CODES:
+            return True
+        if code in DENIED_CODES:
+            return False
+        ## Some other failure (missing queue, throttling, ...): no answer.
+        return None
+
 
-def check_ec2():
-    ec2 = boto3.client('ec2', region_name=os.getenv('AWS_DEFAULT_REGION'))
-    results = {
-        'DescribeTags': _ec2_can_describe_tags(ec2)
-    }
-    return results
+def policy_source_arn(arn):
+    """The IAM role ARN behind an assumed role session ARN."""
+    if arn is None or ':assumed-role/' not in arn:
+        return arn
+    prefix, rest = arn.split(':assumed-role/', 1)
+    return '{}:role/{}'.format(prefix.replace(':sts:', ':iam:'), rest.split('/')[0])
 
-def _sqs_can_list_queues(client):
+
+def simulate(probe, client=None):
+    """The policy simulator's verdict on `probe`'s action for our role."""
+    arn = policy_source_arn(role_arn())
+    if arn is None:
+        return None
+    client = client or clients.client('iam')
     try:
-        response = client.list_queues()
-        return True
-    except botocore.exceptions.ClientError as e:
-        return False
+        response = client.simulate_principal_policy(
+            PolicySourceArn=arn, ActionNames=[probe['simulate']])
+    except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError):
+        return None
+    decisions = [r['EvalDecision'] for r in response.get('EvaluationResults', [])]
+    if not decisions:
+        return None
+    return all(d == 'allowed' for d in decisions)
 
-def _sqs_can_put_message(client):
+
+def run_probe(probe, client=None):
+    """Whether the caller may perform `probe`'s action; None when
+    nothing proved it either way.
+    """
+    if 'simulate' in probe:
+        return simulate(probe, client)
+    client = client or clients.client(probe['service'])
     try:
-        response = client.list_queues()
-
-        if response.get('QueueUrls', None) is not None:
-            for queue in response['QueueUrls']:
-                try:
-                    client.send_message(
-                        QueueUrl=queue,
-                        MessageBody={}
-                    )
-                    # Set status to pass first put that succeeds
-                    return True
-                    break
-                except:
-                    # Allow loop to continue
-                    pass
-            return False
+        if 'targets' in probe:
+            targets = probe['targets'](client)
         else:
-            return False
-    except botocore.exceptions.ClientError as e:
-        return False
-
-def check_sqs():
-    sqs = boto3.client('sqs')
-    results = {
-        'ListQueues': _sqs_can_list_queues(sqs),
-        'PutMessage': _sqs_can_put_message(sqs)
-    }
-    return results
+            targets = [probe.get('args', {})]
+    except botocore.exceptions.ClientError:
+        return None
+
+    for args in targets:
+        verdict = _verdict(client, probe, args)
+        if verdict is not None:
+            return verdict
+    return None
+
+
+def role_arn():
+    """The ARN of the credentials in use, from STS once per access key."""
+    key = os.getenv('AWS_ACCESS_KEY_ID', None)
+    if key not in _identities:
+        try:
+            _identities[key] = clients.client('sts').get_caller_identity()['Arn']
+        except Exception:
+            return None
+    return _identities[key]
+
+
+def _limited(probe, semaphore):
+    def lookup():
+        with semaphore:
+            return run_probe(probe)
+    return lookup
+
+
+def probe_budget(context=None):
+    """PROBE_BUDGET, cut to what the invocation has left."""
+    if context is None:
+        return PROBE_BUDGET
+    margin = int(os.getenv('PROFILER_BUDGET_MARGIN_MS', 500))
+    remaining = (context.get_remaining_time_in_millis() - margin) / 1000.0
+    return max(min(PROBE_BUDGET, remaining), 0)
+
+
+def probe_permissions(services=None, budget=None, context=None):
+    """Map 'service:Action' -> allowed for every probe of `services`.
+
+    Probes whose answer is already known for this execution role are
+    not run again. A probe that nothing proved answers None, and one
+    that errors or runs out of budget reports the executor's status
+    dict; both are retried on the next call. `budget` defaults to
+    probe_budget(context).
+    """
+    probes = [p for p in PROBES if services is None or p['service'] in services]
+    arn = role_arn()
+
+    with _lock:
+        known = dict(_role_results.get(arn, {})) if arn else {}
+
+    limit = int(os.getenv('PROFILER_AWS_PROBE_CONCURRENCY', PROBE_CONCURRENCY))
+    semaphores = {}
+    lookups = {}
+    for probe in probes:
+        name = '{}:{}'.format(probe['service'], probe['action'])
+        if name in known:
+            continue
+        if probe['service'] not in semaphores:
+            semaphores[probe['service']] = threading.Semaphore(limit)
+        lookups[name] = _limited(probe, semaphores[probe['service']])
+
+    if lookups:
+        if budget is None:
+            budget = probe_budget(context)
+        found = run_lookups(lookups, max_workers=PROBE_WORKERS, budget=budget)
+        if arn:
+            with _lock:
+                cache = _role_results.setdefault(arn, {})
+                for name, allowed in found.items():
+                    if isinstance(allowed, bool):
+                        cache[name] = allowed
+        known.update(found)
+
+    return dict((name, known[name]) for name in
+                ('{}:{}'.format(p['service'], p['action']) for p in probes))
+
+
+def clear_role_results():
+    with _lock:
+        _role_results.clear()
+        _identities.clear()
+
+
+def _check(service, context=None):
+    found = probe_permissions([service], context=context)
+    prefix = service + ':'
+    return dict((name[len(prefix):], allowed) for name, allowed in found.items())
+
+
+def check_cloudwatch(context=None):
+    return _check('logs', context)
+
+def check_ec2(context=None):
+    return _check('ec2', context)
+
+def check_sqs(context=None):
+    return _check('sqs', context)
@@ -0,0 +1,131 @@
+"""
+Warm-invocation cache for lookup results.
+
+Lookups whose answer can't change inside one container (cpuinfo, the
+package list, ...) declare a TTL on their profiler in `lookup_ttls`,
+either a number of seconds or STATIC for "once per container". Results
+are kept in a module level dict, which lambda preserves across warm
+invocations, and optionally in a file under /tmp so that they survive
+a new process in the same container too.
+
+The file is only trusted when is_warm says the container is warm, so a
+stale file can never leak into a cold start (or a fresh local run).
+
+Cached values are copied on the way in and out, so a caller mutating
+its result can't change what the next invocation is served.
+"""
+import json
+import os
+import threading
+import time
+
+from profilers.json_stream import is_stream
+
+STATIC = 'static'
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+class LookupCache(object):
+
+    """Two tier (memory, then optional file) cache of lookup results."""
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self.entries = {}
+        self.hits = []
+        self.misses = []
+        self._file_loaded = False
+        self._lock = threading.Lock()
+
+    def _fresh(self, name, ttl, now):
+        entry = self.entries.get(name)
+        if entry is None:
+            return False
+        if ttl == STATIC:
+            return True
+        return now - entry[0] < ttl
+
+    def load_file(self):
+        """Merge entries from the cache file, once per process."""
+        if self._file_loaded or not self.cache_file:
+            return
+        self._file_loaded = True
+        try:
+            with open(self.cache_file) as f:
+                stored = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        for name, entry in stored.items():
+            self.entries.setdefault(name, tuple(entry))
+
+    def save_file(self):
+        if not self.cache_file:
+            return
+        tmp = '{}.{}.tmp'.format(self.cache_file, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.entries, f)
+            os.rename(tmp, self.cache_file)
+        except (IOError, OSError, TypeError, ValueError):
+            ## Unserializable results just stay in memory.
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def wrap(self, lookups, ttls, warm=True, cacheable=None):
+        """Return `lookups` with every lookup named in `ttls` cached.
+
+        `warm` is whether the container is warm; on a cold start only
+        the in-memory tier (necessarily empty in a new process) is used.
+        `cacheable` maps lookup names to a predicate on a fresh result;
+        a result it rejects (e.g. an incomplete one) is returned but not
+        kept. Hits and misses of this run are recorded in `hits` and
+        `misses`.
+        """
+        cacheable = cacheable or {}
+        self.hits = []
+        self.misses = []
+        if warm:
+            self.load_file()
+
+        wrapped = dict(lookups)
+        for name, ttl in ttls.items():
+            if name in lookups:
+                wrapped[name] = self._wrap(name, lookups[name], ttl,
+                                           cacheable.get(name))
+        return wrapped
+
+    def _wrap(self, name, fn, ttl, cacheable=None):
+        def cached():
+            import copy
+            if self._fresh(name, ttl, time.time()):
+                self.hits.append(name)
+                return copy.deepcopy(self.entries[name][1])
+
+            value = fn()
+            self.misses.append(name)
+            ## Streamed sections can only be consumed once.
+            if is_stream(value):
+                return value
+            if cacheable is None or cacheable(value):
+                with self._lock:
+                    self.entries[name] = (time.time(), copy.deepcopy(value))
+            return value
+        return cached
+
+    def report(self):
+        return {'hits': sorted(self.hits), 'misses': sorted(self.misses)}
+
+
+def shared_cache():
+    """The process wide LookupCache, kept alive across warm invocations.
+
+    PROFILER_CACHE_FILE names the optional /tmp tier.
+    """
+    with _shared_lock:
+        if 'cache' not in _shared:
+            _shared['cache'] = LookupCache(os.getenv('PROFILER_CACHE_FILE', None))
+        return _shared['cache']
@@ -0,0 +1,281 @@
+"""
+CPU steal and noisy neighbour probe.
+
+/proc/cpuinfo says what the CPU is, not how much of it we get. This
+probe runs a fixed, calibrated compute kernel and reads /proc/stat and
+/proc/self/task/*/schedstat around it to report:
+
+- ops_per_sec of the kernel on one thread,
+- steal_percent: share of CPU time the hypervisor gave to someone else
+  (the aggregate `steal` column of /proc/stat),
+- run_queue_wait_ms: time our threads were runnable but not running
+  (second field of schedstat),
+- scaling of the same kernel on N threads and on N processes, as the
+  speedup over one thread; the better of the two is effective_vcpus.
+
+The default kernel is SHA-256 over a 64KiB buffer, which releases the
+GIL, so threads scale as well as processes where the CPUs are really
+there. With NumPy installed PROFILER_CPU_KERNEL=numpy selects a matrix
+multiply instead.
+
+Processes are multiprocessing.Process with a Pipe each: Pool and Queue
+need /dev/shm, which Lambda doesn't have. They are counted in
+utils.spawn_count.
+
+The probe saturates every CPU and forks, so it only runs when
+PROFILER_CPU_PROBE=1, on its own after the other lookups.
+"""
+import glob
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from profilers.utils import count_spawn
+
+SECONDS = 1.0
+MAX_WORKERS = 8
+CHUNK = 64 * 1024
+
+## Share of the time budget for each phase.
+PHASES = (('calibrate', 0.1), ('single', 0.3), ('threads', 0.3), ('processes', 0.3))
+
+STAT_FIELDS = ('user', 'nice', 'system', 'idle', 'iowait', 'irq', 'softirq',
+               'steal', 'guest', 'guest_nice')
+
+
+def read_stat(path='/proc/stat'):
+    """The aggregate `cpu` line of /proc/stat as a dict of jiffies, plus
+    'cpus', the number of per-CPU lines. None if unreadable.
+    """
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except (IOError, OSError):
+        return None
+    res = None
+    cpus = 0
+    for line in lines:
+        if line.startswith('cpu '):
+            values = [int(v) for v in line.split()[1:]]
+            res = dict(zip(STAT_FIELDS, values))
+        elif line.startswith('cpu'):
+            cpus += 1
+    if res is not None:
+        res['cpus'] = cpus
+    return res
+
+
+def stat_delta(before, after):
+    """steal/busy percentages between two read_stat snapshots."""
+    if not before or not after:
+        return {}
+    delta = dict((k, after.get(k, 0) - before.get(k, 0)) for k in STAT_FIELDS)
+    ## guest time is already counted in user.
+    total = sum(v for k, v in delta.items() if k not in ('guest', 'guest_nice'))
+    if total <= 0:
+        return {'steal_percent': 0.0, 'busy_percent': 0.0}
+    idle = delta['idle'] + delta['iowait']
+    return {
+        'steal_percent': round(100.0 * delta['steal'] / total, 2),
+        'busy_percent': round(100.0 * (total - idle) / total, 2),
+    }
+
+
+def read_schedstat(pid='self'):
+    """(run ns, wait ns, timeslices) summed over the threads of `pid`,
+    or None where schedstats are not available.
+    """
+    totals = [0, 0, 0]
+    found = False
+    for path in glob.glob('/proc/{}/task/*/schedstat'.format(pid)):
+        try:
+            with open(path) as f:
+                values = [int(v) for v in f.read().split()[:3]]
+        except (IOError, OSError, ValueError):
+            continue
+        if len(values) == 3:
+            found = True
+            totals = [a + b for a, b in zip(totals, values)]
+    return tuple(totals) if found else None
+
+
+def _sha256_kernel():
+    data = os.urandom(CHUNK)
+
+    def op():
+        hashlib.sha256(data).digest()
+    return op
+
+
+def _numpy_kernel():
+    a = numpy.random.RandomState(0).rand(64, 64)
+
+    def op():
+        numpy.dot(a, a)
+    return op
+
+
+KERNELS = {'sha256': _sha256_kernel}
+if numpy is not None:
+    KERNELS['numpy'] = _numpy_kernel
+
+
+def run_kernel(op, ops, deadline):
+    """Run `op` `ops` times or until `deadline`; (ops done, seconds)."""
+    start = time.time()
+    done = 0
+    while done < ops:
+        op()
+        done += 1
+        if done % 8 == 0 and time.time() > deadline:
+            break
+    return done, time.time() - start
+
+
+def calibrate(op, seconds):
+    """How many runs of `op` take about `seconds` on one thread."""
+    done, elapsed = run_kernel(op, 1 << 30, time.time() + seconds)
+    if elapsed <= 0:
+        return done
+    return max(int(done / elapsed * seconds), 1)
+
+
+def _thread_worker(op, ops, deadline, out, i):
+    out[i] = run_kernel(op, ops, deadline)
+
+
+def run_threads(op, ops, workers, deadline):
+    """Aggregate ops/sec of `workers` threads running `ops` each."""
+    out = [None] * workers
+    threads = [threading.Thread(target=_thread_worker, args=(op, ops, deadline, out, i))
+               for i in range(workers)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    done = sum(r[0] for r in out if r)
+    return done / elapsed if elapsed > 0 else None
+
+
+def _process_worker(kernel, ops, deadline, conn):
+    try:
+        op = KERNELS[kernel]()
+        before = read_schedstat()
+        start = time.time()
+        done, elapsed = run_kernel(op, ops, deadline)
+        after = read_schedstat()
+        wait = after[1] - before[1] if before and after else None
+        conn.send((done, start, start + elapsed, wait))
+    finally:
+        conn.close()
+
+
+def run_processes(kernel, ops, workers, deadline):
+    """(aggregate ops/sec, run queue wait ms) of `workers` processes."""
+    import multiprocessing
+    pipes = []
+    procs = []
+    try:
+        for _ in range(workers):
+            parent, child = multiprocessing.Pipe(False)
+            proc = multiprocessing.Process(target=_process_worker,
+                                           args=(kernel, ops, deadline, child))
+            proc.daemon = True
+            count_spawn()
+            proc.start()
+            child.close()
+            pipes.append(parent)
+            procs.append(proc)
+
+        results = []
+        for parent in pipes:
+            ## Workers stop at the deadline; allow a little for exit.
+            if parent.poll(max(deadline - time.time(), 0) + 1.0):
+                results.append(parent.recv())
+    finally:
+        for proc in procs:
+            proc.join(0.5)
+            if proc.is_alive():
+                proc.terminate()
+        for parent in pipes:
+            parent.close()
+
+    if not results:
+        return None, None
+    ## From the first worker starting its kernel to the last finishing,
+    ## so process start up isn't counted but staggered starts are.
+    elapsed = max(r[2] for r in results) - min(r[1] for r in results)
+    rate = sum(r[0] for r in results) / elapsed if elapsed > 0 else None
+    waits = [r[3] for r in results if r[3] is not None]
+    return rate, round(sum(waits) / 1e6, 3) if waits else None
+
+
+def _scaling(rate, single, workers):
+    if not rate or not single:
+        return {'workers': workers, 'ops_per_sec': rate}
+    speedup = rate / single
+    return {
+        'workers': workers,
+        'ops_per_sec': round(rate, 1),
+        'speedup': round(speedup, 2),
+        'efficiency': round(speedup / workers, 2),
+    }
+
+
+def probe(seconds=SECONDS, workers=None, kernel='sha256'):
+    """Run the kernel on one thread, then `workers` threads and
+    processes (default: one per CPU, at most MAX_WORKERS), within about
+    `seconds` of wall time.
+    """
+    if kernel not in KERNELS:
+        return {'error': 'unknown kernel', 'kernels': sorted(KERNELS)}
+    op = KERNELS[kernel]()
+    slices = dict((name, seconds * share) for name, share in PHASES)
+
+    stat_before = read_stat()
+    if workers is None:
+        cpus = (stat_before or {}).get('cpus') or 1
+        workers = min(max(cpus, 2), MAX_WORKERS)
+
+    ops = calibrate(op, slices['calibrate'])
+    ops = max(int(ops * slices['single'] / slices['calibrate']), 1)
+
+    sched_before = read_schedstat()
+    done, elapsed = run_kernel(op, ops, time.time() + slices['single'])
+    sched_after = read_schedstat()
+    single = done / elapsed if elapsed > 0 else None
+
+    res = {
+        'kernel': kernel,
+        'ops_per_sec': round(single, 1) if single else None,
+        'cpu_seconds': None,
+        'run_queue_wait_ms': None,
+    }
+    if sched_before and sched_after:
+        res['cpu_seconds'] = round((sched_after[0] - sched_before[0]) / 1e9, 4)
+        res['run_queue_wait_ms'] = round((sched_after[1] - sched_before[1]) / 1e6, 3)
+
+    threaded = run_threads(op, ops, workers, time.time() + slices['threads'])
+    res['threads'] = _scaling(threaded, single, workers)
+
+    try:
+        forked, wait = run_processes(kernel, ops, workers, time.time() + slices['processes'])
+        res['processes'] = _scaling(forked, single, workers)
+        res['processes']['run_queue_wait_ms'] = wait
+    except (OSError, IOError) as e:
+        res['processes'] = {'workers': workers, 'error': str(e)}
+
+    speedups = [r.get('speedup') for r in (res['threads'], res['processes'])]
+    speedups = [s for s in speedups if s]
+    res['effective_vcpus'] = max(speedups) if speedups else None
+
+    res.update(stat_delta(stat_before, read_stat()))
+    return res
@@ -0,0 +1,149 @@
+"""
+Concurrent executor for a lookups dict.
+
+Runs independent lookups on a bounded pool of worker threads so that
+slow, blocking probes (NTP, sockets, the permissions walk) overlap
+instead of adding up. Every lookup gets its own deadline, and the run
+as a whole never outlives the given budget.
+"""
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+TIMEOUT_RESULT = {"status": "timeout"}
+
+
+def error_result(e):
+    return {"status": "error", "error": type(e).__name__}
+
+
+def run_lookups(lookups, max_workers=8, budget=None, timeouts=None,
+                default_timeout=None, on_timeout=None):
+    """Create dictionary of results by calling lookups concurrently.
+
+    `budget` is the number of seconds the whole run may take; whatever
+    has not finished by then is recorded as {"status": "timeout"}.
+    `timeouts` maps lookup names to their own deadline in seconds,
+    counted from when the lookup starts. Lookups not named there get
+    `default_timeout` (None means only the budget applies).
+
+    Threads cannot be killed, so a lookup that misses its deadline is
+    abandoned: its worker is replaced so the pool keeps `max_workers`
+    healthy threads, and the late result is discarded.
+
+    `on_timeout(name, started, abandoned)` is called for every lookup
+    recorded as a timeout, with when it started (None if it never did)
+    and when it was given up on, once the run is over.
+    """
+    timeouts = timeouts or {}
+    pending = queue.Queue()
+    for name in lookups:
+        pending.put(name)
+
+    cond = threading.Condition()
+    results = {}
+    started = {}
+    finished = set()
+    running = {}
+    workers = []
+    closed = []
+    abandoned = {}
+
+    def worker():
+        while True:
+            try:
+                name = pending.get_nowait()
+            except queue.Empty:
+                return
+
+            with cond:
+                if closed:
+                    ## Dequeued just as the run ended; too late to start.
+                    return
+                started[name] = time.time()
+                running[name] = threading.current_thread()
+                ## Wake the main thread so it can arm this deadline.
+                cond.notify()
+
+            try:
+                value = lookups[name]()
+            except Exception as e:
+                value = error_result(e)
+
+            with cond:
+                if name in results:
+                    ## We were given up on and already replaced.
+                    return
+                results[name] = value
+                finished.add(name)
+                cond.notify()
+
+    def spawn():
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        t.start()
+        workers.append(t)
+
+    for _ in range(min(max_workers, len(lookups))):
+        spawn()
+
+    run_deadline = time.time() + budget if budget is not None else None
+
+    with cond:
+        while len(results) < len(lookups):
+            now = time.time()
+            if run_deadline is not None and now >= run_deadline:
+                break
+
+            wake = run_deadline
+            for name, start in list(started.items()):
+                if name in results:
+                    continue
+                limit = timeouts.get(name, default_timeout)
+                if limit is None:
+                    continue
+                if now >= start + limit:
+                    results[name] = dict(TIMEOUT_RESULT)
+                    abandoned[name] = start + limit
+                    if not pending.empty():
+                        spawn()
+                elif wake is None or start + limit < wake:
+                    wake = start + limit
+
+            if len(results) < len(lookups):
+                cond.wait(None if wake is None else max(wake - now, 0))
+
+        now = time.time()
+        for name in lookups:
+            if name not in results:
+                results[name] = dict(TIMEOUT_RESULT)
+                abandoned[name] = now
+
+        ## Anything still queued must not start after we return.
+        while not pending.empty():
+            try:
+                pending.get_nowait()
+            except queue.Empty:
+                break
+
+        closed.append(True)
+        res = dict(results)
+        stuck = set(running[name] for name in started if name not in finished)
+        abandoned = [(name, started.get(name), at) for name, at in abandoned.items()]
+
+    if on_timeout is not None:
+        for name, start, at in abandoned:
+            on_timeout(name, start, at)
+
+    ## The other workers are idle and about to exit; wait for them so none
+    ## is left running into interpreter shutdown.
+    for t in workers:
+        if t not in stuck:
+            t.join()
+
+    return res
@@ -0,0 +1,331 @@
+"""
+Iterative, budgeted directory walker for the permissions lookups.
+
+Built on scandir so that each directory is stat'd exactly once and the
+d_type of every other entry is reused instead of stat'ing it. Roots are
+fanned out over a small thread pool; within a root the walk is an
+explicit stack, so deep trees can't hit the recursion limit.
+"""
+import fnmatch
+import os
+import stat
+import sys
+import threading
+import time
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+class _Entry(object):
+
+    """Minimal stand-in for os.DirEntry when scandir isn't available."""
+
+    def __init__(self, parent, name):
+        self.name = name
+        self.path = os.path.join(parent, name)
+        self._stat = None
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_dir(self):
+        try:
+            return stat.S_ISDIR(self.stat().st_mode)
+        except OSError:
+            return False
+
+
+def _entries(path):
+    if scandir is not None:
+        return scandir(path)
+    return [_Entry(path, name) for name in os.listdir(path)]
+
+
+def _in_chain(chain, key):
+    while chain is not None:
+        if chain[0] == key:
+            return True
+        chain = chain[1]
+    return False
+
+
+class WalkBudget(object):
+
+    """Limits shared by every root of one walk.
+
+    `max_depth` counts levels below a root (the root is depth 0),
+    `max_entries` is the number of directories visited in total and
+    `seconds` is a wall clock budget for the whole walk. `prune` is a
+    list of globs matched against full paths; matching directories are
+    neither reported nor descended into.
+    """
+
+    def __init__(self, max_depth=None, max_entries=None, seconds=None,
+                 prune=None):
+        self.max_depth = max_depth
+        self.max_entries = max_entries
+        self.deadline = time.time() + seconds if seconds is not None else None
+        self.prune = list(prune or [])
+        self.visited = 0
+        self.truncated = None
+        self._lock = threading.Lock()
+
+    def pruned(self, path):
+        for pattern in self.prune:
+            if fnmatch.fnmatch(path, pattern):
+                return True
+        return False
+
+    def take(self):
+        """Account for one more directory; False once the budget is spent."""
+        with self._lock:
+            if self.truncated in ('entries', 'time'):
+                return False
+            if self.max_entries is not None and self.visited >= self.max_entries:
+                self.truncated = 'entries'
+                return False
+            if self.deadline is not None and time.time() >= self.deadline:
+                self.truncated = 'time'
+                return False
+            self.visited += 1
+            return True
+
+    def descend(self, depth):
+        if self.max_depth is not None and depth >= self.max_depth:
+            with self._lock:
+                self.truncated = self.truncated or 'depth'
+            return False
+        return True
+
+    def stats(self):
+        return {'directories': self.visited, 'truncated': self.truncated}
+
+
+class DirIndex(object):
+
+    """What the last walk saw of every directory, to skip rescanning it.
+
+    Maps each directory to its (mtime, ctime, mode, uid, gid, inode),
+    its access bits and the names of its subdirectories. Adding,
+    removing or renaming an entry bumps a directory's mtime, and chmod
+    or chown its ctime, so while those are unchanged the stored verdict
+    and child list are still right and the directory need not be listed
+    again. Children are still stat'd and checked in turn, so a change
+    anywhere below is found.
+
+    `owner` identifies the access rules the verdicts were computed with
+    (uid, groups, mode); an index saved under different rules is ignored.
+
+    File times only move on every clock tick, so a directory changed
+    within `racy` seconds of the walk could change again without its
+    times moving; such entries are stored but never reused (as git does
+    for its index).
+    """
+
+    VERSION = 1
+
+    def __init__(self, path=None, owner=None, racy=1.0):
+        self.path = path
+        self.owner = owner
+        self.racy_after = time.time() - racy
+        self.entries = {}
+        self.seen = {}
+        self.reused = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(st):
+        return (st.st_mtime, st.st_ctime, st.st_mode, st.st_uid, st.st_gid, st.st_ino)
+
+    def _header(self):
+        ## marshal's format is tied to the interpreter that wrote it.
+        return [self.VERSION, list(sys.version_info[:2]), self.owner]
+
+    def load(self):
+        """Read the saved index; it's only read back by this same runtime,
+        so it is stored with marshal, which loads ~10x faster than json.
+        """
+        import marshal
+        try:
+            with open(self.path, 'rb') as f:
+                header, entries = marshal.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return self
+        if header == self._header():
+            self.entries = entries
+        return self
+
+    def save(self):
+        import marshal
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                marshal.dump([self._header(), self.seen], f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            pass
+
+    def lookup(self, path, st):
+        """(bits, child names or None) stored for `path`, if still valid."""
+        entry = self.entries.get(path)
+        if entry is None or entry[0] != self.key(st):
+            with self._lock:
+                self.revalidated += 1
+            return None
+        with self._lock:
+            self.reused += 1
+        self.seen[path] = entry
+        return entry[1], entry[2]
+
+    def store(self, path, st, bits, children):
+        key = self.key(st)
+        if max(st.st_mtime, st.st_ctime) >= self.racy_after:
+            key = None
+        ## Tuples: lots of small lists would keep the cyclic GC busy.
+        self.seen[path] = (key, tuple(bits), children)
+
+    def stats(self):
+        return {'reused': self.reused, 'revalidated': self.revalidated}
+
+
+def _scan_children(path, depth, chain):
+    """Subdirectories of `path` as stack items, plus their (name, is_symlink)."""
+    children = []
+    names = []
+    try:
+        for entry in _entries(path):
+            try:
+                if not entry.is_dir():
+                    continue
+                child_stat = entry.stat()
+                is_link = entry.is_symlink()
+            except OSError:
+                continue
+
+            names.append((entry.name, is_link))
+            if is_link and _in_chain(chain, (child_stat.st_dev, child_stat.st_ino)):
+                continue
+            children.append((entry.path, child_stat, depth + 1, chain))
+    except OSError:
+        ## eg. permission denied despite the mode bits, or vanished.
+        pass
+    return children, names
+
+
+def _known_children(path, names, depth, chain):
+    """Stack items for the subdirectories an index entry lists."""
+    children = []
+    for name, is_link in names:
+        child = os.path.join(path, name)
+        try:
+            child_stat = os.stat(child)
+        except OSError:
+            continue
+        if not stat.S_ISDIR(child_stat.st_mode):
+            continue
+        if is_link and _in_chain(chain, (child_stat.st_dev, child_stat.st_ino)):
+            continue
+        children.append((child, child_stat, depth + 1, chain))
+    return children
+
+
+def walk(root, access, budget=None, index=None):
+    """Yield (path, stat_result, access bits) for each directory under root.
+
+    Directories come out in the same pre-order the recursive
+    PosixPermissions walk used. `access(stat_result, path)` returns a
+    (readable, writable, executable) tuple; only directories that are
+    readable and executable are descended into. Like the recursive walk,
+    symlinks to directories are followed, except where they lead back
+    to a directory we're already inside (eg. /usr/bin/X11 -> .).
+
+    With a DirIndex, directories whose metadata hasn't changed since it
+    was saved take their bits and subdirectories from the index instead
+    of being evaluated and listed again.
+    """
+    budget = budget or WalkBudget()
+
+    try:
+        root_stat = os.stat(root)
+    except OSError:
+        return
+
+    ## (path, stat, depth, chain of (dev, ino) back to the root)
+    stack = [(root, root_stat, 0, None)]
+
+    while stack:
+        path, st, depth, chain = stack.pop()
+
+        if budget.pruned(path) or not budget.take():
+            continue
+
+        known = index.lookup(path, st) if index is not None else None
+        if known is not None:
+            bits, names = known
+        else:
+            bits, names = access(st, path), None
+        yield path, st, bits
+
+        readable, _, executable = bits
+        if not (readable and executable) or not budget.descend(depth):
+            if index is not None and known is None:
+                index.store(path, st, bits, None)
+            continue
+
+        chain = ((st.st_dev, st.st_ino), chain)
+        if names is not None:
+            children = _known_children(path, names, depth, chain)
+        else:
+            children, names = _scan_children(path, depth, chain)
+            if index is not None:
+                index.store(path, st, bits, tuple(names))
+
+        children.reverse()
+        stack.extend(children)
+
+
+def walk_roots(roots, access, budget=None, workers=4, index=None):
+    """Return writable directories under `roots`, walked in parallel.
+
+    Each root is walked on one of `workers` threads; the per-root lists
+    are concatenated in the order of `roots`.
+    """
+    budget = budget or WalkBudget()
+    roots = list(roots)
+    results = [None] * len(roots)
+    lock = threading.Lock()
+    todo = list(range(len(roots)))
+
+    def worker():
+        while True:
+            with lock:
+                if not todo:
+                    return
+                i = todo.pop(0)
+            results[i] = [path for (path, _, bits) in
+                          walk(roots[i], access, budget, index) if bits[1]]
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(max(1, min(workers, len(roots))))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+
+    paths = []
+    for r in results:
+        paths.extend(r)
+    return paths
@@ -0,0 +1,97 @@
+"""
+Per-lookup timing and resource instrumentation.
+
+Wraps every function in a lookups dict so that calling it records wall
+time, CPU time, peak RSS growth, shells spawned and the exception type
+(if any). Nothing is wrapped unless instrumentation is asked for, so the
+normal run pays nothing for it.
+
+A lookup the concurrent executor gave up on is recorded by abandoned()
+with `timed_out` set and its wall time up to the deadline; whatever it
+does after that isn't measured.
+"""
+import resource
+import sys
+import time
+
+from profilers.utils import thread_spawn_count
+
+
+## Per-thread CPU time is Linux only; RUSAGE_THREAD is missing from the
+## python 2 resource module but the kernel constant is 1.
+if hasattr(resource, 'RUSAGE_THREAD'):
+    RUSAGE_THREAD = resource.RUSAGE_THREAD
+elif sys.platform.startswith('linux'):
+    RUSAGE_THREAD = 1
+else:
+    RUSAGE_THREAD = resource.RUSAGE_SELF
+
+
+def _sample():
+    thread_usage = resource.getrusage(RUSAGE_THREAD)
+    return (
+        time.time(),
+        thread_usage.ru_utime + thread_usage.ru_stime,
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        thread_spawn_count(),
+    )
+
+
+class Instrumentation(object):
+
+    """Collects a timing record per lookup name."""
+
+    def __init__(self):
+        self.records = {}
+        self._abandoned = set()
+
+    def wrap(self, lookups):
+        """Return a copy of `lookups` with every function instrumented."""
+        return dict((name, self._wrap(name, fn))
+                    for (name, fn) in lookups.items())
+
+    def _wrap(self, name, fn):
+        def instrumented():
+            before = _sample()
+            error = None
+            try:
+                return fn()
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                after = _sample()
+                if name not in self._abandoned:
+                    self.records[name] = {
+                        'wall': round(after[0] - before[0], 6),
+                        'cpu': round(after[1] - before[1], 6),
+                        'max_rss_delta_kb': after[2] - before[2],
+                        'subprocesses': after[3] - before[3],
+                        'exception': error,
+                        'timed_out': False,
+                    }
+        return instrumented
+
+    def abandoned(self, name, started, at):
+        """Record `name` as given up on at `at`, having started at
+        `started` (None if it never started).
+        """
+        self._abandoned.add(name)
+        self.records[name] = {
+            'wall': round(at - started, 6) if started is not None else 0.0,
+            'cpu': None,
+            'max_rss_delta_kb': None,
+            'subprocesses': None,
+            'exception': None,
+            'timed_out': True,
+        }
+
+    def timings(self):
+        return dict(self.records)
+
+    def slowest(self, n):
+        """Return the `n` slowest lookups as (name, wall time) pairs."""
+        by_wall = sorted(self.records.items(),
+                         key=lambda item: item[1]['wall'],
+                         reverse=True)
+        return [[name, record['wall']] for (name, record) in by_wall[:n]]
@@ -0,0 +1,179 @@
+"""
+Active I/O probe for the writable scratch space.
+
+For each filesystem we can write to (/tmp, and any other path
+PosixPermissions found writable, one path per st_dev) a temporary file
+is written and read back to measure:
+
+- sequential write throughput (1MiB blocks, fsync'd at the end),
+- sequential read throughput,
+- 4KiB random read IOPS,
+- fsync latency percentiles for 4KiB writes.
+
+Buffers are allocated once and reused; reads go into a preallocated
+buffer with readinto. Each path has a strict size budget (the file
+never grows past it, and is skipped if the filesystem doesn't have
+twice that free) and time budget (every phase stops when its slice is
+up), and the file is always removed. The probe only runs when
+PROFILER_IO_PROBE=1, after the other lookups.
+
+os.pwrite is used where available (Python 3.3+), and lseek + write on
+Python 2. The page cache is dropped with posix_fadvise before reading
+where available; otherwise reads may be served from memory, which the
+result says ('cache_dropped': False).
+"""
+import errno
+import io
+import os
+import random
+import tempfile
+import time
+
+from profilers.utils import percentiles
+
+SIZE = 8 * 1024 * 1024
+SECONDS = 1.0
+BLOCK = 1024 * 1024
+PAGE = 4096
+
+## Share of the time budget for each phase.
+PHASES = (('write', 0.4), ('read', 0.2), ('random_read', 0.2), ('fsync', 0.2))
+
+
+def _pwrite(fd, data, offset):
+    if hasattr(os, 'pwrite'):
+        return os.pwrite(fd, data, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.write(fd, data)
+
+
+def _drop_cache(fd):
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        return True
+    except OSError:
+        return False
+
+
+def _mb_per_s(nbytes, seconds):
+    if seconds <= 0:
+        return None
+    return round(nbytes / seconds / (1024.0 * 1024.0), 2)
+
+
+def filesystems(paths):
+    """The first of `paths` on each filesystem that exists, in order."""
+    seen = set()
+    res = []
+    for path in paths:
+        try:
+            dev = os.stat(path).st_dev
+        except OSError:
+            continue
+        if dev not in seen:
+            seen.add(dev)
+            res.append(path)
+    return res
+
+
+def probe_path(path, size=SIZE, seconds=SECONDS, block=BLOCK):
+    """Measure the filesystem holding `path`, within `size` bytes and
+    `seconds` of wall time. Returns a dict of measurements.
+    """
+    try:
+        vfs = os.statvfs(path)
+        free = vfs.f_bavail * vfs.f_frsize
+    except OSError:
+        free = None
+    if free is not None and free < 2 * size:
+        return {'path': path, 'error': 'insufficient space', 'free': free}
+
+    size = max(size - size % block, block)
+    data = os.urandom(block)
+    page = data[:PAGE]
+    buf = bytearray(block)
+    view = memoryview(buf)
+    page_view = view[:PAGE]
+
+    slices = dict((name, seconds * share) for name, share in PHASES)
+    res = {'path': path, 'size': size}
+
+    try:
+        fd, name = tempfile.mkstemp(prefix='.profiler-io-', dir=path)
+    except (IOError, OSError) as e:
+        return {'path': path, 'error': errno.errorcode.get(e.errno, str(e))}
+
+    try:
+        ## Sequential write, then fsync so the data is really out.
+        start = time.time()
+        deadline = start + slices['write']
+        written = 0
+        while written < size and time.time() < deadline:
+            written += _pwrite(fd, data, written)
+        os.fsync(fd)
+        res['write_mb_s'] = _mb_per_s(written, time.time() - start)
+        res['written'] = written
+
+        res['cache_dropped'] = _drop_cache(fd)
+        if not written:
+            ## Nothing to read back; zero byte reads aren't IOPS.
+            res.update(read_mb_s=None, random_read_iops=None,
+                       fsync_ms={}, fsyncs=0)
+            return res
+
+        ## Sequential read into the preallocated buffer.
+        f = io.FileIO(fd, 'r', closefd=False)
+        f.seek(0)
+        start = time.time()
+        deadline = start + slices['read']
+        read = 0
+        while read < written and time.time() < deadline:
+            n = f.readinto(view)
+            if not n:
+                break
+            read += n
+        res['read_mb_s'] = _mb_per_s(read, time.time() - start)
+
+        ## 4KiB reads at random page aligned offsets.
+        _drop_cache(fd)
+        pages = max(written // PAGE, 1)
+        rng = random.Random(0)
+        start = time.time()
+        deadline = start + slices['random_read']
+        reads = 0
+        while time.time() < deadline:
+            f.seek(rng.randrange(pages) * PAGE)
+            f.readinto(page_view)
+            reads += 1
+        elapsed = time.time() - start
+        res['random_read_iops'] = int(reads / elapsed) if elapsed > 0 else None
+
+        ## fsync latency of small overwrites.
+        deadline = time.time() + slices['fsync']
+        latencies = []
+        while time.time() < deadline:
+            _pwrite(fd, page, (len(latencies) % pages) * PAGE)
+            start = time.time()
+            os.fsync(fd)
+            latencies.append(round((time.time() - start) * 1000.0, 3))
+        res['fsync_ms'] = percentiles(latencies)
+        res['fsyncs'] = len(latencies)
+    except (IOError, OSError) as e:
+        res['error'] = errno.errorcode.get(e.errno, str(e))
+    finally:
+        os.close(fd)
+        try:
+            os.remove(name)
+        except OSError:
+            pass
+    return res
+
+
+def probe(paths, size=SIZE, seconds=SECONDS):
+    """probe_path for one writable path per filesystem in `paths`,
+    `seconds` split evenly between them.
+    """
+    paths = filesystems(paths)
+    return [probe_path(path, size, seconds / len(paths)) for path in paths]
@@ -1,11 +1,22 @@
+import errno
 import os
-from datetime import datetime, timedelta
+import stat
+import threading
+import time
 
+## Per-process state: the resolved warm file, the current snapshot and
+## the invocation counters. Lambda keeps the process between warm
+## invocations, so these are also per container.
+_process = {
+    'invocations': 0,
+    'warm_invocations': 0,
+    'cold_seconds': 0.0,
+    'warm_seconds': 0.0,
+}
+_lock = threading.Lock()
 
-def warm_file():
-    """
-    Determine what the OS is and change the warm location accordingly.
-    """
+
+def _resolve_warm_file():
     if os.getenv('AWS_ACCESS_KEY_ID', None) is not None:
         warm_file = "/tmp/lambda-is-warm"
     elif os.getenv('OS', None) == 'WinNT':
@@ -20,19 +31,117 @@ def warm_file():
     return warm_file
 
 
+def warm_file():
+    """
+    Determine what the OS is and change the warm location accordingly.
+    Resolved once per process; the environment doesn't change under us.
+    """
+    if 'warm_file' not in _process:
+        _process['warm_file'] = _resolve_warm_file()
+    return _process['warm_file']
+
+
+class WarmState(object):
+
+    """Everything we know about warmth, from a single os.stat.
+
+    `status` is warm/not warm/not possible, as is_warm() reports it.
+    Only a cold start with no warm file costs a second syscall, to tell
+    'not warm' from 'not possible' (read only filesystem).
+    """
+
+    def __init__(self, path=None):
+        self.path = path or warm_file()
+        self.taken = time.time()
+        self.mtime = None
+
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            st = None
+
+        if st is not None and stat.S_ISREG(st.st_mode):
+            self.status = 'warm'
+            self.mtime = st.st_mtime
+        elif os.access(os.path.dirname(self.path), os.W_OK):
+            self.status = 'not warm'
+        else:
+            self.status = 'not possible'
+
+    @property
+    def is_warm(self):
+        return self.status
+
+    @property
+    def warm_since(self):
+        return self.mtime
+
+    @property
+    def warm_for(self):
+        if self.mtime is None:
+            return 0
+        return self.taken - self.mtime
+
+    def mark_warm(self):
+        """Create the warm file if it isn't there; atomic across processes."""
+        if self.status != 'not warm':
+            return
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            os.close(fd)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                return
+        self.status = 'warm'
+        self.mtime = time.time()
+
+
+def snapshot(refresh=False):
+    """The current WarmState, taken once per invocation."""
+    if refresh or 'snapshot' not in _process:
+        _process['snapshot'] = WarmState()
+    return _process['snapshot']
+
+
+def begin_invocation():
+    """Take this invocation's snapshot and count it."""
+    state = snapshot(refresh=True)
+    with _lock:
+        _process['invocations'] += 1
+        if state.status == 'warm':
+            _process['warm_invocations'] += 1
+    return state
+
+
+def end_invocation(state=None):
+    """Mark warm and add this invocation's duration to the cold/warm totals."""
+    state = state or snapshot()
+    was_warm = state.status == 'warm'
+    state.mark_warm()
+
+    with _lock:
+        key = 'warm_seconds' if was_warm else 'cold_seconds'
+        _process[key] += time.time() - state.taken
+
+
+def invocation_stats():
+    """Invocations served by this container, and the time spent in them."""
+    with _lock:
+        return {
+            'count': _process['invocations'],
+            'warm': _process['warm_invocations'],
+            'cold_seconds': round(_process['cold_seconds'], 6),
+            'warm_seconds': round(_process['warm_seconds'], 6),
+        }
+
+
 def is_warm():
     """Returns warm/not warm/not possible
        to denote if the aws lambda function is warm,
        as determined by whether or not warm_file() exists (warm/not warm)
        or if the filesystem is readonly (not possible)
     """
-    if os.access(os.path.dirname(warm_file()), os.W_OK):
-        if os.path.isfile(warm_file()):
-            return 'warm'
-        else:
-            return 'not warm'
-    else:
-        return 'not possible'
+    return snapshot().is_warm
 
 def touch(fname, times=None):
     with open(fname, 'a'):
@@ -41,27 +150,14 @@ def touch(fname, times=None):
 def mark_warm():
     """Mark the lambda function as warm.
     """
-    if is_warm() == 'not warm':
-        try:
-            with open(warm_file(), 'a'):
-                os.utime(warm_file(), None)
-        except IOError as e:
-            pass
+    snapshot().mark_warm()
 
 def warm_since():
     """Return the date when the current warm version of the fn started.
     """
-    if is_warm() == 'warm':
-        ts = os.path.getmtime(warm_file())
-        return ts
+    return snapshot().warm_since
 
 
 def warm_for():
     """Return the elapsed time that the fn has been warm for."""
-    if is_warm() == 'warm':
-        ts = os.path.getmtime(warm_file())
-        warm_start = datetime.fromtimestamp(ts)
-        now = datetime.now()
-        return (now - warm_start).total_seconds()
-    else:
-        return 0
+    return snapshot().warm_for
@@ -0,0 +1,71 @@
+"""
+Incremental JSON and NDJSON writers.
+
+Results may contain generators (eg. the streaming permission scans);
+these are encoded as JSON arrays one item at a time, so a section can
+go from the scan to the output sink without ever being held in memory.
+"""
+import json
+
+string_types = (str, type(u''))
+
+
+def is_stream(obj):
+    """Whether `obj` is a one-shot iterator, eg. a generator."""
+    return hasattr(obj, '__next__') or hasattr(obj, 'next')
+
+
+def iterencode(obj):
+    """Yield the JSON encoding of `obj` in chunks.
+
+    dicts, lists, tuples and iterators are walked lazily; everything
+    else is handed to json.dumps.
+    """
+    if isinstance(obj, dict):
+        yield '{'
+        first = True
+        for key, value in obj.items():
+            if not first:
+                yield ', '
+            first = False
+            yield json.dumps(key if isinstance(key, string_types) else str(key))
+            yield ': '
+            for chunk in iterencode(value):
+                yield chunk
+        yield '}'
+    elif isinstance(obj, (list, tuple)) or is_stream(obj):
+        yield '['
+        first = True
+        for item in obj:
+            if not first:
+                yield ', '
+            first = False
+            for chunk in iterencode(item):
+                yield chunk
+        yield ']'
+    else:
+        yield json.dumps(obj)
+
+
+def dumps(obj):
+    """json.dumps that also accepts generators."""
+    return ''.join(iterencode(obj))
+
+
+def write_json(obj, fp):
+    """Write `obj` as one JSON document to the file-like `fp`."""
+    for chunk in iterencode(obj):
+        fp.write(chunk)
+
+
+def write_ndjson(records, fp):
+    """Write each of `records` as its own JSON line to `fp`.
+
+    Returns the number of records written.
+    """
+    count = 0
+    for record in records:
+        fp.write(dumps(record))
+        fp.write('\n')
+        count += 1
+    return count
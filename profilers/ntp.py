@@ -0,0 +1,210 @@
+"""
+Clock offset against a set of NTP servers.
+
+Every server is queried at once, each on its own non-blocking UDP
+socket, and the answers are collected with select() until all have
+answered or the deadline passes. Name resolution runs on daemon threads
+under the same deadline, so a dead resolver or a dropped packet costs
+at most `deadline` seconds and never hangs the profile.
+
+Each answer is corrected for network latency with the four timestamps
+of RFC 5905:
+
+    t1 client transmit, t2 server receive, t3 server transmit, t4 client receive
+    offset = ((t2 - t1) + (t3 - t4)) / 2
+    delay  = (t4 - t1) - (t3 - t2)
+
+Answers that don't echo our transmit timestamp, aren't from a server,
+or are kiss-o'-death packets (stratum 0) are discarded. The result is
+the median offset and delay of the servers that answered.
+
+The measurement is kept for `ttl` seconds, so warm invocations in a
+container reuse it instead of querying again.
+"""
+import select
+import socket
+import struct
+import threading
+import time
+
+SERVERS = ('0.pool.ntp.org', '1.pool.ntp.org', '2.pool.ntp.org', '3.pool.ntp.org')
+PORT = 123
+DEADLINE = 0.8
+TTL = 300
+
+## Seconds from 1900-01-01 (NTP era 0) to 1970-01-01.
+NTP_DELTA = 2208988800
+
+## li_vn_mode, stratum, poll, precision, root delay, root dispersion,
+## reference id, then reference, originate, receive and transmit
+## timestamps as (seconds, fraction) pairs.
+PACKET_FORMAT = '!BBbb3I8I'
+PACKET_SIZE = struct.calcsize(PACKET_FORMAT)
+
+MODE_CLIENT = 3
+MODE_SERVER = 4
+VERSION = 4
+
+_last = {}
+_lock = threading.Lock()
+
+
+def to_ntp(t):
+    """Unix time `t` as an NTP (seconds, fraction) pair."""
+    t += NTP_DELTA
+    seconds = int(t)
+    return seconds, int((t - seconds) * 2 ** 32) & 0xffffffff
+
+
+def from_ntp(seconds, fraction):
+    return seconds - NTP_DELTA + float(fraction) / 2 ** 32
+
+
+def request_packet(t1):
+    """A client request carrying `t1` as its transmit timestamp."""
+    return struct.pack(PACKET_FORMAT, (VERSION << 3) | MODE_CLIENT,
+                       0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, *to_ntp(t1))
+
+
+def parse_response(data):
+    """(mode, stratum, originate, receive, transmit) of a response; the
+    originate timestamp raw, as the (seconds, fraction) pair we sent.
+    """
+    if len(data) < PACKET_SIZE:
+        raise ValueError("Short NTP packet")
+    fields = struct.unpack(PACKET_FORMAT, data[:PACKET_SIZE])
+    return (fields[0] & 0x7, fields[1], (fields[9], fields[10]),
+            from_ntp(fields[11], fields[12]), from_ntp(fields[13], fields[14]))
+
+
+def offset_delay(t1, t2, t3, t4):
+    return ((t2 - t1) + (t3 - t4)) / 2.0, (t4 - t1) - (t3 - t2)
+
+
+def median(values):
+    values = sorted(values)
+    if not values:
+        return None
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def resolve(servers, port, deadline):
+    """Map server -> (family, sockaddr) or an error string, resolving
+    concurrently until `deadline`.
+    """
+    found = {}
+
+    def lookup(server):
+        try:
+            info = socket.getaddrinfo(server, port, 0, socket.SOCK_DGRAM)
+            found[server] = (info[0][0], info[0][4])
+        except (socket.error, IndexError) as e:
+            found[server] = type(e).__name__
+
+    threads = []
+    for server in servers:
+        t = threading.Thread(target=lookup, args=(server,))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join(max(deadline - time.time(), 0))
+    return dict((server, found.get(server, 'timeout')) for server in servers)
+
+
+def query(servers=SERVERS, port=PORT, deadline=DEADLINE):
+    """Query every server at once; map server -> {'offset', 'delay',
+    'stratum'} in seconds, or {'error': ...}.
+    """
+    end = time.time() + deadline
+    res = {}
+    pending = {}
+    try:
+        for server, address in resolve(servers, port, end).items():
+            if not isinstance(address, tuple):
+                res[server] = {'error': address}
+                continue
+            family, sockaddr = address
+            try:
+                sock = socket.socket(family, socket.SOCK_DGRAM)
+            except socket.error as e:
+                res[server] = {'error': type(e).__name__}
+                continue
+            sock.setblocking(False)
+            t1 = time.time()
+            try:
+                sock.sendto(request_packet(t1), sockaddr)
+            except socket.error as e:
+                sock.close()
+                res[server] = {'error': type(e).__name__}
+                continue
+            pending[sock] = (server, t1, to_ntp(t1))
+
+        while pending:
+            remaining = end - time.time()
+            if remaining <= 0:
+                break
+            readable = select.select(list(pending), [], [], remaining)[0]
+            for sock in readable:
+                try:
+                    data = sock.recv(1024)
+                except socket.error:
+                    ## e.g. ICMP port unreachable; keep waiting on the rest.
+                    continue
+                t4 = time.time()
+                server, t1, sent = pending[sock]
+                try:
+                    mode, stratum, originate, t2, t3 = parse_response(data)
+                except ValueError:
+                    continue
+                if mode != MODE_SERVER or originate != sent:
+                    continue
+                del pending[sock]
+                sock.close()
+                if stratum == 0:
+                    res[server] = {'error': 'kiss of death'}
+                    continue
+                offset, delay = offset_delay(t1, t2, t3, t4)
+                res[server] = {'offset': offset, 'delay': delay, 'stratum': stratum}
+    finally:
+        for sock, (server, _, _) in pending.items():
+            sock.close()
+            res[server] = {'error': 'timeout'}
+    return res
+
+
+def measure(servers=SERVERS, port=PORT, deadline=DEADLINE):
+    """Median offset and delay across `servers`, with each answer."""
+    answers = query(servers, port, deadline)
+    good = [a for a in answers.values() if 'offset' in a]
+    offset = median([a['offset'] for a in good])
+    return {
+        'offset': offset,
+        'delay': median([a['delay'] for a in good]),
+        'drift': abs(offset) if offset is not None else None,
+        'answered': len(good),
+        'servers': answers,
+        'measured_at': time.time(),
+    }
+
+
+def cached_measure(servers=SERVERS, port=PORT, deadline=DEADLINE, ttl=TTL):
+    """measure(), reused for `ttl` seconds by this process."""
+    key = (tuple(servers), port)
+    with _lock:
+        last = _last.get(key)
+        if last is not None and time.time() - last['measured_at'] < ttl:
+            return last
+        res = measure(servers, port, deadline)
+        ## Nothing answered: don't keep that around for a whole TTL.
+        if res['answered']:
+            _last[key] = res
+        return res
+
+
+def clear_cache():
+    with _lock:
+        _last.clear()
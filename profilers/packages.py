@@ -0,0 +1,224 @@
+"""
+Cached inventory of the importable top level modules and their versions.
+
+One scan of sys.path answers get_packages, get_package_versions and
+get_package_count. Versions come from the *.dist-info / *.egg-info
+metadata on disk (or importlib.metadata where available) instead of
+importing pkg_resources, which is by far the slowest import we had.
+
+The inventory is kept for the life of the process and persisted to
+/tmp, keyed on a fingerprint of the sys.path entries and their mtimes,
+so warm invocations (and new processes in the same container) skip the
+scan entirely until something is installed or removed.
+"""
+import json
+import os
+import re
+import sys
+import threading
+
+CACHE_FILE = '/tmp/profiler-packages.json'
+
+_lock = threading.Lock()
+_memo = {}
+
+
+def _module_suffixes():
+    try:
+        from importlib.machinery import all_suffixes
+        suffixes = all_suffixes()
+    except ImportError:
+        import imp
+        suffixes = [s[0] for s in imp.get_suffixes()]
+    ## Longest first, like inspect.getmodulename.
+    return sorted(suffixes, key=len, reverse=True)
+
+
+def _module_name(filename, suffixes):
+    for suffix in suffixes:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return None
+
+
+def _safe_key(name):
+    ## pkg_resources.safe_name(name).lower()
+    return re.sub('[^A-Za-z0-9.]+', '-', name).lower()
+
+
+def _modules_in(entry, suffixes):
+    """Top level module names in one sys.path entry, as pkgutil finds them."""
+    if not os.path.isdir(entry):
+        if not os.path.isfile(entry):
+            return []
+        ## Zipped eggs and the like; rare enough to leave to pkgutil.
+        import pkgutil
+        return [m[1] for m in pkgutil.iter_modules([entry])]
+
+    try:
+        filenames = sorted(os.listdir(entry))
+    except OSError:
+        return []
+
+    names = []
+    seen = set()
+    for fn in filenames:
+        modname = _module_name(fn, suffixes)
+        if modname == '__init__' or modname in seen:
+            continue
+
+        if not modname and '.' not in fn:
+            path = os.path.join(entry, fn)
+            try:
+                contents = os.listdir(path)
+            except OSError:
+                continue
+            if not any(_module_name(f, suffixes) == '__init__' for f in contents):
+                continue
+            modname = fn
+
+        if modname and '.' not in modname:
+            seen.add(modname)
+            names.append(modname)
+    return names
+
+
+def _read_metadata(path):
+    """Return (name, version) from a METADATA/PKG-INFO file or directory."""
+    if os.path.isdir(path):
+        for candidate in ('METADATA', 'PKG-INFO'):
+            if os.path.isfile(os.path.join(path, candidate)):
+                path = os.path.join(path, candidate)
+                break
+        else:
+            return None, None
+
+    name = version = None
+    try:
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    ## End of the headers.
+                    break
+                if line.startswith('Name:'):
+                    name = line[5:].strip()
+                elif line.startswith('Version:'):
+                    version = line[8:].strip()
+                if name and version:
+                    break
+    except (IOError, OSError, ValueError):
+        pass
+    return name, version
+
+
+def _distributions(paths):
+    """Map safe project name -> version, first one on the path wins."""
+    versions = {}
+
+    try:
+        from importlib import metadata
+    except ImportError:
+        metadata = None
+
+    if metadata is not None:
+        for dist in metadata.distributions(path=list(paths)):
+            name = dist.metadata['Name']
+            if name:
+                versions.setdefault(_safe_key(name), str(dist.version))
+        return versions
+
+    for entry in paths:
+        if not os.path.isdir(entry):
+            continue
+        try:
+            filenames = sorted(os.listdir(entry))
+        except OSError:
+            continue
+        for fn in filenames:
+            if fn.endswith('.dist-info') or fn.endswith('.egg-info'):
+                name, version = _read_metadata(os.path.join(entry, fn))
+                if name and version:
+                    versions.setdefault(_safe_key(name), version)
+    return versions
+
+
+def scan(paths):
+    """Scan `paths` and return the inventory as a plain dict."""
+    suffixes = _module_suffixes()
+    modules = []
+    seen = set()
+    for entry in paths:
+        for name in _modules_in(entry, suffixes):
+            if name not in seen:
+                seen.add(name)
+                modules.append(name)
+
+    dists = _distributions(paths)
+    versions = {}
+    for name in modules:
+        version = dists.get(_safe_key(name))
+        if version is not None:
+            versions[name] = {'version': version}
+
+    return {'modules': modules, 'versions': versions}
+
+
+def fingerprint(paths):
+    """Hash of the path entries and their mtimes."""
+    import hashlib
+    parts = []
+    for entry in paths:
+        try:
+            mtime = os.stat(entry).st_mtime
+        except OSError:
+            mtime = None
+        parts.append([entry, mtime])
+    return hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+def _load(cache_file, key):
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if cached.get('fingerprint') != key:
+        return None
+    return cached.get('inventory')
+
+
+def _store(cache_file, key, inventory):
+    tmp = '{}.{}.tmp'.format(cache_file, os.getpid())
+    try:
+        with open(tmp, 'w') as f:
+            json.dump({'fingerprint': key, 'inventory': inventory}, f)
+        os.rename(tmp, cache_file)
+    except (IOError, OSError):
+        pass
+
+
+def inventory(paths=None, cache_file=None):
+    """Return {'modules': [...], 'versions': {...}} for `paths` (sys.path).
+
+    Served from memory, then from `cache_file` (PROFILER_PACKAGE_CACHE,
+    default /tmp/profiler-packages.json; empty to disable), and only
+    scanned when neither matches the current fingerprint.
+    """
+    paths = list(sys.path if paths is None else paths)
+    if cache_file is None:
+        cache_file = os.getenv('PROFILER_PACKAGE_CACHE', CACHE_FILE)
+
+    with _lock:
+        key = fingerprint(paths)
+        if _memo.get('fingerprint') == key:
+            return _memo['inventory']
+
+        res = _load(cache_file, key) if cache_file else None
+        if res is None:
+            res = scan(paths)
+            if cache_file:
+                _store(cache_file, key, res)
+
+        _memo['fingerprint'] = key
+        _memo['inventory'] = res
+        return res
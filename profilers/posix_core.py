@@ -1,47 +1,62 @@
 import os
-import pkgutil
-import calendar
-import copy
-import pkg_resources
-import platform
-import socket
-from socket import socket, AF_INET, SOCK_DGRAM
-import re
-import struct
 import time
 
-from contextlib import closing
-from collections import OrderedDict
-from datetime import datetime, timedelta
 from profilers import is_warm
+from profilers import packages
+from profilers import procfs
 
+from profilers.cache import STATIC
 from profilers.profiler_base import Profiler
-from profilers.utils import call_shell_wrapper, contents_of_file, make_result_dict
-from profilers.posix_permissions import PosixPermissions
+from profilers.utils import call_shell_wrapper, contents_of_file, make_result_dict, shell_fallback
 
+## Everything else is imported by the lookup that needs it, so importing
+## this module (and with it, lambda init) stays cheap.
 
-class PosixCoreProfiler(Profiler):
+_permissions = {}
 
-    """Functions for specific data retreival."""
 
-    def check_time_drift():
-        ## Ignores network latency to the NTP server.
+def posix_permissions():
+    """The PosixPermissions shared by the lookups, created on first use."""
+    if 'instance' not in _permissions:
+        from profilers.posix_permissions import PosixPermissions
+        _permissions['instance'] = PosixPermissions()
+    return _permissions['instance']
+
 
-        NTP_PACKET_FORMAT = "!12I"
-        NTP_DELTA = 2208988800L # 1970-01-01 00:00:00
-        NTP_QUERY = '\x1b' + 47 * '\0'
-        host = "pool.ntp.org"
-        port = 123
+def walk_complete(paths):
+    """False when the permissions walk that produced `paths` ran out of
+    entries or time, so a partial list isn't cached for the container.
+    """
+    stats = _permissions['instance'].walk_stats if 'instance' in _permissions else None
+    return not stats or stats.get('truncated') not in ('entries', 'time')
 
-        with closing(socket(AF_INET, SOCK_DGRAM)) as s:
-            s.sendto(NTP_QUERY, ("pool.ntp.org", 123))
-            msg, address = s.recvfrom(1024)
-            local_time = time.time()
-        unpacked = struct.unpack(NTP_PACKET_FORMAT,
-                       msg[0:struct.calcsize(NTP_PACKET_FORMAT)])
-        ntp_time = unpacked[10] + float(unpacked[11]) / 2**32 - NTP_DELTA
 
-        return abs(ntp_time - local_time)
+def ntp_measurement():
+    """NTP offset and delay shared by the time lookups: the servers in
+    PROFILER_NTP_SERVERS (comma separated) queried concurrently within
+    PROFILER_NTP_DEADLINE_MS, and reused for PROFILER_NTP_TTL seconds.
+    """
+    from profilers import ntp
+    servers = [s for s in os.getenv('PROFILER_NTP_SERVERS', '').split(',') if s]
+    return ntp.cached_measure(
+        servers or ntp.SERVERS,
+        deadline=int(os.getenv('PROFILER_NTP_DEADLINE_MS', int(ntp.DEADLINE * 1000))) / 1000.0,
+        ttl=float(os.getenv('PROFILER_NTP_TTL', ntp.TTL)))
+
+
+class PosixCoreProfiler(Profiler):
+
+    """Functions for specific data retreival."""
+
+    def get_ntp():
+        ''' Median clock offset and delay against several NTP
+        servers, with each server's answer (see ntp_measurement). '''
+        return ntp_measurement()
+
+    def check_time_drift():
+        ## Seconds between our clock and NTP time, corrected for network
+        ## latency; None when no server answered in time.
+        return ntp_measurement()['drift']
 
     def check_interesting_env_vars():
         ## Returns a subset of environment variables that are interesting:
@@ -74,9 +89,18 @@ class PosixCoreProfiler(Profiler):
     def check_source_editable():
         ## check if we can edit the file on disk
         flag_string = 'profiler_test'
-        
-        call_shell_wrapper(['echo "{}" >> {}'.format(flag_string, __file__)])
-        res = call_shell_wrapper(['tail -n 1 {}'.format(__file__)])
+
+        if shell_fallback():
+            call_shell_wrapper(['echo "{}" >> {}'.format(flag_string, __file__)])
+            res = call_shell_wrapper(['tail -n 1 {}'.format(__file__)])
+        else:
+            try:
+                with open(__file__, 'a') as f:
+                    f.write('{}\n'.format(flag_string))
+            except IOError:
+                return False
+            lines = (procfs.read_file(__file__) or '').splitlines(True)
+            res = lines[-1] if lines else ''
 
         if res == '{}\n'.format(flag_string):
             return True
@@ -100,6 +124,10 @@ class PosixCoreProfiler(Profiler):
     
     def check_other_runtimes():
         ## for now, just node.  Can expand as wanted, thus we return a dict.
+        ## Natively we can only tell whether the binary is on the PATH.
+
+        if not shell_fallback():
+            return {'node': procfs.find_executable('node') is not None}
 
         node_test = call_shell_wrapper(['node -e \'console.log("foo");\''])
 
@@ -121,24 +149,24 @@ class PosixCoreProfiler(Profiler):
         ## see http://man7.org/linux/man-pages/man5/proc.5.html
         ## If we can't check permissions, we assume none.
         
-        statline = call_shell_wrapper(["grep 'CapEff' /proc/1/status"])
-        flags = 0
-
-        if statline:
-            bitmask = re.match(r'CapEff:\t(\d+)\n', statline).groups()
-
-            if len(bitmask) == 1:
-                flags = int(bitmask[0])
+        if shell_fallback():
+            statline = call_shell_wrapper(["grep 'CapEff' /proc/1/status"])
+        else:
+            statline = procfs.status_field(1, 'CapEff')
 
-        return flags
+        return procfs.parse_capabilities(statline)
 
     def get_pwd():
-        return call_shell_wrapper(["pwd"])
+        if shell_fallback():
+            return call_shell_wrapper(["pwd"])
+        return os.getcwd()
 
     def get_release_version():
+        import platform
         return platform.release()
 
     def get_uptime():
+        from datetime import timedelta
         try:
             with open('/proc/uptime', 'r') as f:
                 uptime_seconds = float(f.readline().split()[0])
@@ -172,6 +200,7 @@ class PosixCoreProfiler(Profiler):
             }
         }
 
+        import copy
         env_vars = copy.deepcopy(os.environ.__dict__.get('data'))
 
         for var, action in sanitize_envvars.iteritems():
@@ -187,7 +216,30 @@ class PosixCoreProfiler(Profiler):
         
 
     def get_df():
-        return call_shell_wrapper(["df", "-h"])
+        if shell_fallback():
+            return call_shell_wrapper(["df", "-h"])
+        return procfs.disk_usage()
+
+    def get_io(seconds=None, found=None):
+        ''' Throughput, random read IOPS and fsync latency of /tmp
+        and every other path found writable (`found`, the permissions
+        result; the writable roots when it wasn't listed), one path per
+        filesystem (see io_probe). PROFILER_IO_PATHS adds paths (colon
+        separated); PROFILER_IO_SIZE sets the size per path and
+        PROFILER_IO_SECONDS the time for all of them, capped at `seconds`.
+        '''
+        from profilers import io_probe
+        if isinstance(found, list):
+            paths = ['/tmp'] + found
+        else:
+            permissions = posix_permissions()
+            paths = ['/tmp'] + [p for p in permissions.path_set
+                                if permissions.path_is_writable(p)]
+        paths += [p for p in os.getenv('PROFILER_IO_PATHS', '').split(':') if p]
+        limit = float(os.getenv('PROFILER_IO_SECONDS', io_probe.SECONDS))
+        return io_probe.probe(paths,
+                              size=int(os.getenv('PROFILER_IO_SIZE', io_probe.SIZE)),
+                              seconds=min(limit, seconds) if seconds is not None else limit)
 
     def get_cpuinfo():
         ''' Return the information in /proc/cpuinfo
@@ -195,75 +247,80 @@ class PosixCoreProfiler(Profiler):
         cpu_info['proc0']={...}
         cpu_info['proc1']={...}
 
+        With PROFILER_CPUINFO_DEDUP=1 identical processors are collapsed
+        into groups (see procfs.dedup_cpuinfo).
         '''
-        cpuinfo = OrderedDict()
-        procinfo = OrderedDict()
+        return procfs.read_cpuinfo(dedup=os.getenv('PROFILER_CPUINFO_DEDUP', '0') == '1')
 
-        nprocs = 0
-        try:
-            with open('/proc/cpuinfo') as f:
-                for line in f:
-                    if not line.strip():
-                        # end of one processor
-                        cpuinfo['proc%s' % nprocs] = procinfo
-                        nprocs = nprocs+1
-                        # Reset
-                        procinfo = OrderedDict()
-                    else:
-                        if len(line.split(':')) == 2:
-                            procinfo[
-                                line.split(':')[0].strip()
-                            ] = line.split(':')[1].strip()
-                        else:
-                            procinfo[line.split(':')[0].strip()] = ''
-        except Exception as e:
-            """Currently only works for posix."""
-            pass
-        
-        return cpuinfo
+    def get_cpu_steal(seconds=None, found=None):
+        ''' Achieved ops/sec of a calibrated kernel, steal %, run
+        queue wait and thread/process scaling (see cpu_probe).
+        PROFILER_CPU_PROBE_SECONDS sets the time, capped at `seconds`,
+        and PROFILER_CPU_KERNEL the kernel (sha256, or numpy). '''
+        from profilers import cpu_probe
+        limit = float(os.getenv('PROFILER_CPU_PROBE_SECONDS', cpu_probe.SECONDS))
+        return cpu_probe.probe(
+            seconds=min(limit, seconds) if seconds is not None else limit,
+            kernel=os.getenv('PROFILER_CPU_KERNEL', 'sha256'))
 
 
     def get_meminfo():
         ''' Return the information in /proc/meminfo
-        as a dictionary '''
-
-        meminfo = OrderedDict()
-        try:
-            with open('/proc/meminfo') as f:
-                for line in f:
-                    meminfo[line.split(':')[0]] = line.split(':')[1].strip()
-        except Exception as e:
-            """Currently only works for posix."""
-            pass
-        
-        return meminfo
+        as a dictionary; values in kB as integers
+        with PROFILER_MEMINFO_INT=1 '''
+        return procfs.read_meminfo(as_int=os.getenv('PROFILER_MEMINFO_INT', '0') == '1')
 
 
     def get_packages():
-        return [x[1] for x in pkgutil.iter_modules()]
+        return list(packages.inventory()['modules'])
 
     def get_package_versions():
-        results = {}
-        for x in pkgutil.iter_modules():
-            try:
-                results[x[1]] = {
-                    'version': str(pkg_resources.get_distribution(x[1]).version)
-                }
-            except:
-                pass
-        return results
+        return dict(packages.inventory()['versions'])
 
     def get_package_count():
-        return len([x[1] for x in pkgutil.iter_modules()])
+        return len(packages.inventory()['modules'])
 
     def get_processes():
-        return call_shell_wrapper(["ps", "aux"])
+        """
+        The process table, column-wise (see procfs.ProcessSnapshot).
+
+        PROFILER_PROCESS_FILTER=non_runtime leaves out this process and
+        its ancestors, PROFILER_PROCESS_MAX_ROWS caps the rows and
+        PROFILER_PROCESS_SAMPLE_MS=N adds cpu_percent over N ms.
+        """
+        if shell_fallback():
+            return call_shell_wrapper(["ps", "aux"])
+
+        exclude = None
+        if os.getenv('PROFILER_PROCESS_FILTER', '') == 'non_runtime':
+            exclude = procfs.runtime_pids()
+        max_rows = os.getenv('PROFILER_PROCESS_MAX_ROWS', None)
+        max_rows = int(max_rows) if max_rows else None
+        sample_ms = int(os.getenv('PROFILER_PROCESS_SAMPLE_MS', 0))
+
+        if sample_ms:
+            snapshot = procfs.ProcessSnapshot.sample(sample_ms / 1000.0, max_rows, exclude)
+        else:
+            snapshot = procfs.ProcessSnapshot.take(max_rows, exclude)
+        return snapshot.to_dict()
 
     def get_timestamp():
+        import calendar
+        from datetime import datetime
         return calendar.timegm(datetime.utcnow().utctimetuple())
 
+    def get_permissions():
+        """
+        Writable paths. With PROFILER_STREAM_PERMISSIONS=1 this is a
+        generator, walked only as the results are serialized.
+        """
+        if os.getenv('PROFILER_STREAM_PERMISSIONS', '0') == '1':
+            return posix_permissions().iter_writable_paths()
+        return posix_permissions().most_writable_paths()
+
     def get_ipaddress():
         # http://stackoverflow.com/questions/166506/finding-local-ip-addresses-using-pythons-stdlib/25850698#25850698
+        import socket
         local_ip_address='0.0.0.0'
         try:
             s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -285,6 +342,7 @@ class PosixCoreProfiler(Profiler):
         "is_warm":    is_warm.is_warm,
         "warm_since": is_warm.warm_since,
         "warm_for":   is_warm.warm_for,
+        "invocations": is_warm.invocation_stats,
         # "dmesg":      get_dmesg,
         "cpuinfo":    get_cpuinfo,
         "meminfo":    get_meminfo,
@@ -296,14 +354,73 @@ class PosixCoreProfiler(Profiler):
         "ipaddress":  get_ipaddress,
         "uptime":     get_uptime,
         "time_drift": check_time_drift,
+        "ntp":        get_ntp,
         "env_subset": check_interesting_env_vars,
         "source_editable": check_source_editable,
         "other_runtimes": check_other_runtimes,
         "docker_sockets": check_docker_containers,
         "proc_capabilities": check_capabilities,
-        "permissions": PosixPermissions().most_writable_paths
+        "permissions": get_permissions
+    }
+
+    lookup_ttls = {
+        "cpuinfo":    STATIC,
+        "release":    STATIC,
+        "packages":   STATIC,
+        "package_versions": STATIC,
+        "package_count": STATIC,
+        "proc_capabilities": STATIC,
+        "other_runtimes": STATIC,
+        "docker_sockets": STATIC,
+        "permissions": STATIC,
     }
 
+    lookup_cacheable = {
+        "permissions": walk_complete,
+    }
+
+    lookup_timeouts = {
+        "time_drift": 1.0,
+        "ntp":        1.0,
+        "ipaddress":  0.5,
+        "other_runtimes": 1.0,
+    }
+
+    ## Active benchmarks, off unless their flag is set to 1. They run
+    ## one at a time after the other lookups, so that they neither skew
+    ## nor are skewed by them, within what is left of the budget.
+    probes = {
+        "io": ('PROFILER_IO_PROBE', get_io),
+        "cpu_steal": ('PROFILER_CPU_PROBE', get_cpu_steal),
+    }
+
+    ## Not worth starting a probe with less time than this left.
+    MIN_PROBE_SECONDS = 0.2
+
+    @classmethod
+    def run_probes(cls, res, budget=None, started=None):
+        """Results of the enabled probes. `budget` is the time in seconds
+        the whole run has from `started`; without it every probe runs for
+        its default time.
+        """
+        from profilers.executor import error_result
+        found = {}
+        for name in sorted(cls.probes):
+            flag, probe = cls.probes[name]
+            if os.getenv(flag, '0') != '1':
+                continue
+            seconds = None
+            if budget is not None:
+                seconds = budget - (time.time() - started)
+                if seconds < cls.MIN_PROBE_SECONDS:
+                    found[name] = {"status": "skipped"}
+                    continue
+            try:
+                found[name] = probe(seconds, res.get('permissions'))
+            except Exception as e:
+                found[name] = error_result(e)
+        return found
+
     @staticmethod
     def jsonify_results(d):
         if 'warm_since' in d:
@@ -314,11 +431,41 @@ class PosixCoreProfiler(Profiler):
         return d
 
     @classmethod
-    def run(cls):
-        res = make_result_dict(cls.lookups)
-
-        import pdb
-        # pdb.set_trace()
-        is_warm.mark_warm()
+    def run(cls, sample=False, sample_interval=None, keep_sampling=False, **options):
+        ## One stat of the warm file answers all the warm lookups.
+        warm_state = is_warm.begin_invocation()
+        if 'instance' in _permissions:
+            _permissions['instance'].walk_stats = None
+
+        ## With `sample`, memory, load and CPU are sampled every
+        ## `sample_interval` seconds while the lookups run. With
+        ## `keep_sampling` the sampler is left running, for the caller
+        ## to end() once the rest of the invocation is done; '_samples'
+        ## then holds the samples so far.
+        sampler = None
+        if sample:
+            from profilers.sampler import shared_sampler
+            sampler = shared_sampler(sample_interval)
+            sampler.begin()
+
+        finished = False
+        try:
+            started = time.time()
+            res = cls.collect(**options)
+            res.update(cls.run_probes(res, options.get('budget'), started))
+            finished = True
+        finally:
+            if sampler is not None and not (finished and keep_sampling):
+                sampler.end_sampling()
+
+        if sampler is not None:
+            res['_samples'] = sampler.to_dict() if keep_sampling else sampler.end()
+
+        is_warm.end_invocation(warm_state)
+
+        ## Directories the permissions walk revalidated vs reused, when
+        ## it ran (not when cached or streamed).
+        if 'instance' in _permissions and _permissions['instance'].walk_stats:
+            res['_walk'] = _permissions['instance'].walk_stats
 
         return cls.jsonify_results(res)
@@ -1,5 +1,8 @@
 from profilers.profiler_base import Profiler
-from profilers.utils import call_shell_wrapper, contents_of_file, make_result_dict
+import os
+
+from profilers import procfs
+from profilers.utils import call_shell_wrapper, contents_of_file, make_result_dict, shell_fallback
 
 
 class PosixExtraProfiler(Profiler):
@@ -8,10 +11,14 @@ class PosixExtraProfiler(Profiler):
         return contents_of_file("/etc/issue")
 
     def get_uname():
-        return call_shell_wrapper(["uname", "-a"])
+        if shell_fallback():
+            return call_shell_wrapper(["uname", "-a"])
+        return " ".join(os.uname())
 
     def get_dmesg():
-        return call_shell_wrapper(["dmesg"])
+        if shell_fallback():
+            return call_shell_wrapper(["dmesg"])
+        return procfs.read_kmsg()
 
     lookups = {
         "/etc/issue": get_etc_issue,
@@ -20,8 +27,8 @@ class PosixExtraProfiler(Profiler):
     }
 
     @classmethod
-    def run(cls):
-        res = make_result_dict(cls.lookups)
+    def run(cls, **options):
+        res = cls.collect(**options)
 
         return res
         
@@ -1,13 +1,83 @@
 import os
 import stat
 
+from profilers.fs_walker import DirIndex, WalkBudget, walk, walk_roots
+
+R_BIT = 4
+W_BIT = 2
+X_BIT = 1
+
+## os.access checks the real ids unless told otherwise (python 3 only).
+if getattr(os, 'supports_effective_ids', None) and os.access in os.supports_effective_ids:
+    def _access(path, flag):
+        return os.access(path, flag, effective_ids=True)
+else:
+    def _access(path, flag):
+        return os.access(path, flag)
+
+
+class AccessEvaluator(object):
+
+    """
+    Effective read/write/execute for a stat_result, all three at once.
+
+    'mask' mode uses the same rules as PosixPermissions.check_octals_in_path
+    (other bits, plus group bits for our groups, plus owner bits if we own
+    it) but in a single pass of shifts and masks, with the groups in a
+    frozenset. 'access' mode asks the kernel instead, with os.access
+    against the effective ids (faccessat(AT_EACCESS)) where supported,
+    which also accounts for root, ACLs and read-only mounts.
+    """
+
+    def __init__(self, uid=None, groups=None, mode='mask'):
+        self.uid = os.getuid() if uid is None else uid
+        self.groups = frozenset(os.getgroups() if groups is None else groups)
+        if mode not in ('mask', 'access'):
+            raise ValueError("mode must be 'mask' or 'access'")
+        self.mode = mode
+
+    def bits(self, path_stat, path=None):
+        """Return the R_BIT | W_BIT | X_BIT mask we have on the path."""
+        if self.mode == 'access':
+            return self._access_bits(path)
+
+        mode = path_stat.st_mode
+        bits = mode & 7
+        if path_stat.st_gid in self.groups:
+            bits |= (mode >> 3) & 7
+        if path_stat.st_uid == self.uid:
+            bits |= (mode >> 6) & 7
+        return bits
+
+    def _access_bits(self, path):
+        bits = 0
+        for bit, flag in ((R_BIT, os.R_OK), (W_BIT, os.W_OK), (X_BIT, os.X_OK)):
+            if _access(path, flag):
+                bits |= bit
+        return bits
+
+    def __call__(self, path_stat, path=None):
+        """(readable, writable, executable) for the path."""
+        bits = self.bits(path_stat, path)
+        return (bool(bits & R_BIT), bool(bits & W_BIT), bool(bits & X_BIT))
+
+
 class PosixPermissions():
 
     """For getting a tree of what filesystem locations are writable."""
-    
-    def __init__(self):
+
+    ## Where most_writable_paths keeps its DirIndex between runs.
+    INDEX_FILE = '/tmp/profiler-walk-index'
+
+    path_set = ["/bin", "/boot", "/builddir", "/etc", "/home", "/lib", "/lib64", "/media", "/mnt", "/opt", "/root", "/sbin", "/selinux", "/srv", "/tmp", "/usr", "/var"]
+
+    def __init__(self, access_mode=None):
         self.my_uid = os.getuid()
         self.my_groups = os.getgroups()
+        self.evaluator = AccessEvaluator(
+            self.my_uid, self.my_groups,
+            mode=access_mode or os.getenv('PROFILER_ACCESS_MODE', 'mask'))
+        self.walk_stats = None
     
     def _folders_in(self, path):
         return [os.path.join(path, f) for f in os.listdir(path) if os.path.isdir(os.path.join(path, f))]
@@ -36,13 +106,16 @@ class PosixPermissions():
         except OSError:
             ## If the file doesn't exist, eg /proc items
             return False
-            
+
+        return self.check_octals_in_stat(path_stat, fn)
+
+    def check_octals_in_stat(self, path_stat, fn):
         path_mode = stat.S_IMODE(path_stat.st_mode)
         path_gid = path_stat.st_gid
         path_uid = path_stat.st_uid
     
-        path_mode_owner = path_mode / 64 % 8
-        path_mode_group = path_mode / 8 % 8
+        path_mode_owner = path_mode // 64 % 8
+        path_mode_group = path_mode // 8 % 8
         path_mode_all = path_mode % 8
 
         ## owner
@@ -62,14 +135,27 @@ class PosixPermissions():
     
         return False
 
+    def access_from_stat(self, path_stat, path=None):
+        """
+        (readable, writable, executable) for an already stat'd path.
+        """
+        return self.evaluator(path_stat, path)
+
+    def _path_bits(self, path):
+        try:
+            return self.evaluator.bits(os.stat(path), path)
+        except OSError:
+            ## If the file doesn't exist, eg /proc items
+            return 0
+
     def path_is_writable(self, path):
-        return self.check_octals_in_path(path, self._octal_is_writable)
+        return bool(self._path_bits(path) & W_BIT)
 
     def path_is_execable(self, path):
-        return self.check_octals_in_path(path, self._octal_is_executable)
+        return bool(self._path_bits(path) & X_BIT)
 
     def path_is_readable(self, path):
-        return self.check_octals_in_path(path, self._octal_is_readable)
+        return bool(self._path_bits(path) & R_BIT)
 
     def get_folder_permission_tree(self, path):
         is_writable = self.path_is_writable(path)
@@ -100,17 +186,77 @@ class PosixPermissions():
 
         return paths
 
-    def most_writable_paths(self):
+    def iter_permission_records(self, paths=None, budget=None):
+        """
+        Yield (path, mode_bits, writable, readable, executable) for every
+        directory visited, as it is discovered. Walks the roots one after
+        the other, so memory stays constant however big the tree is.
+        """
+        budget = budget or self.walk_budget()
+        for root in paths or self.path_set:
+            for path, path_stat, bits in walk(root, self.access_from_stat, budget):
+                readable, writable, executable = bits
+                yield (path, stat.S_IMODE(path_stat.st_mode),
+                       writable, readable, executable)
+
+    def iter_writable_paths(self, paths=None, budget=None):
+        """Streaming variant of most_writable_paths."""
+        for record in self.iter_permission_records(paths, budget):
+            if record[2]:
+                yield record[0]
+
+    def walk_budget(self):
+        """
+        Limits for the walk, from the environment. All unset by default:
+        PROFILER_WALK_MAX_DEPTH, PROFILER_WALK_MAX_ENTRIES,
+        PROFILER_WALK_SECONDS and PROFILER_WALK_PRUNE (':'-separated globs).
+        """
+        def number(name, kind):
+            value = os.getenv(name, None)
+            return kind(value) if value else None
+
+        prune = os.getenv('PROFILER_WALK_PRUNE', '')
+        return WalkBudget(max_depth=number('PROFILER_WALK_MAX_DEPTH', int),
+                          max_entries=number('PROFILER_WALK_MAX_ENTRIES', int),
+                          seconds=number('PROFILER_WALK_SECONDS', float),
+                          prune=[p for p in prune.split(':') if p])
+
+    def walk_index(self):
+        """
+        The DirIndex from the last walk, PROFILER_WALK_INDEX (default
+        /tmp/profiler-walk-index; empty disables it).
+        """
+        path = os.getenv('PROFILER_WALK_INDEX', self.INDEX_FILE)
+        if not path:
+            return None
+        owner = [self.my_uid, sorted(self.my_groups), self.evaluator.mode]
+        return DirIndex(path, owner).load()
+
+    def most_writable_paths(self, budget=None, workers=None, index=None):
         """
         Not 'all writable paths' because we emit some folders
         such as /proc and /dev."
+
+        Only directories whose metadata changed since the last walk are
+        listed again; walk_stats reports how many were revalidated and
+        how many reused.
         """
-        path_set = ["/bin", "/boot", "/builddir", "/etc", "/home", "/lib", "/lib64", "/media", "/mnt", "/opt", "/root", "/sbin", "/selinux", "/srv", "/tmp", "/usr", "/var"]
+        if workers is None:
+            workers = int(os.getenv('PROFILER_WALK_WORKERS', 4))
+        if index is None:
+            index = self.walk_index()
+        budget = budget or self.walk_budget()
 
-        paths = []
-        for p in path_set:
-            paths += self.list_of_writable_paths_in_path(p)
+        paths = walk_roots(self.path_set,
+                           self.access_from_stat,
+                           budget=budget,
+                           workers=workers,
+                           index=index)
 
+        self.walk_stats = budget.stats()
+        if index is not None:
+            ## A truncated walk didn't see everything; keep the old index.
+            if budget.truncated not in ('entries', 'time'):
+                index.save()
+            self.walk_stats.update(index.stats())
         return paths
-
-
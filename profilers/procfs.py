@@ -0,0 +1,450 @@
+"""
+Readers for /proc and friends.
+
+Native replacements for the shell commands the profilers used to run
+(`ps aux`, `df -h`, `grep CapEff /proc/1/status`, `dmesg`), so a
+profile can be collected without forking a single process.
+"""
+import errno
+import os
+import time
+
+try:
+    _intern = intern
+except NameError:
+    from sys import intern as _intern
+
+
+def read_file(path, mode='r'):
+    """Return the whole file in one read, or None if it can't be read."""
+    try:
+        with open(path, mode) as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def status_field(pid, field):
+    """Return the value of `field` in /proc/[pid]/status, or None."""
+    status = read_file('/proc/{}/status'.format(pid))
+    if status is None:
+        return None
+
+    prefix = field + ':'
+    for line in status.splitlines():
+        if line.startswith(prefix):
+            return line[len(prefix):].strip()
+    return None
+
+
+def parse_capabilities(statline):
+    """Return the effective capability mask in a 'CapEff:' status line.
+
+    The kernel prints the mask in hex; if the line can't be parsed we
+    assume no capabilities.
+    """
+    if not statline:
+        return 0
+
+    value = statline.strip()
+    if value.startswith('CapEff:'):
+        value = value[len('CapEff:'):].strip()
+
+    try:
+        return int(value, 16)
+    except ValueError:
+        return 0
+
+
+## Keys that differ between otherwise identical processor blocks.
+PER_PROCESSOR_KEYS = ('processor', 'core id', 'apicid', 'initial apicid', 'cpu MHz')
+
+
+def parse_cpuinfo(text):
+    """Return the processor blocks of /proc/cpuinfo `text` as dicts.
+
+    One str.partition per line. Keys are interned and equal values
+    shared, since every block repeats the same keys and, mostly, the
+    same values (the flags line alone is ~1KB).
+    """
+    blocks = []
+    block = {}
+    values = {}
+    for line in text.splitlines():
+        key, _, value = line.partition(':')
+        key = key.strip()
+        if not key:
+            # end of one processor
+            if block:
+                blocks.append(block)
+                block = {}
+            continue
+        value = value.strip()
+        block[_intern(key)] = values.setdefault(value, value)
+    if block:
+        blocks.append(block)
+    return blocks
+
+
+def dedup_cpuinfo(blocks):
+    """Collapse identical processor blocks.
+
+    Blocks that only differ in PER_PROCESSOR_KEYS become one group:
+    {'processors': [ids], 'info': {shared keys},
+     'per_processor': {key: [value per processor]}}.
+    """
+    groups = []
+    by_info = {}
+    varying = frozenset(PER_PROCESSOR_KEYS)
+    for i, block in enumerate(blocks):
+        ## The kernel prints the keys in the same order in every block.
+        signature = tuple(item for item in block.items() if item[0] not in varying)
+        group = by_info.get(signature)
+        if group is None:
+            group = by_info[signature] = {'processors': [], 'info': dict(signature),
+                                          'per_processor': {}}
+            groups.append(group)
+        group['processors'].append(_processor_id(block, i))
+        for key in PER_PROCESSOR_KEYS:
+            if key != 'processor' and key in block:
+                group['per_processor'].setdefault(key, []).append(block[key])
+    return {'count': len(blocks), 'groups': groups}
+
+
+def _processor_id(block, default):
+    try:
+        return int(block.get('processor', default))
+    except ValueError:
+        return default
+
+
+def read_cpuinfo(dedup=False, path='/proc/cpuinfo'):
+    """/proc/cpuinfo as {'proc0': {...}, ...}, or deduplicated."""
+    text = read_file(path)
+    blocks = parse_cpuinfo(text) if text else []
+    if dedup:
+        return dedup_cpuinfo(blocks)
+    return dict(('proc%s' % i, block) for i, block in enumerate(blocks))
+
+
+def parse_meminfo(text, as_int=False):
+    """Return /proc/meminfo `text` as a dict of its fields.
+
+    Values are the strings the kernel prints ('2048 kB') unless `as_int`,
+    which returns them as integers in kB (counts, like HugePages_Total,
+    as plain integers).
+    """
+    meminfo = {}
+    for line in text.splitlines():
+        key, sep, value = line.partition(':')
+        if not sep:
+            continue
+        value = value.strip()
+        if as_int:
+            ## The kernel only ever prints kB, or no unit for counts.
+            try:
+                value = int(value.partition(' ')[0])
+            except ValueError:
+                pass
+        meminfo[_intern(key)] = value
+    return meminfo
+
+
+def read_meminfo(as_int=False, path='/proc/meminfo'):
+    text = read_file(path)
+    return parse_meminfo(text, as_int) if text else {}
+
+
+def _user_name(uid, cache={}):
+    if uid not in cache:
+        try:
+            import pwd
+            cache[uid] = pwd.getpwuid(uid).pw_name
+        except (ImportError, KeyError):
+            cache[uid] = str(uid)
+    return cache[uid]
+
+
+def read_process(pid, clock_ticks, page_kb, uid_from='status'):
+    """Return one process table row for `pid`, or None if it went away.
+
+    The owner is the real uid from /proc/[pid]/status by default; with
+    uid_from='stat' it is the owner of /proc/[pid] (the effective uid,
+    as ps reports it), which saves reading status.
+    """
+    stat = read_file('/proc/{}/stat'.format(pid))
+    if stat is None:
+        return None
+
+    ## comm may contain spaces and parens, so split on the last ')'.
+    head, _, tail = stat.rpartition(')')
+    comm = head.partition('(')[2]
+    fields = tail.split()
+
+    if uid_from == 'stat':
+        try:
+            uid = os.stat('/proc/{}'.format(pid)).st_uid
+        except OSError:
+            return None
+    else:
+        uid = status_field(pid, 'Uid')
+        uid = int(uid.split()[0]) if uid else -1
+
+    cmdline = read_file('/proc/{}/cmdline'.format(pid)) or ''
+    command = cmdline.rstrip('\0').replace('\0', ' ') or '[{}]'.format(comm)
+
+    return {
+        'pid': int(pid),
+        'ppid': int(fields[1]),
+        'user': _user_name(uid),
+        'state': fields[0],
+        'threads': int(fields[17]),
+        'cpu_seconds': (int(fields[11]) + int(fields[12])) / float(clock_ticks),
+        'vsz_kb': int(fields[20]) // 1024,
+        'rss_kb': int(fields[21]) * page_kb,
+        'command': command,
+    }
+
+
+def read_process_table():
+    """Return a list of process rows read straight from /proc/[pid]."""
+    clock_ticks = os.sysconf('SC_CLK_TCK')
+    page_kb = os.sysconf('SC_PAGE_SIZE') // 1024
+
+    processes = []
+    try:
+        pids = sorted(int(p) for p in os.listdir('/proc') if p.isdigit())
+    except OSError:
+        return processes
+
+    for pid in pids:
+        try:
+            row = read_process(pid, clock_ticks, page_kb)
+        except (IndexError, ValueError):
+            row = None
+        if row is not None:
+            processes.append(row)
+
+    return processes
+
+
+def _ppid(pid):
+    stat = read_file('/proc/{}/stat'.format(pid))
+    if stat is None:
+        return None
+    try:
+        return int(stat.rpartition(')')[2].split()[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def runtime_pids(pid=None):
+    """`pid` (this process) and its ancestors: the runtime that runs us."""
+    pid = os.getpid() if pid is None else pid
+    pids = set()
+    while pid and pid not in pids:
+        pids.add(pid)
+        pid = _ppid(pid)
+    return pids
+
+
+class ProcessSnapshot(object):
+
+    """The process table at one moment, stored column-wise.
+
+    Numeric columns are `array`s and text columns lists, one entry per
+    process, so a table costs a handful of objects instead of a dict per
+    row. to_dict() serializes it the same way: {column: [values]}.
+    """
+
+    NUMERIC = (('pid', 'l'), ('ppid', 'l'), ('threads', 'l'),
+               ('cpu_seconds', 'd'), ('vsz_kb', 'l'), ('rss_kb', 'l'))
+    TEXT = ('user', 'state', 'command')
+    COLUMNS = ('pid', 'ppid', 'user', 'state', 'threads', 'cpu_seconds',
+               'vsz_kb', 'rss_kb', 'command')
+
+    def __init__(self):
+        from array import array
+        self.columns = dict((name, array(code)) for name, code in self.NUMERIC)
+        for name in self.TEXT:
+            self.columns[name] = []
+        self.taken = time.time()
+        self.truncated = False
+        self.cpu_percent = None
+
+    def __len__(self):
+        return len(self.columns['pid'])
+
+    def append(self, row):
+        for name in self.COLUMNS:
+            self.columns[name].append(row[name])
+
+    def rows(self):
+        """The snapshot as row dicts, in pid order."""
+        for i in range(len(self)):
+            yield dict((name, self.columns[name][i]) for name in self.COLUMNS)
+
+    @classmethod
+    def take(cls, max_rows=None, exclude=None):
+        """Read /proc into a new snapshot.
+
+        `exclude` is a set of pids to leave out (see runtime_pids);
+        reading stops after `max_rows` processes, marking the snapshot
+        truncated.
+        """
+        clock_ticks = os.sysconf('SC_CLK_TCK')
+        page_kb = os.sysconf('SC_PAGE_SIZE') // 1024
+        snapshot = cls()
+        try:
+            pids = sorted(int(p) for p in os.listdir('/proc') if p.isdigit())
+        except OSError:
+            return snapshot
+
+        for pid in pids:
+            if exclude and pid in exclude:
+                continue
+            if max_rows is not None and len(snapshot) >= max_rows:
+                snapshot.truncated = True
+                break
+            try:
+                row = read_process(pid, clock_ticks, page_kb, uid_from='stat')
+            except (IndexError, ValueError):
+                row = None
+            if row is not None:
+                snapshot.append(row)
+        snapshot.taken = time.time()
+        return snapshot
+
+    @classmethod
+    def sample(cls, interval=0.1, max_rows=None, exclude=None):
+        """Two snapshots `interval` seconds apart; the second one, with
+        cpu_percent per process over the interval (None for processes
+        started in between).
+        """
+        before = cls.take(exclude=exclude)
+        time.sleep(interval)
+        after = cls.take(max_rows=max_rows, exclude=exclude)
+        after.cpu_usage_since(before)
+        return after
+
+    def cpu_usage_since(self, earlier):
+        elapsed = self.taken - earlier.taken
+        previous = dict(zip(earlier.columns['pid'], earlier.columns['cpu_seconds']))
+        usage = []
+        for pid, cpu in zip(self.columns['pid'], self.columns['cpu_seconds']):
+            if pid in previous and elapsed > 0:
+                usage.append(round(100.0 * (cpu - previous[pid]) / elapsed, 2))
+            else:
+                usage.append(None)
+        self.cpu_percent = usage
+        return usage
+
+    def to_dict(self):
+        res = dict((name, list(values)) for name, values in self.columns.items())
+        if self.cpu_percent is not None:
+            res['cpu_percent'] = self.cpu_percent
+        res['count'] = len(self)
+        res['truncated'] = self.truncated
+        return res
+
+
+def _unescape_mount_field(s):
+    ## /proc/mounts escapes space, tab, newline and backslash as octal.
+    if '\\' not in s:
+        return s
+    for code in ('\\040', '\\011', '\\012', '\\134'):
+        s = s.replace(code, chr(int(code[1:], 8)))
+    return s
+
+
+def read_mounts():
+    """Return (device, mount point, fs type) for every mounted filesystem."""
+    mounts = read_file('/proc/mounts') or read_file('/etc/mtab') or ''
+
+    res = []
+    for line in mounts.splitlines():
+        fields = line.split()
+        if len(fields) >= 3:
+            res.append((_unescape_mount_field(fields[0]),
+                        _unescape_mount_field(fields[1]),
+                        fields[2]))
+    return res
+
+
+def disk_usage():
+    """Return `df`-style usage for every real mounted filesystem.
+
+    Pseudo filesystems reporting no blocks are skipped, as `df` does.
+    """
+    res = []
+    for device, mount_point, fs_type in read_mounts():
+        try:
+            st = os.statvfs(mount_point)
+        except OSError:
+            continue
+        if st.f_blocks == 0:
+            continue
+
+        size = st.f_blocks * st.f_frsize
+        used = (st.f_blocks - st.f_bfree) * st.f_frsize
+        available = st.f_bavail * st.f_frsize
+        usable = used + available
+
+        res.append({
+            'filesystem': device,
+            'type': fs_type,
+            'size': size,
+            'used': used,
+            'available': available,
+            'use_percent': int(-(-used * 100 // usable)) if usable else 0,
+            'mounted_on': mount_point,
+        })
+    return res
+
+
+def read_kmsg(limit=1000):
+    """Return up to `limit` kernel log lines from /dev/kmsg, like `dmesg`.
+
+    Returns '' when the log is not readable (the usual case in a sandbox).
+    """
+    try:
+        fd = os.open('/dev/kmsg', os.O_RDONLY | os.O_NONBLOCK)
+    except OSError:
+        return ''
+
+    lines = []
+    try:
+        while len(lines) < limit:
+            try:
+                record = os.read(fd, 8192)
+            except OSError as e:
+                if e.errno == errno.EPIPE:
+                    ## The oldest records were overwritten; keep reading.
+                    continue
+                break
+            if not record:
+                break
+
+            if not isinstance(record, str):
+                record = record.decode('utf-8', 'replace')
+            prefix, _, message = record.partition(';')
+            fields = prefix.split(',')
+            try:
+                seconds = int(fields[2]) / 1000000.0
+            except (IndexError, ValueError):
+                seconds = 0.0
+            lines.append('[{:12.6f}] {}'.format(
+                seconds, message.split('\n', 1)[0]))
+    finally:
+        os.close(fd)
+
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def find_executable(name):
+    """Return the path of `name` on $PATH, or None."""
+    for directory in os.getenv('PATH', os.defpath).split(os.pathsep):
+        candidate = os.path.join(directory, name)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
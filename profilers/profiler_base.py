@@ -7,12 +7,74 @@ General concept for now:
     the regular lambda start point for running the code locally.
     Now with CI goodness in us-west-2.
 """
+from profilers.utils import make_result_dict
+
 
 class Profiler(object):
 
     """Main map table of items to post or store."""
     lookups = {}
-    
+
+    """Per-lookup deadlines (seconds) used by the concurrent executor."""
+    lookup_timeouts = {}
+
+    """How long (seconds, or cache.STATIC) a lookup's result stays valid."""
+    lookup_ttls = {}
+
+    """Per-lookup predicates: whether a fresh result may be cached."""
+    lookup_cacheable = {}
+
+    @classmethod
+    def collect(cls, concurrent=False, budget=None, max_workers=8,
+                timings=False, slowest=None, cache=False):
+        """Call every lookup and return the results dict.
+
+        Serially by default; with `concurrent` the lookups run on a
+        thread pool and the whole collection finishes within `budget`
+        seconds.
+
+        With `timings` each lookup is instrumented and the records are
+        added under '_timings'; `slowest` additionally lists that many
+        of the slowest lookups under '_slowest'.
+
+        With `cache`, lookups listed in lookup_ttls are served from the
+        warm container cache while fresh; hits and misses are reported
+        under '_cache'.
+        """
+        lookups = cls.lookups
+        if cache:
+            from profilers import is_warm
+            from profilers.cache import shared_cache
+            lookup_cache = shared_cache()
+            lookups = lookup_cache.wrap(lookups, cls.lookup_ttls,
+                                        warm=is_warm.is_warm() == 'warm',
+                                        cacheable=cls.lookup_cacheable)
+        if timings:
+            from profilers.instrumentation import Instrumentation
+            instrumentation = Instrumentation()
+            lookups = instrumentation.wrap(lookups)
+
+        if concurrent:
+            from profilers.executor import run_lookups
+            res = run_lookups(lookups,
+                              max_workers=max_workers,
+                              budget=budget,
+                              timeouts=cls.lookup_timeouts,
+                              on_timeout=instrumentation.abandoned if timings else None)
+        else:
+            res = make_result_dict(lookups)
+
+        if timings:
+            res['_timings'] = instrumentation.timings()
+            if slowest:
+                res['_slowest'] = instrumentation.slowest(slowest)
+
+        if cache:
+            lookup_cache.save_file()
+            res['_cache'] = lookup_cache.report()
+
+        return res
+
     @classmethod
-    def run(cls):
+    def run(cls, **options):
         raise Exception("Implement this method!")
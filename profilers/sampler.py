@@ -0,0 +1,227 @@
+"""
+Background sampler for time series within an invocation.
+
+Everything else in a profile is a single point in time. The sampler
+records, every `interval` seconds from begin() to end():
+
+- rss_kb, vm_kb: resident and total size of this process (/proc/self/statm),
+- mem_available_kb: MemAvailable from /proc/meminfo,
+- load1: one minute load average (/proc/loadavg),
+- cpu_percent: CPU time used by this process since the previous sample,
+  as a percentage of the interval (os.times).
+
+Samples go into fixed size ring buffers backed by `array`, allocated
+once and reused by every warm invocation, so the sampler holds a few
+tens of KB however long the container lives. When an invocation runs
+longer than the buffers hold, the oldest samples are overwritten.
+
+The /proc files are opened once and re-read from offset 0 on every
+sample, instead of opened and parsed from scratch.
+
+end() returns the series, with the sample times in ms since begin(),
+and a min/max/p50/p99 summary of each.
+"""
+import os
+import threading
+import time
+from array import array
+
+from profilers.utils import percentiles
+
+INTERVAL = 0.05
+SIZE = 1200
+
+SERIES = (
+    ('rss_kb', 'l'),
+    ('vm_kb', 'l'),
+    ('mem_available_kb', 'l'),
+    ('load1', 'd'),
+    ('cpu_percent', 'd'),
+)
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+class RingBuffer(object):
+
+    """The last `size` values appended, in a preallocated array."""
+
+    def __init__(self, size, typecode='d'):
+        self.size = size
+        self.data = array(typecode, [0] * size)
+        self.count = 0
+
+    def append(self, value):
+        self.data[self.count % self.size] = value
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def values(self):
+        """The retained values, oldest first."""
+        if self.count <= self.size:
+            return self.data[:self.count].tolist()
+        start = self.count % self.size
+        return (self.data[start:] + self.data[:start]).tolist()
+
+    def clear(self):
+        self.count = 0
+
+
+class ProcReader(object):
+
+    """A /proc file kept open and re-read from the start."""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def read(self):
+        try:
+            if self.fd is None:
+                self.fd = os.open(self.path, os.O_RDONLY)
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            return os.read(self.fd, 8192)
+        except OSError:
+            self.close()
+            return None
+
+    def close(self):
+        if self.fd is not None:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+            self.fd = None
+
+
+def _mem_available(meminfo):
+    start = meminfo.find(b'MemAvailable:')
+    if start < 0:
+        return -1
+    return int(meminfo[start + 13:meminfo.index(b'kB', start)])
+
+
+class Sampler(object):
+
+    """Samples process and system metrics on a background thread."""
+
+    def __init__(self, interval=INTERVAL, size=SIZE):
+        self.interval = interval
+        self.size = size
+        self.times = RingBuffer(size, 'd')
+        self.series = dict((name, RingBuffer(size, typecode)) for name, typecode in SERIES)
+        self.page_kb = os.sysconf('SC_PAGE_SIZE') // 1024
+
+        self._statm = ProcReader('/proc/self/statm')
+        self._meminfo = ProcReader('/proc/meminfo')
+        self._loadavg = ProcReader('/proc/loadavg')
+
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._started = None
+        self._cpu = None
+        self.errors = 0
+
+    def sample(self):
+        """Take one sample now."""
+        now = time.time()
+        times = os.times()
+        cpu = times[0] + times[1]
+
+        statm = self._statm.read()
+        meminfo = self._meminfo.read()
+        loadavg = self._loadavg.read()
+        try:
+            vm, rss = statm.split()[:2]
+            values = {
+                'vm_kb': int(vm) * self.page_kb,
+                'rss_kb': int(rss) * self.page_kb,
+                'mem_available_kb': _mem_available(meminfo),
+                'load1': float(loadavg.split()[0]),
+            }
+        except (AttributeError, ValueError, IndexError):
+            self.errors += 1
+            return
+
+        if self._cpu is None or now <= self._cpu[0]:
+            values['cpu_percent'] = 0.0
+        else:
+            values['cpu_percent'] = 100.0 * (cpu - self._cpu[1]) / (now - self._cpu[0])
+        self._cpu = (now, cpu)
+
+        with self._lock:
+            self.times.append(now)
+            for name, value in values.items():
+                self.series[name].append(value)
+
+    def _run(self):
+        while True:
+            self.sample()
+            if self._stop.wait(self.interval):
+                return
+
+    def begin(self):
+        """Clear the buffers and start sampling."""
+        self.end_sampling()
+        self.times.clear()
+        for ring in self.series.values():
+            ring.clear()
+        self._cpu = None
+        self.errors = 0
+        self._started = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def end_sampling(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def end(self):
+        """Stop sampling and return the series and their summaries."""
+        self.end_sampling()
+        ## One last sample, so short invocations still get two points.
+        self.sample()
+        return self.to_dict()
+
+    def to_dict(self):
+        """The series so far; safe to call while sampling."""
+        started = self._started or 0
+        with self._lock:
+            count = self.times.count
+            times = self.times.values()
+            series = dict((name, ring.values()) for name, ring in self.series.items())
+        res = {
+            'interval_ms': int(self.interval * 1000),
+            'count': count,
+            'dropped': max(count - self.size, 0),
+            't_ms': [int((t - started) * 1000) for t in times],
+            'series': {},
+            'summary': {},
+        }
+        for name, values in series.items():
+            if name in ('load1', 'cpu_percent'):
+                values = [round(v, 2) for v in values]
+            res['series'][name] = values
+            res['summary'][name] = percentiles(values, (50, 99))
+        if self.errors:
+            res['errors'] = self.errors
+        return res
+
+
+def shared_sampler(interval=None):
+    """The process wide Sampler, with PROFILER_SAMPLE_SIZE samples."""
+    with _shared_lock:
+        if 'sampler' not in _shared:
+            _shared['sampler'] = Sampler(
+                size=int(os.getenv('PROFILER_SAMPLE_SIZE', SIZE)))
+        if interval:
+            _shared['sampler'].interval = interval
+        return _shared['sampler']
@@ -1,15 +1,65 @@
 import os
+import threading
+
+## Number of processes spawned (shells by call_shell_wrapper, workers
+## by the CPU probe), process-wide and per thread (so concurrent lookups
+## can be told apart).
+_spawns = {'total': 0}
+_spawns_lock = threading.Lock()
+_thread_spawns = threading.local()
+
+
+def spawn_count():
+    """Return the number of processes spawned by this process so far."""
+    return _spawns['total']
+
+
+def thread_spawn_count():
+    """Return the number of processes spawned by the calling thread so far."""
+    return getattr(_thread_spawns, 'count', 0)
+
+
+def count_spawn():
+    """Count a process about to be spawned by the calling thread."""
+    with _spawns_lock:
+        _spawns['total'] += 1
+    _thread_spawns.count = thread_spawn_count() + 1
+
 
 def call_shell_wrapper(args):
     """
     Intended to make it easy to add additional metrics from shell calls,
     such as capturing return values, etc.
-    Currently no additional value.
+    Currently only counts the spawned shells.
     Subprocess module is recommended but didn't work for some uname calls.
     """
+    count_spawn()
     return os.popen(" ".join(args)).read()
 
 
+def shell_fallback():
+    """Whether lookups should shell out instead of reading /proc natively.
+
+    The native readers are the default; PROFILER_SHELL_FALLBACK=1 brings
+    back the original shell commands, eg. on platforms without /proc.
+    """
+    return os.getenv('PROFILER_SHELL_FALLBACK', '0') == '1'
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """Nearest-rank percentiles of `values` as {'p50': ..., 'max': ...}."""
+    values = sorted(values)
+    if not values:
+        return {}
+    res = {}
+    for point in points:
+        rank = max(int(-(-point * len(values) // 100)), 1)
+        res['p{}'.format(point)] = values[rank - 1]
+    res['min'] = values[0]
+    res['max'] = values[-1]
+    return res
+
+
 def contents_of_file(fname):
     """Return contents of file in a single string.
 
@@ -1,47 +1,67 @@
-import gzip
 import json
-try:
-    import StringIO
-except:
-    from io import StringIO
+import os
+from os import getenv
 
-try:
-    import urllib2
-except:
-    import urllib.request as urllib2
-import uuid
+from profilers import json_stream
 
-from os import getenv
+API_URL = 'https://serverless-observatory.threatresponse.cloud/api/profile'
 
-def store_results_api(res):
-    """Store Results via the API Component.
 
-    Store results either in urllib2 or directly in s3 if lambda.
-    HTTP request will be a POST instead of a GET when the data
-    parameter is provided.
-    """
-    data = json.dumps(res)
+def post_compressed(body, url=None, content_type='application/json'):
+    """POST gzipped `body` to the API (`url`, by default the profile
+    endpoint); None when no API key is set.
 
+    Uses a keep-alive connection that is reused across warm invocations
+    (see transport.py) and raises transport.TransportError when the post
+    fails.
+    """
     # Look for an environment variable containing the API key.
     # If it exists post the result to the API endpoint.
     api_key = getenv('observatory_api_key', None)
+    if api_key is None:
+        return None
+
     headers = {
         "Authorization": "Basic %s" % api_key,
-        'Content-Type': 'application/json'
-        }
-    if api_key is not None:
-        req = urllib2.Request(
-            'https://serverless-observatory.threatresponse.cloud/api/profile',
-            data=data,
-            headers=headers
-        )
-        try:
-            response = urllib2.urlopen(req)
-            return response.read()
-        except Exception as e:
-            pass
-    else:
+        'Content-Type': content_type,
+        'Content-Encoding': 'gzip',
+    }
+
+    # httplib and ssl are only paid for when posting.
+    import transport
+    api = transport.get_transport(url or getenv('observatory_api_url', API_URL))
+    return api.post(body, headers)
+
+def store_results_api(res):
+    """Store Results via the API Component.
+
+    Returns None when no API key is configured; raises
+    transport.TransportError when the post fails, so that store_results
+    can fall back to S3.
+    """
+    if getenv('observatory_api_key', None) is None:
         return None
+    return post_compressed(compress_results(res))
+
+def put_compressed(body, ext='gz'):
+    """Put already compressed `body` (bytes or a file) into the results
+    bucket as <uuid>.json.<ext>; None when no bucket is configured.
+    """
+    s3_bucket = getenv('observatory-results-bucket', None)
+    if s3_bucket is None:
+        return None
+
+    # Only import boto3 if we need it.  Otherwise may not work all the time.
+    import uuid
+    from profilers.aws import clients
+
+    s3 = clients.client('s3')
+    s3_name = "{name}.json.{ext}".format(name=uuid.uuid4().hex, ext=ext)
+    return s3.put_object(
+        Key=s3_name,
+        Body=body,
+        Bucket=s3_bucket
+    )
 
 def store_results_s3(res):
     """
@@ -50,47 +70,348 @@ def store_results_s3(res):
     Assumes that we're in a lambda function (or something else with
     similar permissions).
     """
-    s3_bucket = getenv('observatory-results-bucket', None)
+    if getenv('observatory-results-bucket', None) is None:
+        return None
 
-    if s3_bucket is not None:
-        # Only import boto3 if we need it.  Otherwise may not work all the time.
-        import boto3
+    # Large sections shared by every container of an image are stored
+    # once, by content hash; the document only references them.
+    if getenv('PROFILER_DEDUP', '0') == '1':
+        # Streams can only be read once; materialize them first so the
+        # full document is still there if dedup fails.
+        res = dict((k, list(v) if json_stream.is_stream(v) else v)
+                   for k, v in res.items())
+        try:
+            res = dedup_results(res)
+        except Exception:
+            pass
 
-        s3 = boto3.client('s3')
-        s3_name = "{name}.json.gz".format(name=uuid.uuid4().hex)
+    # Compress the payload for fluentd friendlieness.
+    codec, level = s3_codec()
+    try:
+        data = spooled_results(res, codec, level)
+    except Exception:
+        return None
 
-        # Compress the payload for fluentd friendlieness.
-        data = compress_results(res)
+    # Store the result in S3 bucket same as the API.
+    try:
+        return put_compressed(data, COMPRESSION_EXTENSIONS[codec])
+    except:
+        pass
+    finally:
+        data.close()
 
-        # Store the result in S3 bucket same as the API.
-        try:
-            response = s3.put_object(
-                Key=s3_name,
-                Body=data,
-                Bucket=s3_bucket
-            )
+def store_compressed(body):
+    """store_results for an already gzipped payload: API, then S3."""
+    try:
+        response = post_compressed(body)
+        if response is not None:
             return response
-        except:
-            pass
-    else:
+    except Exception:
+        pass
+    try:
+        return put_compressed(body)
+    except Exception:
         return None
 
 
-def compress_results(res):
-    out = StringIO.StringIO()
-    file_content = json.dumps(res)
-    with gzip.GzipFile(fileobj=out, mode="w") as f:
-        f.write(file_content)
+## Codec name -> file extension. zstd and lz4 are only offered when their
+## modules are installed.
+COMPRESSION_EXTENSIONS = {'gzip': 'gz', 'zstd': 'zst', 'lz4': 'lz4'}
+
+## Encoder output is batched up to this many bytes per compress() call;
+## feeding the compressor every tiny JSON token is slow.
+COMPRESSION_CHUNK = 64 * 1024
+
+## Spooled output stays in memory up to this size, then moves to /tmp.
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+class _LZ4Compressor(object):
+    def __init__(self, level):
+        import lz4.frame
+        self._compressor = lz4.frame.LZ4FrameCompressor(compression_level=level)
+        self._header = self._compressor.begin()
+
+    def compress(self, data):
+        header, self._header = self._header, b''
+        return header + self._compressor.compress(data)
+
+    def flush(self):
+        return self._header + self._compressor.flush()
+
+
+def available_codecs():
+    codecs = ['gzip']
+    for codec, module in (('zstd', 'zstandard'), ('lz4', 'lz4.frame')):
+        try:
+            __import__(module)
+            codecs.append(codec)
+        except ImportError:
+            pass
+    return codecs
+
+
+def s3_codec():
+    """(codec, level) from PROFILER_COMPRESSION and
+    PROFILER_COMPRESSION_LEVEL; gzip at its default level when the codec
+    is unknown or its module isn't installed.
+    """
+    codec = getenv('PROFILER_COMPRESSION', 'gzip')
+    if codec not in available_codecs():
+        return 'gzip', None
+    level = getenv('PROFILER_COMPRESSION_LEVEL', None)
+    try:
+        return codec, int(level) if level else None
+    except ValueError:
+        return codec, None
+
+
+def compressor(codec='gzip', level=None):
+    """Return an object with compress(bytes) and flush() for `codec`."""
+    if codec == 'gzip':
+        import zlib
+        ## 16 + MAX_WBITS: a gzip header and trailer, not a zlib one.
+        return zlib.compressobj(6 if level is None else level,
+                                zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+    if codec == 'lz4':
+        return _LZ4Compressor(0 if level is None else level)
+    raise Exception("Unknown compression codec: {}".format(codec))
+
+
+def iter_compressed(res, codec='gzip', level=None):
+    """Yield `res` as compressed JSON, encoding and compressing as we go.
+
+    The JSON text is never held in memory in full; generators in `res`
+    are consumed lazily.
+    """
+    c = compressor(codec, level)
+    pending = []
+    size = 0
+    for chunk in json_stream.iterencode(res):
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('utf-8')
+        pending.append(chunk)
+        size += len(chunk)
+        if size >= COMPRESSION_CHUNK:
+            out = c.compress(b''.join(pending))
+            pending, size = [], 0
+            if out:
+                yield out
+    out = c.compress(b''.join(pending))
+    if out:
+        yield out
+    out = c.flush()
+    if out:
+        yield out
+
+
+def compress_results_to(res, out, codec='gzip', level=None):
+    """Stream compressed `res` into the binary file-like `out`.
+
+    Returns the number of compressed bytes written.
+    """
+    written = 0
+    for chunk in iter_compressed(res, codec, level):
+        out.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def spooled_results(res, codec='gzip', level=None):
+    """Return a file positioned at the start of the compressed `res`.
+
+    Kept in memory while small, spilled to a /tmp file past
+    SPOOL_MAX_SIZE, so large results never sit in memory in full.
+    """
+    import tempfile
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    compress_results_to(res, out, codec, level)
+    out.seek(0)
+    return out
+
+
+def compress_results(res, codec='gzip', level=None):
+    """Return `res` as compressed JSON bytes (gzip by default)."""
+    from io import BytesIO
+    out = BytesIO()
+    compress_results_to(res, out, codec, level)
     return out.getvalue()
 
 
+## Sections at least this large (as canonical JSON) are stored as
+## content addressed blobs.
+DEDUP_MIN_BYTES = 1024
+BLOB_PREFIX = 'blobs/sha256/'
+BLOB_INDEX = '/tmp/profiler-blobs.json'
+
+_blob_index = {}
+
+
+class BlobIndex(object):
+
+    """Hashes of the blobs known to be in the bucket.
+
+    Kept in memory and in a /tmp file, so neither warm invocations nor
+    new processes in the container check or upload a blob twice.
+    """
+
+    def __init__(self, path=BLOB_INDEX):
+        self.path = path
+        self.hashes = set()
+        if path:
+            try:
+                with open(path) as f:
+                    self.hashes = set(json.load(f))
+            except (IOError, OSError, ValueError, TypeError):
+                pass
+
+    def __contains__(self, digest):
+        return digest in self.hashes
+
+    def add(self, digest):
+        self.hashes.add(digest)
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = '{}.tmp'.format(self.path)
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(sorted(self.hashes), f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            pass
+
+
+def blob_index():
+    """The process wide BlobIndex, stored at PROFILER_BLOB_INDEX."""
+    path = getenv('PROFILER_BLOB_INDEX', BLOB_INDEX)
+    if path not in _blob_index:
+        _blob_index[path] = BlobIndex(path)
+    return _blob_index[path]
+
+
+def blob_ref(digest):
+    return {'$ref': 'sha256:' + digest}
+
+
+def split_sections(res, min_bytes=DEDUP_MIN_BYTES):
+    """Return (document with $refs, {sha256: canonical JSON bytes}).
+
+    Top level sections whose canonical JSON is at least `min_bytes`
+    long are replaced by {"$ref": "sha256:<hex>"}.
+    """
+    import hashlib
+    doc = {}
+    blobs = {}
+    for key, value in res.items():
+        if json_stream.is_stream(value):
+            value = list(value)
+        data = json.dumps(value, sort_keys=True,
+                          separators=(',', ':')).encode('utf-8')
+        if len(data) < min_bytes:
+            doc[key] = value
+            continue
+        digest = hashlib.sha256(data).hexdigest()
+        blobs[digest] = data
+        doc[key] = blob_ref(digest)
+    return doc, blobs
+
+
+def put_blobs(blobs, index=None):
+    """Upload the blobs the bucket doesn't have yet; returns the count.
+
+    Blobs are immutable, so one already in the index or the bucket is
+    never written again.
+    """
+    from profilers.aws import clients
+    s3 = clients.client('s3')
+    bucket = getenv('observatory-results-bucket')
+    index = index or blob_index()
+
+    written = 0
+    for digest, data in blobs.items():
+        if digest in index:
+            continue
+        key = '{}{}.json.gz'.format(BLOB_PREFIX, digest)
+        try:
+            s3.head_object(Bucket=bucket, Key=key)
+        except Exception:
+            s3.put_object(Bucket=bucket, Key=key,
+                          Body=compress_bytes(data),
+                          ContentType='application/json',
+                          ContentEncoding='gzip')
+            written += 1
+        index.add(digest)
+    index.save()
+    return written
+
+
+def dedup_results(res, min_bytes=None):
+    """Store the large sections of `res` as blobs and return the document
+    that references them.
+    """
+    if min_bytes is None:
+        min_bytes = int(getenv('PROFILER_DEDUP_MIN_BYTES', DEDUP_MIN_BYTES))
+    doc, blobs = split_sections(res, min_bytes)
+    put_blobs(blobs)
+    return doc
+
+
+def rehydrate(doc, fetch):
+    """`doc` with every $ref section replaced by `fetch(sha256)`."""
+    res = {}
+    for key, value in doc.items():
+        if isinstance(value, dict) and list(value) == ['$ref']:
+            value = fetch(value['$ref'].split(':', 1)[1])
+        res[key] = value
+    return res
+
+
+def load_results(key, bucket=None):
+    """Read a stored document back from S3, with its sections rehydrated."""
+    import gzip
+    from io import BytesIO
+    from profilers.aws import clients
+    s3 = clients.client('s3')
+    bucket = bucket or getenv('observatory-results-bucket')
+
+    def read(key):
+        body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+        text = gzip.GzipFile(fileobj=BytesIO(body), mode='rb').read()
+        return json.loads(text.decode('utf-8'))
+
+    blobs = {}
+
+    def fetch(digest):
+        if digest not in blobs:
+            blobs[digest] = read('{}{}.json.gz'.format(BLOB_PREFIX, digest))
+        return blobs[digest]
+
+    return rehydrate(read(key), fetch)
+
+
+def compress_bytes(data):
+    c = compressor('gzip')
+    return c.compress(data) + c.flush()
+
+
 def store_results(res):
     """
     Attempts to store results via POST, falls back to writing directly to S3.
     """
-    try:
-        return store_results_api(res)
-    except Exception as e:
-        return store_results_s3(res)
-    finally:
-        return None
+    if getenv('observatory_api_key', None) is not None:
+        # Streamed sections can only be consumed once; keep them around
+        # in case the post fails and S3 needs them too.
+        res = dict((k, list(v) if json_stream.is_stream(v) else v)
+                   for k, v in res.items())
+        try:
+            response = store_results_api(res)
+            if response is not None:
+                return response
+        except Exception:
+            pass
+    return store_results_s3(res)
@@ -0,0 +1,67 @@
+import os
+import unittest
+
+import boto3
+from moto import mock_s3, mock_sqs, mock_sts
+
+import store_results
+from profilers.aws import clients, permissions
+from tests.test_aws_permissions import StubIAM
+
+
+class AWSClientsTest(unittest.TestCase):
+    def setUp(self):
+        clients.clear_clients()
+
+    def tearDown(self):
+        clients.clear_clients()
+
+    def test_clients_are_shared(self):
+        s3 = clients.client('s3')
+
+        assert clients.client('s3') is s3
+        assert clients.client('s3', region_name='eu-west-1') is not s3
+        assert clients.client('s3', endpoint_url='http://127.0.0.1:9') is not s3
+        assert len(clients.clients()) == 3
+
+        clients.clear_clients()
+        assert clients.client('s3') is not s3
+
+    def test_prewarm(self):
+        os.environ['PROFILER_PREWARM_CLIENTS'] = 's3, sqs,'
+        try:
+            built = clients.prewarm()
+        finally:
+            del os.environ['PROFILER_PREWARM_CLIENTS']
+
+        assert built == ['s3', 'sqs']
+        assert [k[0] for k in clients.clients()] == ['s3', 'sqs']
+
+    @mock_sts
+    @mock_sqs
+    def test_permission_checks_reuse_client(self):
+        clients._clients[('iam', clients.default_region(), None)] = StubIAM(['allowed'])
+        permissions.clear_role_results()
+        permissions.check_sqs()
+        sqs = clients.client('sqs')
+        permissions.clear_role_results()
+        permissions.check_sqs()
+
+        assert clients.client('sqs') is sqs
+        assert [k[0] for k in clients.clients()] == ['iam', 'sqs', 'sts']
+
+    @mock_s3
+    def test_store_results_s3_reuses_client(self):
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='results')
+        os.environ['observatory-results-bucket'] = 'results'
+        try:
+            store_results.store_results_s3({"a": 1})
+            s3 = clients.client('s3')
+            store_results.store_results_s3({"a": 2})
+        finally:
+            del os.environ['observatory-results-bucket']
+
+        assert clients.client('s3') is s3
+        keys = s3.list_objects(Bucket='results')['Contents']
+        assert len(keys) == 2
+        assert all(k['Key'].endswith('.json.gz') for k in keys)
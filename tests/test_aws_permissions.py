@@ -1,27 +1,155 @@
 import pprint
-from profilers.aws import permissions
-from moto import mock_cloudwatch, mock_ec2, mock_sqs
+from profilers.aws import clients, permissions
+from moto import mock_ec2, mock_logs, mock_sqs, mock_sts
 import unittest
 
 
 class AWSPermissionsTest(unittest.TestCase):
     def setUp(self):
-        pass
+        clients.clear_clients()
+        permissions.clear_role_results()
 
-    @mock_cloudwatch
+    @mock_sts
+    @mock_logs
     def test_cloudwatch_permissions(self):
-        check = permissions.check_cloudwatch()
-        assert check['CreateLogGroup'] is not None
-        assert check['CreateLogStream'] is not None
-        assert check['PutLogEvents'] is not None
+        import os
+        clients.client('logs').create_log_group(logGroupName='/aws/lambda/profiler')
+        os.environ['AWS_LAMBDA_LOG_GROUP_NAME'] = '/aws/lambda/profiler'
+        try:
+            check = permissions.check_cloudwatch()
+        finally:
+            del os.environ['AWS_LAMBDA_LOG_GROUP_NAME']
+        assert check['CreateLogGroup'] is True
+        assert check['CreateLogStream'] is True
+        ## No AWS_LAMBDA_LOG_STREAM_NAME to write to: no answer.
+        assert check['PutLogEvents'] is None
 
+    @mock_sts
     @mock_ec2
     def test_ec2_permissions(self):
         check = permissions.check_ec2()
-        assert check['DescribeTags'] is not None
+        assert check['DescribeTags'] is True
 
+    def iam(self, *decisions):
+        stub = StubIAM(decisions)
+        clients._clients[('iam', clients.default_region(), None)] = stub
+        return stub
+
+    @mock_sts
     @mock_sqs
     def test_sqs_permissions(self):
+        stub = self.iam('implicitDeny')
         check = permissions.check_sqs()
-        assert check['ListQueues'] is not None
-        assert check ['PutMessage'] is not None
\ No newline at end of file
+        assert check['ListQueues'] is True
+        assert check['PutMessage'] is False
+        ## Asked of the simulator for our role; nothing is sent.
+        assert stub.calls == [(permissions.policy_source_arn(permissions.role_arn()),
+                               ['sqs:SendMessage'])]
+
+        permissions.clear_role_results()
+        self.iam('allowed')
+        assert permissions.check_sqs()['PutMessage'] is True
+
+    @mock_sts
+    @mock_sqs
+    def test_results_cached_per_role(self):
+        stub = self.iam('allowed')
+        first = permissions.probe_permissions(['sqs'])
+        assert first == {'sqs:ListQueues': True, 'sqs:PutMessage': True}
+
+        ## The role's answers are known.
+        assert permissions.probe_permissions(['sqs']) == first
+        assert len(stub.calls) == 1
+
+        ## Another role is probed afresh.
+        permissions._identities.clear()
+        permissions._role_results[permissions.role_arn()] = {}
+        permissions.probe_permissions(['sqs'])
+        assert len(stub.calls) == 2
+
+    @mock_sts
+    @mock_sqs
+    def test_unknown_answers_not_cached(self):
+        stub = self.iam()
+        assert permissions.probe_permissions(['sqs'])['sqs:PutMessage'] is None
+        permissions.probe_permissions(['sqs'])
+        assert len(stub.calls) == 2
+
+    @mock_sts
+    @mock_logs
+    def test_no_log_group_is_no_answer(self):
+        import os
+        os.environ.pop('AWS_LAMBDA_LOG_GROUP_NAME', None)
+        assert permissions.check_cloudwatch()['CreateLogStream'] is None
+
+    def test_policy_source_arn(self):
+        assert permissions.policy_source_arn(
+            'arn:aws:sts::123456789012:assumed-role/my-role/my-session') == \
+            'arn:aws:iam::123456789012:role/my-role'
+        assert permissions.policy_source_arn(
+            'arn:aws:iam::123456789012:user/me') == 'arn:aws:iam::123456789012:user/me'
+
+    def test_budget_from_remaining_time(self):
+        class Context(object):
+            def get_remaining_time_in_millis(self):
+                return 1500
+        assert permissions.probe_budget(Context()) == 1.0
+        assert permissions.probe_budget() == permissions.PROBE_BUDGET
+
+    def test_probe_stops_at_first_answer(self):
+        client = StubClient(['QueueDoesNotExist', 'AccessDenied', None])
+        probe = {'service': 'sqs', 'action': 'PutMessage', 'call': 'send_message',
+                 'targets': lambda c: [{'QueueUrl': q} for q in 'abc']}
+
+        assert permissions.run_probe(probe, client) is False
+        assert client.calls == ['a', 'b']
+
+    def test_no_answer_is_none(self):
+        client = StubClient(['QueueDoesNotExist', 'Throttling'])
+        probe = {'service': 'sqs', 'action': 'PutMessage', 'call': 'send_message',
+                 'targets': lambda c: [{'QueueUrl': q} for q in 'ab']}
+
+        assert permissions.run_probe(probe, client) is None
+
+    def test_dry_run_counts_as_allowed(self):
+        client = StubClient(['DryRunOperation'])
+        probe = {'service': 'ec2', 'action': 'DescribeTags',
+                 'call': 'send_message', 'args': {'QueueUrl': 'a'}, 'dry_run': True}
+
+        assert permissions.run_probe(probe, client) is True
+        assert client.dry_run == [True]
+
+
+class StubClient(object):
+
+    """Fails each call with the next error code; None succeeds."""
+
+    def __init__(self, codes):
+        self.codes = list(codes)
+        self.calls = []
+        self.dry_run = []
+
+    def send_message(self, QueueUrl, DryRun=False):
+        import botocore.exceptions
+        self.calls.append(QueueUrl)
+        self.dry_run.append(DryRun)
+        code = self.codes.pop(0)
+        if code is not None:
+            raise botocore.exceptions.ClientError({'Error': {'Code': code}}, 'SendMessage')
+
+
+class StubIAM(object):
+
+    """Answers the policy simulator with `decisions`; none is an error."""
+
+    def __init__(self, decisions):
+        self.decisions = list(decisions)
+        self.calls = []
+
+    def simulate_principal_policy(self, PolicySourceArn, ActionNames):
+        import botocore.exceptions
+        self.calls.append((PolicySourceArn, ActionNames))
+        if not self.decisions:
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'AccessDenied'}}, 'SimulatePrincipalPolicy')
+        return {'EvaluationResults': [{'EvalDecision': d} for d in self.decisions]}
@@ -0,0 +1,178 @@
+import base64
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from io import BytesIO
+
+import boto3
+from moto import mock_s3
+
+import batching
+import transport
+from profilers.aws import clients
+from tests.test_transport import StandIn
+
+
+class BatchingTest(unittest.TestCase):
+    def setUp(self):
+        self.batch_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.batch_dir)
+
+    def test_gzip_members_concatenate(self):
+        data = batching.gzip_member(b'{"a": 1}\n') + batching.gzip_member(b'{"a": 2}\n')
+        assert gzip.GzipFile(fileobj=BytesIO(data)).read() == b'{"a": 1}\n{"a": 2}\n'
+
+    def test_flush_by_count(self):
+        sink = batching.BatchSink(self.batch_dir, max_count=3)
+        sink.add({"run": 0})
+        sink.add({"run": 1})
+        assert not sink.due()
+        assert sink.count == 2
+
+        ## Nowhere to ship to: the batch is kept for the next flush.
+        assert sink.add({"run": 2}) == []
+        assert len(sink.ready()) == 1
+        path = os.path.join(self.batch_dir, sink.ready()[0] + batching.READY_SUFFIX)
+        assert batching.read_batch(path) == [{"run": 0}, {"run": 1}, {"run": 2}]
+
+    def test_flush_by_size_and_age(self):
+        sink = batching.BatchSink(self.batch_dir, max_bytes=1)
+        sink.add({"run": 0})
+        assert len(sink.ready()) == 1
+
+        sink = batching.BatchSink(self.batch_dir, max_age=60)
+        sink.add({"run": 1})
+        assert not sink.due()
+        assert sink.due(now=batching._created(sink.batch_id) + 61)
+
+    def test_open_batch_survives_the_process(self):
+        batching.BatchSink(self.batch_dir).add({"run": 0})
+        sink = batching.BatchSink(self.batch_dir)
+
+        assert sink.count == 1
+        sink.add({"run": 1})
+        assert sink.count == 2
+
+    def test_tags_handed_back_once_shipped(self):
+        tags = []
+        sink = batching.BatchSink(self.batch_dir, on_delivered=tags.append)
+        sink.add({"run": 0}, tag='a')
+        sink.add({"run": 1}, tag='a.b')
+        ## Nowhere to ship to yet.
+        assert sink.flush() == []
+        assert tags == []
+
+        sink.ship_batch = lambda batch_id: {'batch_id': batch_id}
+        assert len(sink.ship()) == 1
+        assert tags == ['a', 'a.b']
+        assert os.listdir(self.batch_dir) == []
+
+    def test_older_open_batches_are_closed(self):
+        first = batching.BatchSink(self.batch_dir)
+        first.add({"run": 0})
+        first.add({"run": 1})
+        ## A second process starting its own batch alongside.
+        time.sleep(0.01)
+        second = batching.BatchSink(os.path.join(self.batch_dir, 'other'))
+        second.add({"run": 2})
+        name = second.batch_id + batching.OPEN_SUFFIX
+        os.rename(os.path.join(second.batch_dir, name), os.path.join(self.batch_dir, name))
+
+        sink = batching.BatchSink(self.batch_dir)
+        assert sink.batch_id == second.batch_id
+        assert sink.count == 1
+        assert sink.ready() == [first.batch_id]
+        assert sink._count(first.batch_id) == 2
+
+    def test_size_closed_batches_use_multipart(self):
+        assert batching.MULTIPART_THRESHOLD <= batching.MAX_BYTES
+        assert batching.PART_SIZE >= 5 * 1024 * 1024
+
+
+class BatchingS3Test(unittest.TestCase):
+    def setUp(self):
+        self.batch_dir = tempfile.mkdtemp()
+        clients.clear_clients()
+        os.environ['observatory-results-bucket'] = 'results'
+
+    def tearDown(self):
+        del os.environ['observatory-results-bucket']
+        clients.clear_clients()
+        shutil.rmtree(self.batch_dir)
+
+    def objects(self, s3):
+        return sorted(o['Key'] for o in s3.list_objects(Bucket='results').get('Contents', []))
+
+    @mock_s3
+    def test_single_put_with_manifest(self):
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='results')
+        sink = batching.BatchSink(self.batch_dir)
+        for run in range(3):
+            sink.add({"run": run})
+
+        manifest, = sink.flush()
+        assert manifest['sink'] == 's3'
+        assert manifest['count'] == 3
+        assert self.objects(s3) == sorted([
+            manifest['key'], 'batches/{}.manifest.json'.format(manifest['batch_id'])])
+
+        body = s3.get_object(Bucket='results', Key=manifest['key'])['Body'].read()
+        lines = gzip.GzipFile(fileobj=BytesIO(body)).read().splitlines()
+        assert [json.loads(l.decode('utf-8')) for l in lines] == [{"run": r} for r in range(3)]
+        assert sink.ready() == []
+
+    @mock_s3
+    def test_multipart_upload(self):
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='results')
+        sink = batching.BatchSink(self.batch_dir, max_bytes=64 * 1024 * 1024,
+                                  multipart_threshold=1,
+                                  part_size=5 * 1024 * 1024)
+        ## Incompressible enough to need two parts.
+        blob = base64.b64encode(os.urandom(512 * 1024)).decode('ascii')
+        for run in range(16):
+            sink.add({"run": run, "blob": blob})
+
+        manifest, = sink.flush()
+        assert manifest['bytes'] > 5 * 1024 * 1024
+        head = s3.head_object(Bucket='results', Key=manifest['key'])
+        assert head['ContentLength'] == manifest['bytes']
+        assert head['ETag'].endswith('-2"')
+
+
+class BatchingAPITest(unittest.TestCase):
+    def setUp(self):
+        self.batch_dir = tempfile.mkdtemp()
+        self.server = StandIn()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        os.environ['observatory_api_key'] = 'key'
+        os.environ['observatory_api_batch_url'] = 'http://127.0.0.1:{}/api/profile/batch'.format(
+            self.server.server_port)
+
+    def tearDown(self):
+        del os.environ['observatory_api_key']
+        del os.environ['observatory_api_batch_url']
+        transport.clear_transports()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.batch_dir)
+
+    def test_batch_endpoint_body(self):
+        sink = batching.BatchSink(self.batch_dir, max_count=2)
+        sink.add({"run": 0})
+        manifest, = sink.add({"run": 1})
+
+        assert manifest['sink'] == 'api'
+        body, = self.server.bodies
+        assert [json.loads(l.decode('utf-8')) for l in body.splitlines()] == [
+            {"run": 0}, {"run": 1}]
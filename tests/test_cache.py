@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from profilers import posix_core
+from profilers.cache import STATIC, LookupCache
+
+
+class Counter(object):
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return {'calls': self.calls}
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmp, 'lookups.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_static_and_volatile(self):
+        static, volatile = Counter(), Counter()
+        cache = LookupCache()
+        lookups = {'static': static, 'volatile': volatile}
+
+        for _ in range(3):
+            wrapped = cache.wrap(lookups, {'static': STATIC})
+            wrapped['static']()
+            wrapped['volatile']()
+
+        assert static.calls == 1
+        assert volatile.calls == 3
+        assert cache.report() == {'hits': ['static'], 'misses': []}
+
+    def test_ttl_expiry(self):
+        counter = Counter()
+        cache = LookupCache()
+        cache.wrap({'c': counter}, {'c': 0.05})['c']()
+        cache.wrap({'c': counter}, {'c': 0.05})['c']()
+        assert counter.calls == 1
+        time.sleep(0.1)
+        cache.wrap({'c': counter}, {'c': 0.05})['c']()
+        assert counter.calls == 2
+
+    def test_file_tier_only_when_warm(self):
+        counter = Counter()
+        first = LookupCache(self.cache_file)
+        first.wrap({'c': counter}, {'c': STATIC})['c']()
+        first.save_file()
+
+        ## A new process in a cold container must not trust the file.
+        cold = LookupCache(self.cache_file)
+        assert cold.wrap({'c': counter}, {'c': STATIC}, warm=False)['c']() == {'calls': 2}
+
+        warm = LookupCache(self.cache_file)
+        assert warm.wrap({'c': counter}, {'c': STATIC}, warm=True)['c']() == {'calls': 1}
+        assert warm.report()['hits'] == ['c']
+
+    def test_streams_are_not_cached(self):
+        cache = LookupCache()
+        wrapped = cache.wrap({'s': lambda: iter([1, 2])}, {'s': STATIC})
+        wrapped['s']()
+        assert 's' not in cache.entries
+
+    def test_values_are_copies(self):
+        cache = LookupCache()
+        first = cache.wrap({'c': Counter()}, {'c': STATIC})['c']()
+        first['calls'] = 99
+        second = cache.wrap({'c': Counter()}, {'c': STATIC})['c']()
+        assert second == {'calls': 1}
+        second['calls'] = 98
+        assert cache.wrap({'c': Counter()}, {'c': STATIC})['c']() == {'calls': 1}
+
+    def test_vetoed_results_are_not_cached(self):
+        counter = Counter()
+        cache = LookupCache()
+        cacheable = {'c': lambda value: value['calls'] > 1}
+        for _ in range(3):
+            cache.wrap({'c': counter}, {'c': STATIC}, cacheable=cacheable)['c']()
+        ## The first result was refused, the second kept.
+        assert counter.calls == 2
+
+    def test_truncated_walk_is_not_cached(self):
+        os.environ['PROFILER_WALK_MAX_ENTRIES'] = '1'
+        os.environ['PROFILER_WALK_INDEX'] = ''
+        cache = LookupCache()
+        lookups = {'permissions': posix_core.PosixCoreProfiler.lookups['permissions']}
+        try:
+            cache.wrap(lookups, {'permissions': STATIC},
+                       cacheable=posix_core.PosixCoreProfiler.lookup_cacheable)['permissions']()
+        finally:
+            del os.environ['PROFILER_WALK_MAX_ENTRIES']
+            del os.environ['PROFILER_WALK_INDEX']
+        assert posix_core.posix_permissions().walk_stats['truncated'] == 'entries'
+        assert 'permissions' not in cache.entries
@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from profilers import cpu_probe
+from profilers.posix_core import PosixCoreProfiler
+from profilers.utils import spawn_count
+
+
+STAT = """cpu  100 0 50 800 10 0 0 40 0 0
+cpu0 50 0 25 400 5 0 0 20 0 0
+cpu1 50 0 25 400 5 0 0 20 0 0
+intr 12345
+"""
+
+STAT_LATER = """cpu  150 0 60 820 10 0 0 60 0 0
+cpu0 75 0 30 410 5 0 0 30 0 0
+cpu1 75 0 30 410 5 0 0 30 0 0
+intr 12346
+"""
+
+
+class CPUProbeTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _stat(self, text):
+        path = os.path.join(self.dir, 'stat')
+        with open(path, 'w') as f:
+            f.write(text)
+        return cpu_probe.read_stat(path)
+
+    def test_read_stat(self):
+        stat = self._stat(STAT)
+        assert stat['cpus'] == 2
+        assert stat['steal'] == 40
+        assert stat['idle'] == 800
+        assert cpu_probe.read_stat(os.path.join(self.dir, 'missing')) is None
+
+    def test_stat_delta(self):
+        delta = cpu_probe.stat_delta(self._stat(STAT), self._stat(STAT_LATER))
+        ## 50 user + 10 system + 20 idle + 20 steal
+        assert delta['steal_percent'] == 20.0
+        assert delta['busy_percent'] == 80.0
+        assert cpu_probe.stat_delta(None, None) == {}
+
+    def test_schedstat(self):
+        sched = cpu_probe.read_schedstat()
+        if sched is None:
+            self.skipTest('no schedstats')
+        assert len(sched) == 3
+        assert sched[0] > 0
+
+    def test_probe(self):
+        start = time.time()
+        res = cpu_probe.probe(seconds=0.4, workers=2)
+        assert time.time() - start < 2.0
+        assert res['ops_per_sec'] > 0
+        for variant in ('threads', 'processes'):
+            assert res[variant]['workers'] == 2
+            assert res[variant]['speedup'] > 0
+        assert res['effective_vcpus'] > 0
+        assert 0 <= res['steal_percent'] <= 100
+
+    def test_unknown_kernel(self):
+        assert cpu_probe.probe(kernel='nope')['error'] == 'unknown kernel'
+
+    def test_forks_counted(self):
+        spawns = spawn_count()
+        cpu_probe.probe(seconds=0.2, workers=2)
+        assert spawn_count() - spawns == 2
+
+    def test_opt_in(self):
+        assert 'cpu_steal' not in PosixCoreProfiler.lookups
+        os.environ['PROFILER_CPU_PROBE'] = '1'
+        try:
+            res = PosixCoreProfiler.run_probes({}, budget=0.3, started=time.time())
+        finally:
+            del os.environ['PROFILER_CPU_PROBE']
+        assert res['cpu_steal']['ops_per_sec'] > 0
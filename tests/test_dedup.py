@@ -0,0 +1,112 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+
+import boto3
+from moto import mock_s3
+
+import store_results
+from profilers.aws import clients
+
+
+class DedupTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.index = os.path.join(self.tmp, 'blobs.json')
+        clients.clear_clients()
+        store_results._blob_index.clear()
+        os.environ['observatory-results-bucket'] = 'results'
+        os.environ['PROFILER_DEDUP'] = '1'
+        os.environ['PROFILER_BLOB_INDEX'] = self.index
+
+    def tearDown(self):
+        for name in ('observatory-results-bucket', 'PROFILER_DEDUP', 'PROFILER_BLOB_INDEX'):
+            del os.environ[name]
+        clients.clear_clients()
+        store_results._blob_index.clear()
+        shutil.rmtree(self.tmp)
+
+    def result(self, timestamp):
+        return {
+            "timestamp": timestamp,
+            "cpuinfo": {"model name": "Intel(R) Xeon(R) CPU E5-2650L v3 @ 1.80GHz" * 30},
+            "package_versions": dict(("pkg{}".format(i), {"version": "1.0"}) for i in range(100)),
+            "permissions": (p for p in ["/tmp"] * 200),
+        }
+
+    def keys(self, s3, prefix):
+        found = s3.list_objects(Bucket='results', Prefix=prefix).get('Contents', [])
+        return sorted(o['Key'] for o in found)
+
+    def test_split_sections(self):
+        doc, blobs = store_results.split_sections(self.result(1))
+
+        assert doc["timestamp"] == 1
+        assert len(blobs) == 3
+        for key in ("cpuinfo", "package_versions", "permissions"):
+            assert list(doc[key]) == ["$ref"]
+        rehydrated = store_results.rehydrate(
+            doc, lambda digest: json.loads(blobs[digest].decode('utf-8')))
+        assert rehydrated["permissions"] == ["/tmp"] * 200
+
+    @mock_s3
+    def test_blobs_written_once(self):
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='results')
+
+        for timestamp in range(3):
+            store_results.store_results_s3(self.result(timestamp))
+
+        assert len(self.keys(s3, store_results.BLOB_PREFIX)) == 3
+        documents = [k for k in self.keys(s3, '') if not k.startswith('blobs/')]
+        assert len(documents) == 3
+
+        body = s3.get_object(Bucket='results', Key=documents[0])['Body'].read()
+        doc = json.loads(gzip.GzipFile(fileobj=BytesIO(body), mode='rb').read().decode('utf-8'))
+        assert len(json.dumps(doc)) < 400
+
+        loaded = sorted((store_results.load_results(k) for k in documents),
+                        key=lambda d: d["timestamp"])
+        expected = self.result(0)
+        expected["permissions"] = list(expected["permissions"])
+        assert loaded[0] == expected
+        assert [d["timestamp"] for d in loaded] == [0, 1, 2]
+
+    @mock_s3
+    def test_index_skips_known_blobs(self):
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='results')
+        doc, blobs = store_results.split_sections(self.result(1))
+
+        assert store_results.put_blobs(blobs) == 3
+        assert store_results.put_blobs(blobs) == 0
+        assert sorted(json.load(open(self.index))) == sorted(blobs)
+
+        ## Another container: no index, but the bucket has the blobs.
+        fresh = store_results.BlobIndex(os.path.join(self.tmp, 'other.json'))
+        assert store_results.put_blobs(blobs, fresh) == 0
+        assert len(fresh.hashes) == 3
+
+    @mock_s3
+    def test_full_document_when_dedup_fails(self):
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='results')
+
+        def fail(blobs, index=None):
+            raise IOError("blob upload failed")
+        put_blobs = store_results.put_blobs
+        store_results.put_blobs = fail
+        try:
+            store_results.store_results_s3(self.result(1))
+        finally:
+            store_results.put_blobs = put_blobs
+
+        keys = self.keys(s3, '')
+        assert len(keys) == 1
+        doc = store_results.load_results(keys[0])
+        assert doc["permissions"] == ["/tmp"] * 200
+        assert doc["cpuinfo"] == self.result(1)["cpuinfo"]
@@ -0,0 +1,134 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import delivery
+import launcher
+import transport
+from tests.test_transport import StandIn
+
+
+class DeliveryTest(unittest.TestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.server = StandIn()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        os.environ['observatory_api_key'] = 'key'
+        os.environ['observatory_api_url'] = 'http://127.0.0.1:{}/api/profile'.format(
+            self.server.server_port)
+
+    def tearDown(self):
+        del os.environ['observatory_api_key']
+        del os.environ['observatory_api_url']
+        transport.clear_transports()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.spool_dir)
+
+    def delivered(self):
+        return [json.loads(b.decode('utf-8')) for b in self.server.bodies]
+
+    def test_delivers_in_background(self):
+        shipper = delivery.Delivery(self.spool_dir)
+        shipper.deliver({"run": 1})
+        assert shipper.flush(5)
+
+        assert self.delivered() == [{"run": 1}]
+        stats = shipper.stats()
+        assert stats['spool_depth'] == 0
+        assert stats['delivered'] == 1
+        assert stats['last_lag'] >= 0
+
+    def test_failures_stay_spooled_and_drain_in_order(self):
+        self.server.statuses = [500] * 3
+        api = transport.get_transport(os.environ['observatory_api_url'])
+        api.retries = 0
+        shipper = delivery.Delivery(self.spool_dir)
+
+        for run in range(3):
+            shipper.deliver({"run": run})
+            assert shipper.flush(5)
+        assert shipper.stats()['spool_depth'] == 3
+        assert shipper.stats()['failed'] == 3
+
+        ## Next warm invocation, once the breaker has let go: the whole
+        ## backlog goes out in one drain.
+        api.breaker.record_success()
+        shipper.deliver({"run": 3})
+        assert shipper.flush(5)
+        assert [r["run"] for r in self.delivered()[3:]] == [0, 1, 2, 3]
+        assert shipper.stats()['spool_depth'] == 0
+
+    def test_spool_survives_the_process(self):
+        self.server.statuses = [403]
+        first = delivery.Delivery(self.spool_dir)
+        first.deliver({"run": "old"})
+        assert first.flush(5)
+        assert first.stats()['spool_depth'] == 1
+
+        ## A new process in the same container.
+        assert delivery.Delivery(self.spool_dir).drain() == 1
+        assert self.delivered() == [{"run": "old"}, {"run": "old"}]
+
+    def test_tags_handed_back_once_delivered(self):
+        tags = []
+        shipper = delivery.Delivery(self.spool_dir, on_delivered=tags.append)
+        for run, tag in enumerate(['abc', None, 'abc.def']):
+            shipper.spool({"run": run}, tag=tag)
+            ## Spool files sort by their enqueue time in ms.
+            time.sleep(0.002)
+        assert shipper.drain() == 3
+        assert tags == ['abc', 'abc.def']
+
+    def test_spool_is_bounded(self):
+        shipper = delivery.Delivery(self.spool_dir, send=lambda body: None, spool_max=2)
+        for run in range(4):
+            shipper.spool({"run": run})
+
+        assert len(shipper.spooled()) == 2
+        assert shipper.dropped == 2
+
+    def test_launcher_async_mode(self):
+        shipper = delivery.Delivery(self.spool_dir)
+        delivery._shared['delivery'] = shipper
+        try:
+            results = {"uname": "Linux"}
+            os.environ['PROFILER_DELIVERY'] = 'async'
+            try:
+                assert launcher.get_shipper(results)(results) is True
+            finally:
+                del os.environ['PROFILER_DELIVERY']
+            assert shipper.flush(5)
+        finally:
+            delivery._shared.clear()
+
+        assert results['delivery']['spool_depth'] == 0
+        assert self.delivered() == [results]
+
+    def test_launcher_acknowledges_delta_payloads(self):
+        import delta
+        shipper = delivery.Delivery(self.spool_dir)
+        delivery._shared['delivery'] = shipper
+        state_file = os.path.join(self.spool_dir, 'delta.json')
+        os.environ['PROFILER_DELIVERY'] = 'async'
+        os.environ['PROFILER_DELIVERY_FORMAT'] = 'delta'
+        os.environ['PROFILER_DELTA_STATE'] = state_file
+        try:
+            results = {"uname": "Linux"}
+            encoder = delta.delta_encoder()
+            payload = encoder.encode(results)
+            assert launcher.get_shipper(results)(payload, delta.payload_tag(payload)) is True
+            encoder.commit(acknowledged=False)
+            assert shipper.flush(5)
+        finally:
+            for name in ('PROFILER_DELIVERY', 'PROFILER_DELIVERY_FORMAT', 'PROFILER_DELTA_STATE'):
+                del os.environ[name]
+            delivery._shared.clear()
+
+        assert delta.DeltaEncoder(state_file).acknowledged() == payload['_hash']
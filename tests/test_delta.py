@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import delta
+
+
+class DeltaTest(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.state_dir, 'delta.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def test_diff_and_apply(self):
+        base = {"env": {"A": "1", "B": "2", "a/b": "x"}, "time": 1, "gone": True,
+                "packages": ["a", "b"]}
+        doc = {"env": {"A": "1", "B": "3", "a/b": "y"}, "time": 2, "new": None,
+               "packages": ["a", "b", "c"]}
+        ops = delta.diff(base, doc)
+
+        assert {"op": "remove", "path": "/gone"} in ops
+        assert {"op": "add", "path": "/new", "value": None} in ops
+        assert {"op": "replace", "path": "/env/a~1b", "value": "y"} in ops
+        assert {"op": "replace", "path": "/packages", "value": ["a", "b", "c"]} in ops
+        assert not [op for op in ops if op['path'] == '/env/A']
+        assert delta.apply(base, ops) == doc
+        assert base["env"]["B"] == "2"
+
+    def test_encoder_ships_deltas_once_committed(self):
+        encoder = delta.DeltaEncoder(self.state_file)
+        first = {"cpuinfo": {"cores": 2}, "timestamp": 1}
+        second = {"cpuinfo": {"cores": 2}, "timestamp": 2}
+
+        full = encoder.encode(first)
+        assert full["_hash"] == delta.content_hash(first)
+        ## Not committed (say the upload failed): still a full payload.
+        assert not delta.is_delta(encoder.encode(second))
+
+        encoder.encode(first)
+        encoder.commit()
+        payload = delta.DeltaEncoder(self.state_file).encode(second)
+        assert payload == {
+            "_delta": {"base": full["_hash"], "hash": delta.content_hash(second)},
+            "ops": [{"op": "replace", "path": "/timestamp", "value": 2}],
+        }
+
+    def test_keyframes_and_reconstruct(self):
+        encoder = delta.DeltaEncoder(self.state_file, keyframe=3)
+        docs = [{"packages": ["a"], "timestamp": i, "stream": iter([i])} for i in range(5)]
+        payloads = []
+        for doc in docs:
+            payloads.append(encoder.encode(doc))
+            encoder.commit()
+
+        assert [delta.is_delta(p) for p in payloads] == [False, True, True, False, True]
+        expected = [{"packages": ["a"], "timestamp": i, "stream": [i]} for i in range(5)]
+        assert delta.reconstruct(payloads) == expected
+        assert delta.reconstruct(payloads[3:]) == expected[3:]
+
+    def test_broken_chain(self):
+        encoder = delta.DeltaEncoder(self.state_file)
+        payloads = []
+        for i in range(3):
+            payloads.append(encoder.encode({"timestamp": i}))
+            encoder.commit()
+
+        with self.assertRaises(ValueError):
+            delta.reconstruct([payloads[0], payloads[2]])
+        with self.assertRaises(ValueError):
+            delta.reconstruct(payloads[1:])
+
+    def test_deltas_only_against_acknowledged_base(self):
+        encoder = delta.DeltaEncoder(self.state_file)
+        first = encoder.encode({"timestamp": 0})
+        ## Enqueued, but not delivered yet.
+        encoder.commit(acknowledged=False)
+        assert not delta.is_delta(encoder.encode({"timestamp": 1}))
+
+        ## Delivered before the next invocation.
+        assert encoder.acknowledge(delta.payload_tag(first))
+        second = encoder.encode({"timestamp": 1})
+        encoder.commit(acknowledged=False)
+        assert delta.is_delta(second)
+        assert encoder.acknowledge(delta.payload_tag(second))
+        assert delta.reconstruct([first, second])[-1] == {"timestamp": 1}
+
+    def test_acknowledgement_needs_its_base(self):
+        encoder = delta.DeltaEncoder(self.state_file)
+        payloads = []
+        for i in range(3):
+            payloads.append(encoder.encode({"timestamp": i}))
+            encoder.commit()
+        encoder.encode({"timestamp": 3})
+        encoder.commit(acknowledged=False)
+
+        ## The receiver got the delta after a dropped one: it can't
+        ## rebuild it, so it doesn't count.
+        tag = delta.payload_tag(payloads[2])
+        assert '.' in tag
+        open(encoder.ack_file, 'w').write(delta.payload_tag(payloads[0]))
+        assert not encoder.acknowledge(tag)
+        assert encoder.acknowledged() == payloads[0]["_hash"]
+        assert not delta.is_delta(encoder.encode({"timestamp": 4}))
@@ -0,0 +1,79 @@
+import threading
+import time
+import unittest
+
+from profilers.executor import run_lookups
+
+
+def slow(seconds, value=None):
+    def fn():
+        time.sleep(seconds)
+        return value
+    return fn
+
+
+def broken():
+    raise ValueError("boom")
+
+
+class ExecutorTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def test_results_match_serial(self):
+        lookups = dict((str(i), slow(0.01, i)) for i in range(20))
+        res = run_lookups(lookups, max_workers=4)
+        assert res == dict((str(i), i) for i in range(20))
+
+    def test_lookups_overlap(self):
+        lookups = dict((str(i), slow(0.2, i)) for i in range(4))
+        start = time.time()
+        run_lookups(lookups, max_workers=4)
+        assert time.time() - start < 0.6
+
+    def test_per_lookup_timeout(self):
+        lookups = {"slow": slow(5), "fast": slow(0, "ok")}
+        start = time.time()
+        res = run_lookups(lookups, max_workers=2, timeouts={"slow": 0.1})
+        assert time.time() - start < 1
+        assert res["slow"] == {"status": "timeout"}
+        assert res["fast"] == "ok"
+
+    def test_stuck_worker_is_replaced(self):
+        lookups = {"a": slow(5), "b": slow(0, "b"), "c": slow(0, "c")}
+        res = run_lookups(lookups, max_workers=1,
+                          timeouts={"a": 0.1}, budget=2)
+        assert res["b"] == "b"
+        assert res["c"] == "c"
+
+    def test_budget(self):
+        lookups = dict((str(i), slow(5)) for i in range(3))
+        start = time.time()
+        res = run_lookups(lookups, max_workers=1, budget=0.2)
+        assert time.time() - start < 1
+        assert all(v == {"status": "timeout"} for v in res.values())
+
+    def test_errors_are_recorded(self):
+        res = run_lookups({"broken": broken})
+        assert res["broken"] == {"status": "error", "error": "ValueError"}
+
+    def test_idle_workers_joined(self):
+        lookups = dict((str(i), slow(0, i)) for i in range(8))
+        for _ in range(50):
+            before = threading.active_count()
+            run_lookups(lookups, max_workers=4)
+            assert threading.active_count() == before
+
+    def test_nothing_starts_after_return(self):
+        calls = []
+
+        def lookup():
+            calls.append(time.time())
+            time.sleep(0.1)
+
+        lookups = dict((str(i), lookup) for i in range(6))
+        run_lookups(lookups, max_workers=2, budget=0.15)
+        returned = time.time()
+        time.sleep(0.3)
+        assert len(calls) < 6
+        assert all(t < returned for t in calls)
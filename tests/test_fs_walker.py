@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from profilers.fs_walker import DirIndex, WalkBudget, walk, walk_roots
+from profilers.posix_permissions import AccessEvaluator, PosixPermissions
+
+
+class FsWalkerTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.permissions = PosixPermissions()
+
+        layout = {
+            'a': 0o755,
+            'a/b': 0o555,
+            'a/b/c': 0o777,
+            'a/d': 0o711,
+            'a/d/e': 0o777,
+            'f': 0o300,
+            'f/g': 0o777,
+        }
+        for path in sorted(layout):
+            os.mkdir(os.path.join(self.root, path))
+        for path in sorted(layout, reverse=True):
+            os.chmod(os.path.join(self.root, path), layout[path])
+        open(os.path.join(self.root, 'a', 'file'), 'w').close()
+
+    def tearDown(self):
+        for dirpath, dirnames, _ in os.walk(self.root):
+            for d in dirnames:
+                os.chmod(os.path.join(dirpath, d), 0o755)
+        shutil.rmtree(self.root)
+
+    def test_same_paths_as_recursive_walk(self):
+        expected = self.permissions.list_of_writable_paths_in_path(self.root)
+        res = walk_roots([self.root], self.permissions.access_from_stat)
+        assert res == expected
+
+    def test_symlink_cycle(self):
+        os.symlink('.', os.path.join(self.root, 'a', 'loop'))
+        res = walk_roots([self.root], self.permissions.access_from_stat)
+        assert not [p for p in res if 'loop' in p]
+
+    def test_depth_budget(self):
+        budget = WalkBudget(max_depth=1)
+        res = [p for (p, _, _) in
+               walk(self.root, self.permissions.access_from_stat, budget)]
+        assert os.path.join(self.root, 'a') in res
+        assert os.path.join(self.root, 'a', 'b') not in res
+        assert budget.stats()['truncated'] == 'depth'
+
+    def test_entry_budget_and_prune(self):
+        budget = WalkBudget(max_entries=2)
+        res = list(walk(self.root, self.permissions.access_from_stat, budget))
+        assert len(res) == 2
+        assert budget.stats()['truncated'] == 'entries'
+
+        budget = WalkBudget(prune=['*/a'])
+        res = [p for (p, _, _) in
+               walk(self.root, self.permissions.access_from_stat, budget)]
+        assert not [p for p in res if p.startswith(os.path.join(self.root, 'a'))]
+
+    def test_missing_root(self):
+        res = walk_roots([os.path.join(self.root, 'nope'), self.root],
+                         self.permissions.access_from_stat)
+        assert res[0] == self.root
+
+    def test_permission_records(self):
+        records = list(self.permissions.iter_permission_records([self.root]))
+        assert records[0][0] == self.root
+        assert all(len(r) == 5 for r in records)
+
+        streamed = list(self.permissions.iter_writable_paths([self.root]))
+        assert streamed == self.permissions.list_of_writable_paths_in_path(self.root)
+
+    def test_mask_evaluator_matches_octal_checks(self):
+        st = os.stat(self.root)
+        perms = self.permissions
+        for mode in range(0o1000):
+            for uid in (perms.my_uid, perms.my_uid + 1):
+                for gid in (st.st_gid, 65534):
+                    fake = os.stat_result((0o040000 | mode, 0, 0, 1, uid, gid,
+                                           0, 0, 0, 0))
+                    assert perms.access_from_stat(fake) == (
+                        perms.check_octals_in_stat(fake, perms._octal_is_readable),
+                        perms.check_octals_in_stat(fake, perms._octal_is_writable),
+                        perms.check_octals_in_stat(fake, perms._octal_is_executable))
+
+    def test_access_mode(self):
+        evaluator = AccessEvaluator(mode='access')
+        assert evaluator(None, self.root) == (
+            os.access(self.root, os.R_OK),
+            os.access(self.root, os.W_OK),
+            os.access(self.root, os.X_OK))
+
+    def index_walk(self, index_file, racy=0):
+        index = DirIndex(index_file, owner=[1, 2, 'mask'], racy=racy).load()
+        paths = walk_roots([self.root], self.permissions.access_from_stat, index=index)
+        index.save()
+        return paths, index.stats()
+
+    def test_index_reuses_unchanged_directories(self):
+        index_file = os.path.join(tempfile.mkdtemp(), 'index.json')
+        try:
+            expected = self.permissions.list_of_writable_paths_in_path(self.root)
+            paths, stats = self.index_walk(index_file)
+            assert paths == expected
+            assert stats == {'reused': 0, 'revalidated': 7}
+
+            paths, stats = self.index_walk(index_file)
+            assert paths == expected
+            assert stats == {'reused': 7, 'revalidated': 0}
+
+            ## New subdirectory: its parent's mtime moves.
+            os.mkdir(os.path.join(self.root, 'a', 'd', 'e', 'new'))
+            os.utime(os.path.join(self.root, 'a', 'd', 'e'), (1000000, 1000000))
+            paths, stats = self.index_walk(index_file)
+            assert paths == self.permissions.list_of_writable_paths_in_path(self.root)
+            assert os.path.join(self.root, 'a', 'd', 'e', 'new') in paths
+            assert stats == {'reused': 6, 'revalidated': 2}
+
+            ## chmod: the mode is part of the key.
+            os.chmod(os.path.join(self.root, 'a', 'b', 'c'), 0o555)
+            paths, stats = self.index_walk(index_file)
+            assert os.path.join(self.root, 'a', 'b', 'c') not in paths
+            assert stats['revalidated'] == 1
+        finally:
+            shutil.rmtree(os.path.dirname(index_file))
+
+    def test_index_racy_and_foreign_entries(self):
+        index_file = os.path.join(tempfile.mkdtemp(), 'index.json')
+        try:
+            ## Everything was just created, so nothing is trusted yet.
+            self.index_walk(index_file, racy=60)
+            assert self.index_walk(index_file)[1]['reused'] == 0
+
+            self.index_walk(index_file)
+            other = DirIndex(index_file, owner=[0, [], 'mask']).load()
+            assert other.entries == {}
+        finally:
+            shutil.rmtree(os.path.dirname(index_file))
@@ -0,0 +1,33 @@
+import os
+import unittest
+
+from benchmarks import import_time
+
+
+## Modules that used to be imported by `import launcher` and now must
+## only be loaded by the lookups or storage paths that need them.
+HEAVY_MODULES = ['pkg_resources', 'pkgutil', 'platform', 'socket', 'ssl',
+                 'urllib2', 'urllib.request', 'gzip', 'uuid', 'copy',
+                 'profilers.posix_permissions']
+
+
+class ImportTimeTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def test_launcher_import_budget(self):
+        budget = float(os.getenv('PROFILER_IMPORT_BUDGET_MS',
+                                 import_time.DEFAULT_BUDGET_MS))
+        elapsed, modules = import_time.measure('launcher')
+        assert elapsed < budget, "import launcher took {:.1f} ms".format(elapsed)
+
+    def test_heavy_modules_are_lazy(self):
+        _, modules = import_time.measure('launcher')
+        assert not [m for m in HEAVY_MODULES if m in modules]
+
+    def test_parse_importtime(self):
+        stderr = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       491 |        491 |     profilers.utils\n"
+                  "import time:      2883 |       3374 | launcher\n")
+        res = import_time.parse_importtime(stderr)
+        assert res == {'profilers.utils': (491, 491), 'launcher': (2883, 3374)}
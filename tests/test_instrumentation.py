@@ -0,0 +1,92 @@
+import time
+import unittest
+
+from profilers.executor import run_lookups
+from profilers.instrumentation import Instrumentation
+from profilers.profiler_base import Profiler
+from profilers.utils import call_shell_wrapper
+
+
+def nap():
+    time.sleep(0.05)
+    return 'nap'
+
+
+def spin():
+    return sum(range(100000))
+
+
+def shell():
+    return call_shell_wrapper(['true'])
+
+
+def broken():
+    raise KeyError('missing')
+
+
+class DummyProfiler(Profiler):
+    lookups = {
+        "nap": nap,
+        "spin": spin,
+        "shell": shell,
+    }
+
+
+class InstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def test_records(self):
+        instrumentation = Instrumentation()
+        lookups = instrumentation.wrap(DummyProfiler.lookups)
+        lookups['nap']()
+        lookups['shell']()
+
+        records = instrumentation.timings()
+        assert records['nap']['wall'] >= 0.05
+        assert records['nap']['subprocesses'] == 0
+        assert records['shell']['subprocesses'] == 1
+        assert records['shell']['exception'] is None
+
+    def test_exception_type(self):
+        instrumentation = Instrumentation()
+        wrapped = instrumentation.wrap({"broken": broken})
+        self.assertRaises(KeyError, wrapped['broken'])
+        assert instrumentation.timings()['broken']['exception'] == 'KeyError'
+
+    def test_collect_emits_timings(self):
+        res = DummyProfiler.collect(timings=True, slowest=1)
+        assert res['nap'] == 'nap'
+        assert set(res['_timings']) == set(DummyProfiler.lookups)
+        assert res['_slowest'][0][0] == 'nap'
+
+    def test_abandoned_lookups_are_recorded(self):
+        class SlowProfiler(DummyProfiler):
+            lookups = {"nap": nap, "stuck": lambda: time.sleep(2)}
+            lookup_timeouts = {"stuck": 0.1}
+
+        res = SlowProfiler.collect(concurrent=True, timings=True, slowest=1)
+        assert res['stuck'] == {"status": "timeout"}
+        record = res['_timings']['stuck']
+        assert record['timed_out'] is True
+        assert 0.1 <= record['wall'] < 0.5
+        assert res['_timings']['nap']['timed_out'] is False
+        assert res['_slowest'][0][0] == 'stuck'
+
+    def test_lookups_never_started(self):
+        instrumentation = Instrumentation()
+        lookups = instrumentation.wrap({"a": lambda: time.sleep(0.3),
+                                        "b": lambda: time.sleep(0.3)})
+        run_lookups(lookups, max_workers=1, budget=0.1,
+                    on_timeout=instrumentation.abandoned)
+        records = instrumentation.timings()
+        assert records['a']['timed_out'] and records['b']['timed_out']
+        assert sorted(r['wall'] for r in records.values())[0] == 0.0
+        ## The late finish doesn't replace the record.
+        time.sleep(0.3)
+        assert instrumentation.timings() == records
+
+    def test_collect_without_timings(self):
+        res = DummyProfiler.collect()
+        assert '_timings' not in res
+        assert '_slowest' not in res
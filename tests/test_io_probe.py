@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from profilers import io_probe
+from profilers.posix_core import PosixCoreProfiler
+from profilers.utils import percentiles
+
+
+class IOProbeTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_probe_path(self):
+        start = time.time()
+        res = io_probe.probe_path(self.dir, size=2 * 1024 * 1024, seconds=0.4,
+                                  block=256 * 1024)
+        elapsed = time.time() - start
+        assert 'error' not in res, res
+        assert res['written'] <= 2 * 1024 * 1024
+        assert res['write_mb_s'] > 0
+        assert res['read_mb_s'] > 0
+        assert res['random_read_iops'] > 0
+        assert res['fsyncs'] > 0
+        assert res['fsync_ms']['p50'] <= res['fsync_ms']['p99'] <= res['fsync_ms']['max']
+        ## Within budget, allowing for one fsync past the deadline.
+        assert elapsed < 2.0
+        ## Cleaned up after itself.
+        assert os.listdir(self.dir) == []
+
+    def test_insufficient_space(self):
+        res = io_probe.probe_path(self.dir, size=1 << 60)
+        assert res['error'] == 'insufficient space'
+        assert os.listdir(self.dir) == []
+
+    def test_unwritable_path(self):
+        res = io_probe.probe_path(os.path.join(self.dir, 'missing'), seconds=0.1)
+        assert 'error' in res
+
+    def test_one_path_per_filesystem(self):
+        other = os.path.join(self.dir, 'sub')
+        os.mkdir(other)
+        assert io_probe.filesystems([self.dir, other, '/nonexistent']) == [self.dir]
+
+    def test_percentiles(self):
+        res = percentiles(range(1, 101))
+        assert res == {'p50': 50, 'p90': 90, 'p99': 99, 'min': 1, 'max': 100}
+        assert percentiles([]) == {}
+        assert percentiles([3])['p99'] == 3
+
+    def test_nothing_written(self):
+        res = io_probe.probe_path(self.dir, size=1024 * 1024, seconds=0)
+        assert res['written'] == 0
+        assert res['random_read_iops'] is None
+        assert res['read_mb_s'] is None
+        assert os.listdir(self.dir) == []
+
+    def test_time_split_between_filesystems(self):
+        start = time.time()
+        res = io_probe.probe(['/nonexistent', self.dir], size=1024 * 1024, seconds=0.2)
+        assert [r['path'] for r in res] == [self.dir]
+        assert time.time() - start < 1.0
+
+
+class IOProbeRunTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        for name in ('PROFILER_IO_PROBE', 'PROFILER_IO_SIZE'):
+            os.environ.pop(name, None)
+
+    def test_off_by_default(self):
+        assert 'io' not in PosixCoreProfiler.lookups
+        assert PosixCoreProfiler.run_probes({}) == {}
+
+    def test_runs_on_found_paths(self):
+        os.environ['PROFILER_IO_PROBE'] = '1'
+        os.environ['PROFILER_IO_SIZE'] = str(1024 * 1024)
+        res = PosixCoreProfiler.run_probes({'permissions': [self.dir]},
+                                           budget=1.0, started=time.time())
+        assert res['io'][0]['path'] == '/tmp'
+        assert all('error' not in r for r in res['io'])
+
+    def test_skipped_without_budget(self):
+        os.environ['PROFILER_IO_PROBE'] = '1'
+        res = PosixCoreProfiler.run_probes({}, budget=1.0, started=time.time() - 1.0)
+        assert res['io'] == {'status': 'skipped'}
@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from profilers import is_warm
+
+
+class IsWarmTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'lambda-is-warm')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_cold_then_warm(self):
+        state = is_warm.WarmState(self.path)
+        assert state.is_warm == 'not warm'
+        assert state.warm_since is None
+        assert state.warm_for == 0
+
+        state.mark_warm()
+        assert os.path.isfile(self.path)
+
+        state = is_warm.WarmState(self.path)
+        assert state.is_warm == 'warm'
+        assert state.warm_since == os.stat(self.path).st_mtime
+        assert state.warm_for >= 0
+
+    def test_mark_warm_is_exclusive(self):
+        with open(self.path, 'w') as f:
+            f.write('first')
+        mtime = os.stat(self.path).st_mtime
+
+        ## A stale snapshot must not clobber another process' warm file.
+        state = is_warm.WarmState(os.path.join(self.tmp, 'other'))
+        state.path = self.path
+        state.mark_warm()
+        assert open(self.path).read() == 'first'
+        assert os.stat(self.path).st_mtime == mtime
+
+    def test_not_possible(self):
+        state = is_warm.WarmState(os.path.join(self.tmp, 'missing', 'warm'))
+        assert state.is_warm == 'not possible'
+
+    def test_invocation_stats(self):
+        before = is_warm.invocation_stats()
+        is_warm._process['warm_file'], saved = self.path, is_warm.warm_file()
+        try:
+            for _ in range(2):
+                is_warm.end_invocation(is_warm.begin_invocation())
+        finally:
+            is_warm._process['warm_file'] = saved
+
+        after = is_warm.invocation_stats()
+        assert after['count'] == before['count'] + 2
+        assert after['warm'] == before['warm'] + 1
@@ -0,0 +1,40 @@
+import json
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from profilers import json_stream
+
+
+class JsonStreamTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def test_generators_become_arrays(self):
+        doc = {
+            "permissions": (p for p in ["/tmp", "/tmp/a"]),
+            "records": iter([("/tmp", 1023, True, True, True)]),
+            "nested": {"list": [1, 2.5, None, "x"], "flag": False},
+        }
+        out = StringIO()
+        json_stream.write_json(doc, out)
+
+        assert json.loads(out.getvalue()) == {
+            "permissions": ["/tmp", "/tmp/a"],
+            "records": [["/tmp", 1023, True, True, True]],
+            "nested": {"list": [1, 2.5, None, "x"], "flag": False},
+        }
+
+    def test_ndjson(self):
+        out = StringIO()
+        count = json_stream.write_ndjson(({"i": i} for i in range(3)), out)
+        assert count == 3
+        lines = out.getvalue().splitlines()
+        assert [json.loads(l) for l in lines] == [{"i": 0}, {"i": 1}, {"i": 2}]
+
+    def test_dumps_matches_json(self):
+        doc = {"a": [1, {"b": "c"}], "d": u"\u00e9"}
+        assert json.loads(json_stream.dumps(doc)) == doc
@@ -1,7 +1,15 @@
+import json
+import os
+import sys
 import launcher
 import launcher
 import unittest
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 
 class LauncherTest(unittest.TestCase):
     def setUp(self):
@@ -11,3 +19,71 @@ class LauncherTest(unittest.TestCase):
         res = launcher.wrapper()
         assert res is not None
 
+
+    def test_concurrent_options_use_remaining_time(self):
+        class Context(object):
+            def get_remaining_time_in_millis(self):
+                return 3000
+
+        os.environ['PROFILER_EXECUTOR'] = 'concurrent'
+        try:
+            options = launcher.get_profile_options(Context())
+        finally:
+            del os.environ['PROFILER_EXECUTOR']
+
+        assert options['concurrent'] is True
+        assert options['budget'] == 2.5
+
+    def test_no_sink_skips_spooling(self):
+        import tempfile
+        spool_dir = os.path.join(tempfile.mkdtemp(), 'spool')
+        os.environ['PROFILER_DELIVERY'] = 'async'
+        os.environ['PROFILER_SPOOL_DIR'] = spool_dir
+        try:
+            results = {"uname": "Linux"}
+            assert launcher.get_shipper(results)(results) is None
+        finally:
+            del os.environ['PROFILER_DELIVERY']
+            del os.environ['PROFILER_SPOOL_DIR']
+            os.rmdir(os.path.dirname(spool_dir))
+        assert 'delivery' not in results
+
+    def test_post_deadline_cleared_after_handler(self):
+        import transport
+
+        class Context(object):
+            def get_remaining_time_in_millis(self):
+                return 3000
+
+        os.environ['observatory_api_key'] = 'key'
+        os.environ['observatory_api_url'] = 'http://127.0.0.1:9/api/profile'
+        try:
+            launcher.lambda_handler(None, Context())
+        finally:
+            del os.environ['observatory_api_key']
+            del os.environ['observatory_api_url']
+            transport.clear_transports()
+        assert transport._deadline.get('deadline') is None
+
+    def test_stdout_fallback_keeps_streamed_sections(self):
+        import transport
+        os.environ['observatory_api_key'] = 'key'
+        os.environ['observatory_api_url'] = 'http://127.0.0.1:9/api/profile'
+        os.environ['PROFILER_STREAM_PERMISSIONS'] = '1'
+        ## A cached permissions list would hide the stream.
+        os.environ['PROFILER_CACHE'] = '0'
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            res = launcher.lambda_handler(None, None)
+            printed = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+            for name in ('observatory_api_key', 'observatory_api_url',
+                         'PROFILER_STREAM_PERMISSIONS', 'PROFILER_CACHE'):
+                del os.environ[name]
+            transport.clear_transports()
+
+        doc = json.loads(printed)
+        assert doc['permissions']
+        assert doc['permissions'] == res['permissions']
@@ -0,0 +1,138 @@
+import socket
+import struct
+import threading
+import time
+import unittest
+
+from profilers import ntp
+from profilers.posix_core import ntp_measurement
+
+
+class StandIn(object):
+
+    """A local NTP server whose clock is `offset` seconds ahead, taking
+    `delay` seconds to answer, or never answering when `silent`.
+    """
+
+    def __init__(self, host, port=0, offset=0.0, delay=0.0, silent=False, stratum=2):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.settimeout(0.1)
+        self.port = self.sock.getsockname()[1]
+        self.offset = offset
+        self.delay = delay
+        self.silent = silent
+        self.stratum = stratum
+        self.requests = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        while self.running:
+            try:
+                data, address = self.sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except socket.error:
+                return
+            self.requests += 1
+            if self.silent:
+                continue
+            fields = struct.unpack(ntp.PACKET_FORMAT, data[:ntp.PACKET_SIZE])
+            received = ntp.to_ntp(time.time() + self.offset)
+            time.sleep(self.delay)
+            transmit = ntp.to_ntp(time.time() + self.offset)
+            packet = struct.pack(ntp.PACKET_FORMAT, (4 << 3) | ntp.MODE_SERVER,
+                                 self.stratum, 0, 0, 0, 0, 0, 0, 0,
+                                 fields[13], fields[14],
+                                 received[0], received[1], transmit[0], transmit[1])
+            self.sock.sendto(packet, address)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+
+class NTPTest(unittest.TestCase):
+    def setUp(self):
+        ntp.clear_cache()
+        self.standins = []
+
+    def tearDown(self):
+        for standin in self.standins:
+            standin.close()
+
+    def standin(self, host, **kwargs):
+        port = self.standins[0].port if self.standins else 0
+        standin = StandIn(host, port, **kwargs)
+        self.standins.append(standin)
+        return standin
+
+    def test_timestamps_round_trip(self):
+        now = time.time()
+        assert abs(ntp.from_ntp(*ntp.to_ntp(now)) - now) < 1e-6
+
+    def test_offset_delay(self):
+        ## Server 5s ahead, 0.1s each way, 0.02s to answer.
+        offset, delay = ntp.offset_delay(100.0, 105.1, 105.12, 100.22)
+        assert abs(offset - 5.0) < 1e-9
+        assert abs(delay - 0.2) < 1e-9
+
+    def test_median(self):
+        assert ntp.median([3, 1, 2]) == 2
+        assert ntp.median([4, 1, 2, 3]) == 2.5
+        assert ntp.median([]) is None
+
+    def test_median_across_servers(self):
+        a = self.standin('127.0.0.1', offset=2.0)
+        self.standin('127.0.0.2', offset=2.1)
+        self.standin('127.0.0.3', offset=30.0, delay=0.05)
+        res = ntp.measure(['127.0.0.1', '127.0.0.2', '127.0.0.3'], port=a.port, deadline=1.0)
+        assert res['answered'] == 3
+        assert abs(res['offset'] - 2.1) < 0.01
+        assert res['drift'] == res['offset']
+        ## The server's processing time isn't counted as network delay.
+        assert res['servers']['127.0.0.3']['delay'] < 0.05
+
+    def test_deadline(self):
+        a = self.standin('127.0.0.1', offset=-1.0)
+        self.standin('127.0.0.2', silent=True)
+        start = time.time()
+        res = ntp.measure(['127.0.0.1', '127.0.0.2'], port=a.port, deadline=0.3)
+        assert time.time() - start < 0.6
+        assert res['answered'] == 1
+        assert abs(res['offset'] + 1.0) < 0.01
+        assert res['servers']['127.0.0.2'] == {'error': 'timeout'}
+
+    def test_errors(self):
+        a = self.standin('127.0.0.1', stratum=0)
+        res = ntp.measure(['127.0.0.1', 'host.invalid'], port=a.port, deadline=0.5)
+        assert res['answered'] == 0
+        assert res['offset'] is None and res['drift'] is None
+        assert res['servers']['127.0.0.1'] == {'error': 'kiss of death'}
+        assert 'error' in res['servers']['host.invalid']
+
+    def test_cached(self):
+        a = self.standin('127.0.0.1', offset=1.0)
+        first = ntp.cached_measure(['127.0.0.1'], port=a.port, deadline=0.5, ttl=60)
+        second = ntp.cached_measure(['127.0.0.1'], port=a.port, deadline=0.5, ttl=60)
+        assert second is first
+        assert a.requests == 1
+        ntp.cached_measure(['127.0.0.1'], port=a.port, deadline=0.5, ttl=0)
+        assert a.requests == 2
+
+    def test_servers_from_env(self):
+        import os
+        os.environ['PROFILER_NTP_SERVERS'] = 'host.invalid'
+        os.environ['PROFILER_NTP_DEADLINE_MS'] = '200'
+        try:
+            start = time.time()
+            res = ntp_measurement()
+        finally:
+            del os.environ['PROFILER_NTP_SERVERS']
+            del os.environ['PROFILER_NTP_DEADLINE_MS']
+        assert time.time() - start < 0.5
+        assert list(res['servers']) == ['host.invalid']
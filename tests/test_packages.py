@@ -0,0 +1,58 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from profilers import packages
+
+
+class PackagesTest(unittest.TestCase):
+    def setUp(self):
+        self.site = tempfile.mkdtemp()
+        self.cache = os.path.join(tempfile.mkdtemp(), 'packages.json')
+        packages._memo.clear()
+
+        os.mkdir(os.path.join(self.site, 'pkg_one'))
+        open(os.path.join(self.site, 'pkg_one', '__init__.py'), 'w').close()
+        os.mkdir(os.path.join(self.site, 'not_a_package'))
+        open(os.path.join(self.site, 'mod_two.py'), 'w').close()
+
+        info = os.path.join(self.site, 'pkg_one-1.2.3.dist-info')
+        os.mkdir(info)
+        with open(os.path.join(info, 'METADATA'), 'w') as f:
+            f.write('Metadata-Version: 2.1\nName: pkg-one\nVersion: 1.2.3\n\nBody\n')
+
+    def tearDown(self):
+        packages._memo.clear()
+        shutil.rmtree(self.site)
+        shutil.rmtree(os.path.dirname(self.cache))
+
+    def test_scan(self):
+        res = packages.inventory([self.site], cache_file=self.cache)
+        assert res['modules'] == ['mod_two', 'pkg_one']
+        assert res['versions'] == {'pkg_one': {'version': '1.2.3'}}
+
+    def test_cache_file(self):
+        res = packages.inventory([self.site], cache_file=self.cache)
+        with open(self.cache) as f:
+            cached = json.load(f)
+        assert cached['fingerprint'] == packages.fingerprint([self.site])
+
+        ## A new process in the same container reads the file, not the disk.
+        packages._memo.clear()
+        cached['inventory']['modules'].append('from_cache')
+        with open(self.cache, 'w') as f:
+            json.dump(cached, f)
+        res = packages.inventory([self.site], cache_file=self.cache)
+        assert 'from_cache' in res['modules']
+
+    def test_rescan_on_change(self):
+        packages.inventory([self.site], cache_file=self.cache)
+        open(os.path.join(self.site, 'mod_three.py'), 'w').close()
+        ## Make sure the directory mtime moves even on coarse filesystems.
+        st = os.stat(self.site)
+        os.utime(self.site, (st.st_atime, st.st_mtime + 10))
+
+        res = packages.inventory([self.site], cache_file=self.cache)
+        assert 'mod_three' in res['modules']
@@ -0,0 +1,129 @@
+import os
+import unittest
+
+from profilers import procfs
+from profilers.posix_core import PosixCoreProfiler
+from profilers.utils import spawn_count
+
+
+class ProcfsTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def test_process_table_has_us(self):
+        table = procfs.read_process_table()
+        me = [p for p in table if p['pid'] == os.getpid()]
+        assert len(me) == 1
+        assert me[0]['ppid'] == os.getppid()
+        assert 'python' in me[0]['command']
+
+    def test_uid_sources_agree(self):
+        clock_ticks = os.sysconf('SC_CLK_TCK')
+        page_kb = os.sysconf('SC_PAGE_SIZE') // 1024
+        status = procfs.read_process(os.getpid(), clock_ticks, page_kb)
+        stat = procfs.read_process(os.getpid(), clock_ticks, page_kb, uid_from='stat')
+        assert status['user'] == stat['user']
+        assert status['command'] == stat['command']
+        assert procfs.read_process(2 ** 22 + 1, clock_ticks, page_kb, uid_from='stat') is None
+
+    def test_disk_usage(self):
+        usage = procfs.disk_usage()
+        assert usage
+        for fs in usage:
+            assert fs['used'] <= fs['size']
+
+    def test_parse_capabilities(self):
+        assert procfs.parse_capabilities('CapEff:\t0000003fffffffff\n') == 0x3fffffffff
+        assert procfs.parse_capabilities('0000000000000000') == 0
+        assert procfs.parse_capabilities(None) == 0
+        assert procfs.parse_capabilities('garbage') == 0
+
+    def test_native_backend_does_not_fork(self):
+        lookups = ["pwd", "df", "ps", "proc_capabilities", "other_runtimes"]
+        before = spawn_count()
+        for name in lookups:
+            PosixCoreProfiler.lookups[name]()
+        assert spawn_count() == before
+
+    def test_snapshot_columns(self):
+        snapshot = procfs.ProcessSnapshot.take()
+        table = snapshot.to_dict()
+
+        assert table['count'] == len(table['pid']) == len(table['command'])
+        assert not table['truncated']
+        i = table['pid'].index(os.getpid())
+        assert table['ppid'][i] == os.getppid()
+        assert table['user'][i] == procfs._user_name(os.geteuid())
+        assert 'python' in table['command'][i]
+        assert list(snapshot.rows())[i]['pid'] == os.getpid()
+
+    def test_snapshot_filters(self):
+        runtime = procfs.runtime_pids()
+        assert os.getpid() in runtime
+        assert os.getppid() in runtime
+
+        table = procfs.ProcessSnapshot.take(exclude=runtime).to_dict()
+        assert not runtime & set(table['pid'])
+
+        capped = procfs.ProcessSnapshot.take(max_rows=1).to_dict()
+        assert capped['count'] == 1
+        assert capped['truncated'] == (len(procfs.ProcessSnapshot.take()) > 1)
+
+    def test_snapshot_sampling(self):
+        snapshot = procfs.ProcessSnapshot.sample(0.05)
+        table = snapshot.to_dict()
+
+        assert len(table['cpu_percent']) == table['count']
+        i = table['pid'].index(os.getpid())
+        assert table['cpu_percent'][i] >= 0
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class ProcInfoTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def test_cpuinfo(self):
+        cpuinfo = procfs.read_cpuinfo(path=os.path.join(FIXTURES, 'cpuinfo-96'))
+
+        assert len(cpuinfo) == 96
+        assert cpuinfo['proc95']['processor'] == '95'
+        assert cpuinfo['proc0']['address sizes'] == '46 bits physical, 57 bits virtual'
+        assert cpuinfo['proc0']['power management'] == ''
+        ## Equal values are shared between blocks.
+        assert cpuinfo['proc0']['flags'] is cpuinfo['proc1']['flags']
+
+    def test_cpuinfo_dedup(self):
+        path = os.path.join(FIXTURES, 'cpuinfo-96')
+        full = procfs.read_cpuinfo(path=path)
+        dedup = procfs.read_cpuinfo(dedup=True, path=path)
+
+        assert dedup['count'] == 96
+        ## One group per socket.
+        assert [g['processors'] for g in dedup['groups']] == [
+            list(range(48)), list(range(48, 96))]
+        group = dedup['groups'][1]
+        assert group['info']['physical id'] == '1'
+        assert 'apicid' not in group['info']
+        for i, cpu in enumerate(group['processors']):
+            block = dict(group['info'])
+            block['processor'] = str(cpu)
+            for key, values in group['per_processor'].items():
+                block[key] = values[i]
+            assert block == full['proc%s' % cpu]
+
+    def test_meminfo(self):
+        path = os.path.join(FIXTURES, 'meminfo')
+        meminfo = procfs.read_meminfo(path=path)
+        as_int = procfs.read_meminfo(as_int=True, path=path)
+
+        assert meminfo['MemTotal'] == '6158152 kB'
+        assert as_int['MemTotal'] == 6158152
+        assert as_int['HugePages_Total'] == 0
+        assert sorted(meminfo) == sorted(as_int)
+
+    def test_missing_files(self):
+        assert procfs.read_cpuinfo(path='/nonexistent') == {}
+        assert procfs.read_meminfo(path='/nonexistent') == {}
@@ -0,0 +1,105 @@
+import os
+import time
+import unittest
+
+import launcher
+from profilers import sampler
+from profilers.posix_core import PosixCoreProfiler
+
+
+class SamplerTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def test_ring_buffer(self):
+        ring = sampler.RingBuffer(3, 'l')
+        assert ring.values() == []
+        for value in range(1, 6):
+            ring.append(value)
+        assert len(ring) == 3
+        assert ring.values() == [3, 4, 5]
+        ring.clear()
+        ring.append(7)
+        assert ring.values() == [7]
+
+    def test_samples_an_invocation(self):
+        s = sampler.Sampler(interval=0.01, size=500)
+        s.begin()
+        time.sleep(0.1)
+        res = s.end()
+        assert res['count'] >= 3
+        assert res['dropped'] == 0
+        assert len(res['t_ms']) == res['count']
+        assert res['t_ms'] == sorted(res['t_ms'])
+        for name, values in res['series'].items():
+            assert len(values) == res['count'], name
+        assert res['series']['rss_kb'][0] > 0
+        assert res['series']['mem_available_kb'][0] > 0
+        summary = res['summary']['rss_kb']
+        assert summary['min'] <= summary['p50'] <= summary['p99'] <= summary['max']
+
+    def test_buffers_are_reused(self):
+        s = sampler.Sampler(interval=0.005, size=4)
+        buffers = s.series['rss_kb'].data
+        for _ in range(2):
+            s.begin()
+            time.sleep(0.05)
+            res = s.end()
+            assert len(res['t_ms']) == 4
+            assert res['dropped'] == res['count'] - 4
+        assert s.series['rss_kb'].data is buffers
+
+    def test_mem_available(self):
+        meminfo = b'MemTotal:  100 kB\nMemAvailable:   4242 kB\n'
+        assert sampler._mem_available(meminfo) == 4242
+        assert sampler._mem_available(b'MemTotal:  100 kB\n') == -1
+
+    def test_sampler_option(self):
+        os.environ['PROFILER_SAMPLER'] = '1'
+        try:
+            options = launcher.get_profile_options(None)
+        finally:
+            del os.environ['PROFILER_SAMPLER']
+        assert options['sample'] is True
+        assert options['sample_interval'] == 0.05
+
+    def test_run_adds_samples(self):
+        class Profiler(PosixCoreProfiler):
+            lookups = {'pwd': lambda: os.getcwd()}
+            lookup_ttls = {}
+        res = Profiler.run(sample=True, sample_interval=0.01)
+        assert res['_samples']['count'] >= 1
+
+    def test_sampler_stops_when_collect_fails(self):
+        class Profiler(PosixCoreProfiler):
+            @classmethod
+            def collect(cls, **options):
+                raise ValueError("boom")
+        with self.assertRaises(ValueError):
+            Profiler.run(sample=True, sample_interval=0.01, keep_sampling=True)
+        assert sampler.shared_sampler()._thread is None
+
+    def test_handler_samples_whole_invocation(self):
+        import json
+        import sys
+        try:
+            from StringIO import StringIO
+        except ImportError:
+            from io import StringIO
+
+        os.environ['PROFILER_SAMPLER'] = '1'
+        os.environ['PROFILER_SAMPLE_INTERVAL_MS'] = '10'
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            res = launcher.lambda_handler(None, None)
+            printed = json.loads(sys.stdout.getvalue())
+        finally:
+            sys.stdout = stdout
+            del os.environ['PROFILER_SAMPLER']
+            del os.environ['PROFILER_SAMPLE_INTERVAL_MS']
+
+        ## Sampling went on while the results were written out.
+        assert res['_samples']['t_ms'][-1] >= printed['_samples']['t_ms'][-1]
+        assert res['_samples']['count'] > printed['_samples']['count']
+        assert sampler.shared_sampler()._thread is None
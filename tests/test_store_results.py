@@ -0,0 +1,67 @@
+import gzip
+import json
+import os
+import unittest
+from io import BytesIO
+
+import store_results
+
+
+class CompressResultsTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def test_gzip_round_trip(self):
+        res = {"uname": "Linux", "count": 3, "text": u"caf\u00e9"}
+        data = store_results.compress_results(res)
+
+        assert isinstance(data, bytes)
+        text = gzip.GzipFile(fileobj=BytesIO(data)).read().decode('utf-8')
+        assert json.loads(text) == res
+
+    def test_streams_large_and_lazy_sections(self):
+        paths = ["/tmp/{}".format(i) for i in range(20000)]
+        res = {"permissions": (p for p in paths)}
+        chunks = list(store_results.iter_compressed(res))
+
+        assert len(chunks) > 1
+        text = gzip.GzipFile(fileobj=BytesIO(b''.join(chunks))).read()
+        assert json.loads(text.decode('utf-8')) == {"permissions": paths}
+
+    def test_spooled_results_rewound(self):
+        f = store_results.spooled_results({"a": [1, 2]})
+        try:
+            text = gzip.GzipFile(fileobj=f, mode="rb").read().decode('utf-8')
+        finally:
+            f.close()
+        assert json.loads(text) == {"a": [1, 2]}
+
+    def test_optional_codecs(self):
+        assert 'gzip' in store_results.available_codecs()
+        for codec in store_results.available_codecs():
+            assert store_results.compress_results({"a": 1}, codec)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(Exception):
+            store_results.compress_results({"a": 1}, 'brotli')
+
+    def test_s3_codec_falls_back_to_gzip(self):
+        for codec in ('brotli', 'zstd', 'lz4'):
+            if codec in store_results.available_codecs():
+                continue
+            os.environ['PROFILER_COMPRESSION'] = codec
+            os.environ['PROFILER_COMPRESSION_LEVEL'] = '19'
+            try:
+                assert store_results.s3_codec() == ('gzip', None)
+            finally:
+                del os.environ['PROFILER_COMPRESSION']
+                del os.environ['PROFILER_COMPRESSION_LEVEL']
+
+    def test_bad_level_doesnt_raise(self):
+        os.environ['observatory-results-bucket'] = 'results'
+        os.environ['PROFILER_COMPRESSION_LEVEL'] = '99'
+        try:
+            assert store_results.store_results_s3({"a": 1}) is None
+        finally:
+            del os.environ['observatory-results-bucket']
+            del os.environ['PROFILER_COMPRESSION_LEVEL']
@@ -0,0 +1,180 @@
+import gzip
+import json
+import os
+import threading
+import time
+import unittest
+from io import BytesIO
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import store_results
+import transport
+
+
+class StandIn(HTTPServer):
+
+    """Local observatory stand-in; replies with the queued statuses."""
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.statuses = []
+        self.delay = 0
+        self.bodies = []
+        self.clients = set()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        server.clients.add(self.client_address)
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.GzipFile(fileobj=BytesIO(body)).read()
+        server.bodies.append(body)
+        time.sleep(server.delay)
+
+        status = server.statuses.pop(0) if server.statuses else 200
+        reply = b'{"ok": true}'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+class TransportTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StandIn()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}/api/profile'.format(self.server.server_port)
+
+    def tearDown(self):
+        transport.clear_transports()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_kept_alive(self):
+        t = transport.HTTPTransport(self.url)
+        for _ in range(3):
+            assert t.post(b'{}') == b'{"ok": true}'
+
+        assert t.requests == 3
+        assert t.connections == 1
+        assert len(self.server.clients) == 1
+
+    def test_retries_server_errors(self):
+        self.server.statuses = [503, 500]
+        t = transport.HTTPTransport(self.url, retries=2)
+
+        assert t.post(b'{}') == b'{"ok": true}'
+        assert len(self.server.bodies) == 3
+
+    def test_client_errors_not_retried(self):
+        self.server.statuses = [403]
+        t = transport.HTTPTransport(self.url, retries=2)
+
+        with self.assertRaises(transport.TransportError):
+            t.post(b'{}')
+        assert len(self.server.bodies) == 1
+
+    def test_read_timeout(self):
+        self.server.delay = 0.5
+        t = transport.HTTPTransport(self.url, read_timeout=0.1, retries=0)
+
+        start = time.time()
+        with self.assertRaises(transport.TransportError):
+            t.post(b'{}')
+        assert time.time() - start < 0.45
+
+    def test_breaker_short_circuits(self):
+        self.server.statuses = [500] * 10
+        breaker = transport.CircuitBreaker(threshold=2, reset=60)
+        t = transport.HTTPTransport(self.url, retries=0, breaker=breaker)
+
+        for _ in range(2):
+            with self.assertRaises(transport.TransportError):
+                t.post(b'{}')
+        assert breaker.state == 'open'
+        with self.assertRaises(transport.CircuitOpen):
+            t.post(b'{}')
+        assert len(self.server.bodies) == 2
+
+        breaker.opened_at -= 60
+        assert breaker.state == 'half open'
+        self.server.statuses = []
+        t.post(b'{}')
+        assert breaker.state == 'closed'
+
+    def test_store_results_posts_gzip(self):
+        os.environ['observatory_api_key'] = 'key'
+        os.environ['observatory_api_url'] = self.url
+        try:
+            response = store_results.store_results(
+                {"permissions": (p for p in ["/tmp"]), "uname": "Linux"})
+        finally:
+            del os.environ['observatory_api_key']
+            del os.environ['observatory_api_url']
+
+        assert response == b'{"ok": true}'
+        assert json.loads(self.server.bodies[0].decode('utf-8')) == {
+            "permissions": ["/tmp"], "uname": "Linux"}
+
+    def test_read_timeout_not_resent(self):
+        t = transport.HTTPTransport(self.url, read_timeout=0.2, retries=0)
+        t.post(b'{}')
+        self.server.delay = 0.5
+
+        ## A timeout on a reused connection is not a dropped keep-alive.
+        with self.assertRaises(transport.TransportError):
+            t.post(b'{}')
+        assert len(self.server.bodies) == 2
+
+    def test_dropped_keep_alive_resent(self):
+        t = transport.HTTPTransport(self.url, retries=0)
+        t.post(b'{}')
+        t._conn.sock.close()
+        t._conn.sock = self.dead_socket()
+
+        assert t.post(b'{}') == b'{"ok": true}'
+        assert t.connections == 2
+
+    def dead_socket(self):
+        import socket
+        sock = socket.create_connection(('127.0.0.1', self.server.server_port))
+        sock.shutdown(socket.SHUT_RDWR)
+        return sock
+
+    def test_deadline(self):
+        self.server.delay = 0.3
+        t = transport.HTTPTransport(self.url, read_timeout=1.0, retries=5)
+
+        start = time.time()
+        try:
+            with self.assertRaises(transport.DeadlineExceeded):
+                t.post(b'{}', deadline=time.time() + 0.15)
+        finally:
+            t.close()
+        assert time.time() - start < 0.3
+        ## Our own deadline running out isn't held against the API.
+        assert t.breaker.failures == 0
+
+    def test_invocation_deadline(self):
+        t = transport.HTTPTransport(self.url)
+        transport.set_deadline(time.time() - 1)
+        try:
+            with self.assertRaises(transport.DeadlineExceeded):
+                t.post(b'{}')
+        finally:
+            transport.set_deadline(None)
+        assert self.server.bodies == []
+        assert t.breaker.failures == 0
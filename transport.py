@@ -0,0 +1,268 @@
+"""
+Keep-alive HTTP transport for posting results to the observatory API.
+
+One connection per endpoint is kept at module level, so warm invocations
+reuse the TCP (and TLS) session instead of paying a handshake each time.
+Every request has a connect and a read timeout and is retried a bounded
+number of times with jittered exponential backoff. A circuit breaker
+shared by all requests to the endpoint stops us from spending the lambda
+budget on an API that is down; while it is open posts fail immediately
+and store_results goes straight to S3.
+
+A read timeout is a failed attempt like any other. Only a reused
+connection the server has closed (BadStatusLine, reset, broken pipe) is
+reopened and the request resent without using up a retry. No attempt
+runs past the deadline the handler sets from the time the invocation
+has left, so the S3 fallback still gets its turn.
+"""
+import errno
+import random
+import socket
+import threading
+import time
+from os import getenv
+
+try:
+    import httplib
+    from urlparse import urlsplit
+except ImportError:
+    import http.client as httplib
+    from urllib.parse import urlsplit
+
+## Timeouts in seconds; the whole function has 3.
+CONNECT_TIMEOUT = 0.5
+READ_TIMEOUT = 1.0
+RETRIES = 2
+BACKOFF_BASE = 0.05
+BACKOFF_CAP = 0.5
+
+## Consecutive failed posts before the breaker opens, and how long it
+## stays open before a single trial request is let through.
+FAILURE_THRESHOLD = 3
+RESET_SECONDS = 30.0
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+## When the current invocation has to be done posting, see set_deadline.
+_deadline = {}
+
+
+class TransportError(Exception):
+    pass
+
+
+class CircuitOpen(TransportError):
+    pass
+
+
+class DeadlineExceeded(TransportError):
+    pass
+
+
+class CircuitBreaker(object):
+
+    """closed -> open after `threshold` failures -> half open after `reset`."""
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, reset=RESET_SECONDS):
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.time() - self.opened_at >= self.reset:
+            return 'half open'
+        return 'open'
+
+    def allow(self):
+        return self.state != 'open'
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold or self.opened_at is not None:
+                ## A failed trial in half open re-opens for another period.
+                self.opened_at = time.time()
+
+
+def backoff(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Full jitter: uniform in [0, min(cap, base * 2 ** attempt)]."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _retryable_status(status):
+    return status == 429 or status >= 500
+
+
+def _stale_connection(e):
+    """Whether `e` means a reused keep-alive connection had been closed
+    by the server, rather than a timeout or a failure of the request.
+    """
+    if isinstance(e, (httplib.BadStatusLine, getattr(httplib, 'RemoteDisconnected', ()))):
+        return True
+    if isinstance(e, socket.timeout):
+        return False
+    return getattr(e, 'errno', None) in (errno.ECONNRESET, errno.EPIPE)
+
+
+class HTTPTransport(object):
+
+    """POSTs to one URL over a persistent connection."""
+
+    def __init__(self, url, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, retries=RETRIES, breaker=None):
+        parts = urlsplit(url)
+        self.url = url
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path += '?' + parts.query
+
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.breaker = breaker or CircuitBreaker()
+
+        self.connections = 0
+        self.requests = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self, timeout):
+        if self.scheme == 'https':
+            conn = httplib.HTTPSConnection(self.host, self.port,
+                                           timeout=min(self.connect_timeout, timeout))
+        else:
+            conn = httplib.HTTPConnection(self.host, self.port,
+                                          timeout=min(self.connect_timeout, timeout))
+        conn.connect()
+        self.connections += 1
+        return conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _send(self, body, headers, deadline):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise DeadlineExceeded('deadline exceeded')
+        if self._conn is None:
+            self._conn = self._connect(remaining)
+            remaining = deadline - time.time()
+        self._conn.sock.settimeout(max(min(self.read_timeout, remaining), 0.001))
+        self._conn.request('POST', self.path, body, headers)
+        response = self._conn.getresponse()
+        return response, response.read()
+
+    def _request(self, body, headers, deadline):
+        reused = self._conn is not None
+        try:
+            response, data = self._send(body, headers, deadline)
+        except (httplib.HTTPException, socket.error) as e:
+            self.close()
+            if not reused or not _stale_connection(e):
+                raise
+            ## The server dropped the idle keep-alive connection before
+            ## reading the request; that doesn't count against the retries.
+            response, data = self._send(body, headers, deadline)
+
+        if response.will_close:
+            self.close()
+        self.requests += 1
+        return response.status, data
+
+    def post(self, body, headers=None, deadline=None):
+        """POST `body`, returning the response body of a 2xx.
+
+        No attempt, backoff or timeout runs past `deadline` (a time.time()
+        value; by default the invocation deadline, see set_deadline).
+        Raises CircuitOpen without touching the network while the breaker
+        is open, TransportError once the retries or the time are used up.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpen(self.url)
+        if deadline is None:
+            deadline = _deadline.get('deadline') or float('inf')
+
+        headers = dict(headers or {})
+        error = None
+        failed = False
+        with self._lock:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    pause = backoff(attempt - 1)
+                    if time.time() + pause >= deadline:
+                        break
+                    time.sleep(pause)
+                try:
+                    status, data = self._request(body, headers, deadline)
+                except DeadlineExceeded as e:
+                    error = e
+                    break
+                except (httplib.HTTPException, socket.error) as e:
+                    self.close()
+                    if time.time() >= deadline:
+                        ## Cut short by our deadline, not the API's fault.
+                        error = DeadlineExceeded('{}: {}'.format(type(e).__name__, e))
+                        break
+                    failed = True
+                    error = TransportError('{}: {}'.format(type(e).__name__, e))
+                    continue
+
+                if 200 <= status < 300:
+                    self.breaker.record_success()
+                    return data
+                failed = True
+                error = TransportError('HTTP {}'.format(status))
+                if not _retryable_status(status):
+                    break
+
+        ## Running out of invocation time says nothing about the API's
+        ## health; only real failures count towards opening the breaker.
+        if failed:
+            self.breaker.record_failure()
+        raise error or DeadlineExceeded('deadline exceeded')
+
+
+def get_transport(url):
+    """The module level transport for `url`, kept across warm invocations.
+
+    Timeouts and retries come from PROFILER_HTTP_CONNECT_TIMEOUT,
+    PROFILER_HTTP_READ_TIMEOUT and PROFILER_HTTP_RETRIES.
+    """
+    with _transports_lock:
+        if url not in _transports:
+            _transports[url] = HTTPTransport(
+                url,
+                connect_timeout=float(getenv('PROFILER_HTTP_CONNECT_TIMEOUT', CONNECT_TIMEOUT)),
+                read_timeout=float(getenv('PROFILER_HTTP_READ_TIMEOUT', READ_TIMEOUT)),
+                retries=int(getenv('PROFILER_HTTP_RETRIES', RETRIES)))
+        return _transports[url]
+
+
+def set_deadline(deadline):
+    """Bound every post of this invocation by `deadline` (a time.time()
+    value), or lift the bound with None.
+    """
+    _deadline['deadline'] = deadline
+
+
+def clear_transports():
+    with _transports_lock:
+        for transport in _transports.values():
+            transport.close()
+        _transports.clear()